@@ -1,188 +1,418 @@
 #! /usr/bin/env python3
 # This file has the user interface code
 
-import board
-import RPi.GPIO as GPIO
-import os
+import contextlib
+import queue
 import threading
 import time
-from adafruit_seesaw.seesaw import Seesaw 
-from adafruit_seesaw.analoginput import AnalogInput
-from adafruit_seesaw import neopixel
 
-import pygame 
-
-from art import ArtproofDrawing, intialize_pygame
-import stream
+from perf import FrameProfiler, RateCounter, StartupTimer
+startup = StartupTimer() # how long booting takes, see --startup-report
+
+# the hardware libraries (board, RPi.GPIO, adafruit_seesaw) are imported by the
+# initialize_* functions, so this module can be imported off the pi
+with startup.step("import pygame"):
+    import pygame 
+with startup.step("import art"):
+    from art import intialize_pygame
+with startup.step("import export"):
+    import export
+with startup.step("import stream"):
+    import stream
+import machine
+from artcache import ArtifactCache
+from leds import PixelWriter
+from plotqueue import PlotQueue, PlotTooLong
+from preview import PreviewRenderer
+from sampler import PotSampler
+
+GPIO = None # RPi.GPIO (or mockgpio), once initialize_GPIO has run
+
+STATUS_INTERVAL = 0.25 # seconds between grbl status queries while plotting
+
+def plot_thread(plotter_port, plot_queue):
+    '''
+    Streams queued jobs to the plotter, one at a time, in the order they were submitted.
+    Progress and machine state go back through the queue for the UI to show.
 
-plot_lock = threading.Lock()
-plotfile = None
-def plot_thread(plotter_port):
-    global plotfile, plot_lock
+    Args:
+        plotter_port: serial device of the plotter, or None to fake plotting with a delay
+        plot_queue: the PlotQueue shared with the UI
+    '''
     if plotter_port:
         plot = stream.open_port_and_home(plotter_port, verbose=False)
     while True:
-        plot_lock.acquire()
-        f = plotfile
-        plot_lock.release()
-        if f:
+        job = plot_queue.get() # sleeps until there is something to plot
+        if job is None: # queue closed
+            return
+        on_progress = lambda progress, job=job: plot_queue.update_progress(job, progress)
+        try:
             if plotter_port:
-                stream.stream_gcode(plot, open(f), verbose=False)
+                with open(job.fname) as f:
+                    stream.stream_gcode(plot, f, verbose=False, status_interval=STATUS_INTERVAL, on_progress=on_progress)
             else:
                 #fake serial sending by just sleeping
-                time.sleep(20)
-            plot_lock.acquire()
-            plotfile = None
-            plot_lock.release()
+                for i in range(1, 21):
+                    time.sleep(1)
+                    on_progress(stream.StreamProgress(i, i, 20, i/20, i, 20 - i, "Run", None, None, None))
+        except Exception as e:
+            print("Plotting %s failed: %r" % (job.name, e))
+            plot_queue.finish(job, error=e)
         else:
-            time.sleep(0.1)
+            plot_queue.finish(job)
 
-def initialize_GPIO(btnL_pin, btnR_pin):
+def initialize_GPIO(btnL_pin, btnR_pin, mock=False):
+    '''
+    Sets up the button pins (with mock, on mockgpio instead of the real pins)
+    '''
+    global GPIO
+    if mock:
+        import mockgpio as GPIO
+    else:
+        import RPi.GPIO as GPIO
     GPIO.setwarnings(False) # Ignore warning for now
     #GPIO.setmode(GPIO.BOARD) # Use physical pin numbering
     GPIO.setup(btnR_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN) # Set pin 10 to be an input pin and set initial value to be pulled low (off)
     GPIO.setup(btnL_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN) # Set pin 10 to be an input pin and set initial value to be pulled low (off)
 
-def initialize_pots(addresses):
+def initialize_pots(addresses, mock=False):
     '''
-    This sets up the potentiometers
+    This sets up the potentiometers (with mock, mockgpio.Pots instead of the I2C ones)
     '''
+    if mock:
+        import mockgpio
+        return [None]*len(addresses), [mockgpio.Pot() for _ in addresses]
+    import board
+    from adafruit_seesaw.seesaw import Seesaw
+    from adafruit_seesaw.analoginput import AnalogInput
 
     i2c = board.I2C()
     sliders = [Seesaw(i2c, addr) for addr in addresses]
 
     return sliders, [AnalogInput(slider, 18) for slider in sliders]
 
-def initialize_pixels(pots): 
+def initialize_pixels(pots, mock=False): 
     '''
-    This sets up the LEDs
+    This sets up the LEDs (with mock, mockgpio.Pixels that only remember their colour)
     '''
+    if mock:
+        import mockgpio
+        return [mockgpio.Pixels() for _ in pots]
+    from adafruit_seesaw import neopixel
     return [neopixel.NeoPixel(pot, 14, 4, pixel_order=neopixel.RGB) for pot in pots]
 
 def potentiometer_to_color(value): 
     return value/1023 * 255
 
-def main(pots, screen, pixels, drawing, btnL_pin, btnR_pin, seedstart=0):
-    global plotfile, plot_lock
+def pot_colors(values):
+    '''
+    The LED colour for each pot value
+    '''
+    return [(0, 0, min(255, max(potentiometer_to_color(value), 0))) for value in values]
+
+def draw_perf_overlay(screen, rect, font, profiler, background, bus=None):
+    '''
+    Draws the rolling stage timings into rect (one line per stage, slowest first),
+    after the I2C traffic per second if a bus RateCounter is given
+
+    Returns rect, for pygame.display.update
     '''
-    This what runs the event loop
+    screen.fill(background, rect)
+    summary = profiler.summary()
+    frame = summary.pop("frame", None)
+    lines = []
+    if frame:
+        fps = 1000/frame["mean"] if frame["mean"] else 0
+        lines.append("frame  p50 %6.1f  p95 %6.1f  max %6.1f ms  %.1f fps" % (frame["p50"], frame["p95"], frame["max"], fps))
+    if bus is not None:
+        lines.append("i2c    " + "  ".join("%s %.0f/s" % item for item in sorted(bus.rates().items())))
+    for name, s in sorted(summary.items(), key=lambda item: -item[1]["p95"]):
+        lines.append("%-8s p50 %6.1f  p95 %6.1f  max %6.1f ms" % (name, s["p50"], s["p95"], s["max"]))
+    y = rect.top + 4
+    for line in lines:
+        text = font.render(line, True, (80, 80, 80), background)
+        if y + text.get_height() > rect.bottom:
+            break
+        screen.blit(text, (rect.left + 8, y))
+        y += text.get_height() + 2
+    return rect
+
+def main(pots, screen, pixels, preview, btnL_pin, btnR_pin, plot_queue, seedstart=0, profiler=None, show_perf=False, startup=None):
+    '''
+    This what runs the event loop. It sleeps until something happens: a button
+    press (GPIO edge), a pot moving, an export or plot job changing, or a key.
+    While a frame is rendering or an export is running it also wakes up now and
+    then to pick those up; otherwise it only wakes every IDLE_WAIT seconds.
 
     Args:
         pots: a list of AnalogInput objects (potentiometers)
         screen: the pygame screen object
         pixels: a list of NeoPixel objects (LEDs)
-        drawing: the art object
+        preview: the PreviewRenderer generating and rasterizing the art in its own process
         btnL_pin: the input pin for save button
         btnR_pinL the input pin for print button
+        plot_queue: the PlotQueue the plot thread is working through
+        profiler: a FrameProfiler for the loop timings (a disabled one is made if None)
+        show_perf: start with the timing overlay showing (toggle with the P key)
+        startup: a StartupTimer to finish and print once the first frame is up (None for no report)
     '''
 
     BACKGROUND_COLOR = pygame.Color('white')
-    FPS = 5
+    PREVIEW_POLL = 0.02 # seconds between checks for a finished frame while one is rendering
+    EXPORT_REFRESH = 0.25 # seconds between export progress redraws
+    IDLE_WAIT = 1.0 # longest the loop sleeps when nothing happens
+    BUTTON_BOUNCE_MS = 200 # edges closer together than this are the contacts bouncing
+    MOCK_POT_STEP = 32 # counts an up / down key turns a mock pot
+    STATUS_BAND = pygame.Rect(0, 880, 600, 40) # area the status text is drawn into
+    POT_SAMPLE_RATE = 50 # pot polls per second, on the sampler thread
+    POT_SMOOTHING = 0.5 # weight of a new reading in the moving average
+    POT_THRESHOLD = 4 # counts a pot has to move before the art regenerates
+    EXPORT_BAND = pygame.Rect(0, 930, 600, 40) # area the export progress is drawn into
+    EXPORT_WORKERS = 4 # export processes, one per core on the pi
+    ARTIFACT_CACHE_BYTES = 200*1024*1024 # disk the cached exports may take
+    LED_WRITES_PER_SLOT = 2 # LED devices written between two pot polls
+    PERF_BAND = pygame.Rect(0, 610, 600, 260) # unused area under the art, for the timing overlay
+    PERF_REFRESH = 1.0 # seconds between overlay redraws
+
+    # timings are only collected while the overlay is up or they are being logged
+    if profiler is None:
+        profiler = FrameProfiler(enabled=show_perf)
+    logging_perf = profiler.log_file is not None
+    profiler.enabled = show_perf or logging_perf
+    perf_font = pygame.font.Font('freesansbold.ttf', 16)
+    perf_shown_at = 0.0
 
     seed = seedstart
-
-    curr_values = [pot.value for pot in pots]
-    last_printed_values = curr_values
-    drawing.update(curr_values)
-
-    clock = pygame.time.Clock()
+    step = startup.step if startup is not None else lambda name: contextlib.nullcontext()
+
+    # other threads wake the loop up by posting to the pygame event queue (safe from any thread)
+    BUTTON_EVENT = pygame.event.custom_type() # a button was pressed, .pin says which
+    WAKE_EVENT = pygame.event.custom_type() # pots moved, an export finished or the plot queue changed
+    wake = lambda *args: pygame.event.post(pygame.event.Event(WAKE_EVENT))
+    on_press = lambda pin: pygame.event.post(pygame.event.Event(BUTTON_EVENT, pin=pin))
+    for pin in (btnL_pin, btnR_pin):
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=on_press, bouncetime=BUTTON_BOUNCE_MS)
+    # off the pi the keyboard stands in for the hardware: left / right push the buttons (through
+    # mockgpio's edge detection and debouncing), 1-9 and 0 pick a pot, up / down turn it
+    mocked = GPIO.__name__ == "mockgpio"
+    button_keys = {pygame.K_LEFT: btnL_pin, pygame.K_RIGHT: btnR_pin} if mocked else {}
+    pot_keys = {getattr(pygame, "K_%d" % ((i + 1) % 10)): i for i in range(min(len(pots), 10))} if mocked else {}
+    turn_keys = {pygame.K_UP: MOCK_POT_STEP, pygame.K_DOWN: -MOCK_POT_STEP} if mocked and all(hasattr(pot, "turn") for pot in pots) else {}
+    selected_pot = 0
+    if turn_keys:
+        pygame.key.set_repeat(250, 30) # holding a key sweeps the pot
+    plot_queue.on_change = wake
+
+    # the pots are read over I2C on their own thread, the loop only looks at the latest snapshot;
+    # the LEDs share the bus, so the same thread writes the ones that changed between pot polls
+    bus = RateCounter()
+    leds = PixelWriter(pixels, writes_per_slot=LED_WRITES_PER_SLOT, bus=bus)
+    with step("first pot read"):
+        sampler = PotSampler(pots, rate=POT_SAMPLE_RATE, smoothing=POT_SMOOTHING, hysteresis=POT_THRESHOLD, profiler=profiler,
+                             on_change=wake, after_sample=leds.flush, bus=bus)
+        curr_version, values = sampler.snapshot()
+        leds.show_all(pot_colors(values))
+        sampler.start()
+    last_printed_values = values
+    # the loop only ever blits the newest finished frame, it never waits for one
+    preview.request(values)
 
     current_state = "DRAWING" # can be DRAWING or MESSAGE
 
     font = pygame.font.Font('freesansbold.ttf', 32)
 
-    while True:
-        plot_lock.acquire()
-        plot_busy = (plotfile != None)
-        plot_name = plotfile
-        plot_lock.release()
-
-        screen.fill(BACKGROUND_COLOR)
+    # exports run in worker processes; finished print jobs are handed to the serial thread
+    with step("export pool"):
+        # a drawing exported before (reprints, saving then printing) comes straight out of the cache
+        exports = export.ExportPool(preview.dimensions, workers=EXPORT_WORKERS, cache=ArtifactCache(max_bytes=ARTIFACT_CACHE_BYTES), on_done=wake)
+    print_exports = 0 # print exports in flight, they already count against the plot backlog
+    last_print = None # the PlotJob of the most recent print, to show its place in line
+    too_long = None # name of the last print turned down for taking longer than the plot queue allows
+
+    # only the parts of the screen that changed get repainted; these track what is currently shown
+    screen.fill(BACKGROUND_COLOR)
+    pygame.display.flip()
+    shown_status = None
+    shown_exports = None
+    shown_version = 0 # preview.version of the frame on screen (0: none yet)
 
-        if plot_busy:
-            #text = font.render("Saved for printing! Number:{seed}".format(seed=seed), True, (0, 0, 0), (255, 255, 255))
-            text = font.render("BUSY Plotting: %s"%(plot_name), True, (0, 0, 0), (128, 128, 0))
+    while True:
+        #WAIT for something to happen
+        if preview.busy:
+            timeout = PREVIEW_POLL
+        elif exports.active():
+            timeout = EXPORT_REFRESH
+        elif show_perf:
+            timeout = PERF_REFRESH
         else:
-            text = font.render("Ready!", True, (255, 255, 255), (0, 128, 0))
-        textRect = text.get_rect()
-        textRect.center = (300,900)
-        screen.blit(text, textRect)
+            timeout = IDLE_WAIT
+        with profiler.stage("wait"):
+            events = [pygame.event.wait(int(timeout*1000))] + pygame.event.get()
+
+        pressed = [] # button pins, in the order they were pressed
+        for event in events:
+            if event.type == BUTTON_EVENT:
+                pressed.append(event.pin)
+            elif event.type == pygame.KEYDOWN and event.key in button_keys:
+                GPIO.press(button_keys[event.key]) # its edge callback posts a BUTTON_EVENT
+            elif event.type == pygame.KEYDOWN and event.key in pot_keys:
+                selected_pot = pot_keys[event.key]
+            elif event.type == pygame.KEYDOWN and event.key in turn_keys:
+                pots[selected_pot].turn(turn_keys[event.key]) # the sampler picks it up like a real pot
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_p: # toggle the timing overlay
+                show_perf = not show_perf
+                profiler.enabled = show_perf or logging_perf
+                perf_shown_at = 0.0
+                if not show_perf:
+                    screen.fill(BACKGROUND_COLOR, PERF_BAND)
+                    pygame.display.update(PERF_BAND)
+            elif event.type == pygame.QUIT:
+                for pin in (btnL_pin, btnR_pin):
+                    GPIO.remove_event_detect(pin)
+                plot_queue.on_change = None
+                sampler.stop()
+                preview.close()
+                exports.shutdown()
+                profiler.close()
+                pygame.quit()
+                return
 
-        #READ INPUTS
-        values = [pot.value for pot in pots]
-        if values != curr_values:
-            drawing.update(values, seed)
-            curr_values = values
+        with profiler.stage("status"):
+            #COLLECT FINISHED EXPORTS
+            for job in exports.poll():
+                if job.kind == "print":
+                    print_exports -= 1
+                    if job.status == "done":
+                        #hand the new gcode to the serial thread
+                        try:
+                            last_print = plot_queue.submit(job.fname_gcode, job.name, estimate=job.estimate)
+                        except queue.Full:
+                            print("Plot queue full, %s was saved but not queued" % job.name)
+                        except PlotTooLong as e:
+                            print("%s, it was saved but not queued" % e)
+                            too_long = job.name
+                if job.status == "done" and job.stats:
+                    print("Exported %s%s: %.0fmm drawn, %.0fmm travel, %.0fmm of retraced lines left out" % (
+                        job.name, " (cached)" if job.cached else "", job.stats["after"].pen_down, job.stats["after"].pen_up, job.stats.get("removed_mm", 0.0)))
+                if job.status == "failed":
+                    print("Export of %s failed: %r" % (job.name, job.error))
+
+            plotting, waiting = plot_queue.snapshot()
+
+            dirty = []
+
+            progress = plotting.progress if plotting else None
+            percent = int(progress.fraction*100) if progress else None
+            eta = plot_queue.time_left(plotting) if plotting else None # streaming progress, or the estimate before it starts
+            eta = int(eta) if eta is not None else None
+            status = (plotting, len(waiting), percent, eta)
+            if status != shown_status:
+                if plotting:
+                    #text = font.render("Saved for printing! Number:{seed}".format(seed=seed), True, (0, 0, 0), (255, 255, 255))
+                    line = " (+%d in line)" % len(waiting) if waiting else ""
+                    done = " %d%%" % percent if progress else ""
+                    left = " ~%d:%02d left" % divmod(eta, 60) if eta is not None else ""
+                    text = font.render("Plotting: %s%s%s%s"%(plotting.name, done, left, line), True, (0, 0, 0), (128, 128, 0))
+                else:
+                    text = font.render("Ready!", True, (255, 255, 255), (0, 128, 0))
+                textRect = text.get_rect()
+                textRect.center = (300,900)
+                screen.fill(BACKGROUND_COLOR, STATUS_BAND)
+                screen.blit(text, textRect)
+                dirty.append(STATUS_BAND.union(textRect))
+                shown_status = status
+
+            active = exports.active()
+            place = plot_queue.position(last_print) if last_print else None
+            wait = plot_queue.time_left(last_print) if place else None
+            wait = -int(-wait//60) if wait is not None else None # whole minutes, so the band isn't redrawn every second
+            export_status = (tuple((job.name, job.kind, int(job.progress*100)) for job in active), place, wait, too_long)
+            if export_status != shown_exports:
+                screen.fill(BACKGROUND_COLOR, EXPORT_BAND)
+                text = None
+                if active:
+                    job = active[0]
+                    label = "Processing" if job.kind == "print" else "Saving"
+                    more = " (+%d)" % (len(active) - 1) if len(active) > 1 else ""
+                    text = font.render("%s: %s %d%%%s" % (label, job.name, int(job.progress*100), more), True, (0, 0, 0), (128, 128, 0))
+                elif place: # the visitor's drawing is waiting for the plotter
+                    done_in = ", done in ~%d min" % wait if wait is not None else ""
+                    text = font.render("%s is #%d in line%s" % (last_print.name, place, done_in), True, (0, 0, 0), (128, 128, 0))
+                elif too_long:
+                    text = font.render("%s is too big to plot, try again!" % too_long, True, (0, 0, 0), (128, 128, 0))
+                if text:
+                    textRect = text.get_rect()
+                    textRect.center = EXPORT_BAND.center
+                    screen.blit(text, textRect)
+                    dirty.append(EXPORT_BAND.union(textRect))
+                else:
+                    dirty.append(EXPORT_BAND)
+                shown_exports = export_status
+
+        #READ INPUTS (the version only moves when a pot moved past the threshold)
+        with profiler.stage("pots"):
+            version, values = sampler.snapshot()
+        if version != curr_version:
+            preview.request(values, seed)
+            # UPDATE LEDS (only the ones whose colour changed get written, by the sampler thread)
+            with profiler.stage("leds"):
+                leds.show_all(pot_colors(values))
+            curr_version = version
 
         #TODO show input hash
 
-        #GENERATE ART
-        drawing.draw()
-        pygame.display.flip()
-        
-        if (not plot_busy) and GPIO.input(btnR_pin) == GPIO.HIGH: #PRINTING
+        #SHOW ART (whatever frame the preview process finished last; a slow one leaves the old frame up)
+        with profiler.stage("preview"):
+            preview.poll()
+        if preview.version != shown_version:
+            profiler.record("update", preview.update_seconds)
+            profiler.record("draw", preview.render_seconds)
+            with profiler.stage("blit"):
+                dirty.append(preview.draw(screen))
+            shown_version = preview.version
+
+        #TIMING OVERLAY
+        if show_perf and time.monotonic() - perf_shown_at >= PERF_REFRESH:
+            with profiler.stage("overlay"):
+                dirty.append(draw_perf_overlay(screen, PERF_BAND, perf_font, profiler, BACKGROUND_COLOR, bus))
+            perf_shown_at = time.monotonic()
+
+        if dirty:
+            with profiler.stage("display"):
+                pygame.display.update(dirty)
+
+        if startup is not None and shown_version: # the first frame with the art is up
+            startup.finish()
+            print(startup.report())
+            startup = None
+
+        # buttons act on the (debounced) press edge, holding one down does nothing more
+        btnR_down = btnR_pin in pressed
+        btnL_down = btnL_pin in pressed
+
+        # prints are accepted while plotting, as long as there is room in the backlog
+        # nothing can be exported before the first frame is up
+        if btnR_down and preview.cache_key and plot_queue.depth() + print_exports < plot_queue.maxsize: #PRINTING
             fname = "drawing_{seed}".format(seed=seed)
-            fname_svg = fname+".svg"
-            fname_gcode = fname+".gcode"
-
-            #put up processing message
-            screen.fill((120,128,0))
-            text = font.render("Processing: %s..."%(fname), True, (0, 0, 0), (128, 128, 0))
-            textRect = text.get_rect()
-            textRect.center = (300,512)
-            screen.blit(text, textRect)
-            pygame.display.flip()
-
-            #block while generating GCODE
-            drawing.to_svg(fname_svg)
-            os.system("vpype read {filename} scaleto 4.5in 4.5in layout -m .5in -v top 5.5x7in linesimplify -t 0.05mm write {filename}".format(filename=fname_svg)) #format the created svg to a 5x7 layout
-            os.system("vpype read party_signature.svg scaleto 4.05in 1.05in layout -h center -v bottom 5.5x6.5in read {filename} write {filename}".format(filename=fname_svg)) #add the signature svg
-            os.system("vpype -c test_party_config.cfg read {svg} linemerge linesort gwrite -p test_party_config {gcode}".format(svg=fname_svg, gcode=fname_gcode)) #create gcode from merged file
-
-            #signal to serial thread new gcode is available
-            plot_lock.acquire()
-            plotfile = fname_gcode
-            plot_lock.release()
+            # export exactly what is on screen: the values and seed the frame was generated from
+            drawn_values, drawn_seed = preview.cache_key
+            exports.submit(fname, drawn_values, drawn_seed, kind="print")
+            print_exports += 1
+            too_long = None
 
             seed += 1
             last_printed_values = values
 
-        #SAVE BUTTON - essentially the same as GENERATE ART but can be done while busy as well and does not signal to serial
-        if GPIO.input(btnL_pin) == GPIO.HIGH: # press again to go back
+        #SAVE BUTTON - essentially the same as PRINTING but can be done while busy as well and does not signal to serial
+        if btnL_down and preview.cache_key:
             fname = "drawing_{seed}".format(seed=seed)
-            fname_svg = fname+".svg"
-            fname_gcode = fname+".gcode"
-
-            #put up saving message
-            screen.fill((120,128,0))
-            text = font.render("Saving: %s..."%(fname), True, (0, 0, 0), (128, 128, 0))
-            textRect = text.get_rect()
-            textRect.center = (300,512)
-            screen.blit(text, textRect)
-            pygame.display.flip()
-
-            #block while generating SVG (and gcode as a time delay for legibility
-            drawing.to_svg(fname_svg)
-            os.system("vpype read {filename} scaleto 4.5in 4.5in layout -m .5in -v top 5.5x7in linesimplify -t 0.05mm write {filename}".format(filename=fname_svg)) #format the created svg to a 5x7 layout
-            os.system("vpype read party_signature.svg scaleto 4.05in 1.05in layout -h center -v bottom 5.5x6.5in read {filename} write {filename}".format(filename=fname_svg)) #add the signature svg
-            os.system("vpype -c test_party_config.cfg read {svg} linemerge linesort gwrite -p test_party_config {gcode}".format(svg=fname_svg, gcode=fname_gcode)) #create gcode from merged file
+            drawn_values, drawn_seed = preview.cache_key
+            exports.submit(fname, drawn_values, drawn_seed, kind="save")
  
             seed += 1
             last_printed_values = values
 
-        # UPDATE LEDS
-        for i, pixel in enumerate(pixels):
-            pixel.fill(
-                (0, 0, min(255, max(potentiometer_to_color(values[i]), 0)))
-                )
-
-        #UPDATE SCREEN
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return
-        
-        clock.tick(FPS)
+        profiler.end_frame()
 
 
 if __name__ == "__main__":
@@ -192,6 +422,10 @@ if __name__ == "__main__":
     parser.add_argument('-n', '--no-plotter', default=False, action="store_true", dest="noplotter", help="don't actually talk to Pl0tb0t, just fake plotting with a timeer")
     parser.add_argument('-p', '--port', default='/dev/ttyUSB0', action="store", help="use PORT for Pl0tb0t connection", metavar='PORT')
     parser.add_argument('-s', '--seed', default=0, action="store", type=int, help="set seed value start position to avoid file overwrites")
+    parser.add_argument('--perf', default=False, action="store_true", help="show the loop timing overlay (P toggles it)")
+    parser.add_argument('--perf-log', default=None, action="store", dest="perf_log", help="append loop timings to FILE as JSON lines", metavar='FILE')
+    parser.add_argument('--mock-gpio', default=False, action="store_true", dest="mock_gpio", help="use mockgpio instead of the real buttons, pots and LEDs (left / right press the buttons, 1-9 / 0 pick a pot, up / down turn it)")
+    parser.add_argument('--startup-report', default=False, action="store_true", dest="startup_report", help="print how long each import and init step took once the first frame is up")
     args = parser.parse_args()
 
 
@@ -200,17 +434,31 @@ if __name__ == "__main__":
     DRAW_DIMENSIONS = (600,600)
     INPUT1_PIN = 18
     INPUT2_PIN = 17
+    PLOT_BACKLOG = 5 # drawings allowed to wait for the plotter
+    MAX_PLOT_SECONDS = 20*60 # drawings estimated to take longer aren't plotted
 
     # initialization
-    screen = intialize_pygame(SCREEN_DIMENSIONS) #reference to the pygame screen object
-    sliders, pots = initialize_pots(POT_ADDRESSES) # references to the potentiometers
-    pixels = initialize_pixels(sliders) # references to the LEDs
-    initialize_GPIO(INPUT1_PIN, INPUT2_PIN)
+    with startup.step("pygame"):
+        screen = intialize_pygame(SCREEN_DIMENSIONS) #reference to the pygame screen object
+    with startup.step("pots"):
+        sliders, pots = initialize_pots(POT_ADDRESSES, mock=args.mock_gpio) # references to the potentiometers
+    with startup.step("pixels"):
+        pixels = initialize_pixels(sliders, mock=args.mock_gpio) # references to the LEDs
+    with startup.step("GPIO"):
+        initialize_GPIO(INPUT1_PIN, INPUT2_PIN, mock=args.mock_gpio)
     port = args.port if not args.noplotter else None
-    plotter_thread = threading.Thread(target=plot_thread, args=(port,), daemon=True)
+    # the limit goes by plottime's estimate, which is only worth refusing a visitor over with the real settings
+    max_plot_seconds = MAX_PLOT_SECONDS if machine.settings_measured() else None
+    if max_plot_seconds is None:
+        print("Plot time estimates use placeholder grbl settings (see machine.py), not enforcing the %d minute limit" % (MAX_PLOT_SECONDS//60))
+    plot_queue = PlotQueue(maxsize=PLOT_BACKLOG, max_seconds=max_plot_seconds)
+    plotter_thread = threading.Thread(target=plot_thread, args=(port, plot_queue), daemon=True)
     plotter_thread.start()
 
-    drawing = ArtproofDrawing(dimensions=DRAW_DIMENSIONS, values=[pot.value for pot in pots], screen = screen) # the art object
+    # the art is generated in its own process; main() asks for the sampler's first read
+    with startup.step("preview process"):
+        preview = PreviewRenderer(DRAW_DIMENSIONS)
 
     # main loop
-    main(pots=pots, screen=screen, pixels=pixels, drawing=drawing, btnL_pin=INPUT1_PIN, btnR_pin=INPUT2_PIN, seedstart=args.seed)
+    main(pots=pots, screen=screen, pixels=pixels, preview=preview, btnL_pin=INPUT1_PIN, btnR_pin=INPUT2_PIN, plot_queue=plot_queue, seedstart=args.seed,
+         profiler=FrameProfiler(log_file=args.perf_log), show_perf=args.perf, startup=startup if args.startup_report else None)
@@ -1,17 +1,20 @@
 #! /usr/bin/env python3
 # this file generates the art
-import cairo
 import math
-import pygame
-import random
-import svgwrite
 import numpy as np
+from collections import OrderedDict
+
+from paths import Arc, line
+from svgout import SVGWriter
 
 def intialize_pygame(dimensions): 
     '''
     This sets up the pygame window
     '''
-    pygame.init()
+    import pygame
+    # only what the kiosk uses; pygame.init() would also bring up audio and joysticks
+    pygame.display.init()
+    pygame.font.init()
     pygame.display.set_caption("Art Generator")
     screen = pygame.display.set_mode(dimensions)
     #screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
@@ -26,6 +29,13 @@ def rect_coord_from_center_radius(center, radius):
 
     return (center[0] - radius, center[1] - radius, 2*radius, 2*radius)
 
+def pygame_rect(center, radius):
+    '''
+    pygame.Rect bounding the circle (pygame is only imported when this is used)
+    '''
+    import pygame
+    return pygame.Rect(rect_coord_from_center_radius(center, radius))
+
 def xy_from_center_radius_theta(center, radius, theta):
     '''
     Return the xy coordinates of the point on the circle with given center and radius at the given angle
@@ -38,34 +48,270 @@ def xy_from_center_radius_theta(center, radius, theta):
 
     return center[0] + radius * math.cos(-theta), center[1] + radius * math.sin(-theta)
 
-def svg_arc(dwg, position, radius, rad_start, rad_end, color="black"):
-        
-    x0, y0 = position[0] + radius, position[1]
-    x1, y1 = position[0] + radius, position[1]
-    x0 -= (1 - math.cos(-rad_start)) * radius
-    y0 += math.sin(-rad_start) * radius
-    x1 -= (1 - math.cos(-rad_end)) * radius
-    y1 += math.sin(-rad_end) * radius
-
-    args = {'x0': x0,
-            'y0': y0,
-            'x1': x1,
-            'y1': y1,
-            'xradius': radius,
-            'yradius': radius,
-            'ellipseRotation': 0,
-            'sweep': 0,
-            'large': 1 if rad_end - rad_start > math.pi else 0,
-    }
-
-    path = """M %(x0)f,%(y0)f A %(xradius)f,%(yradius)f %(ellipseRotation)f %(large)d,%(sweep)d %(x1)f,%(y1)f""" % args
-
-    arc = dwg.path(d=path, fill="none", stroke=color, stroke_width=3)
-    dwg.add(arc)
-
-    # start/end points, just for reference
-    # dwg.add(dwg.circle((x0, y0), r=2, stroke="green", fill="green"))
-    # dwg.add(dwg.circle((x1, y1), r=2, stroke="red", fill="red"))
+# Record layouts for the array-backed geometry. One row per slice / wedge; the
+# Slice and Wedge classes below are views built from these rows on demand.
+SLICE_DTYPE = np.dtype([
+    ('cx', 'f8'), ('cy', 'f8'),
+    ('start_theta', 'f8'), ('end_theta', 'f8'),
+    ('start_radius', 'f8'), ('end_radius', 'f8'),
+    ('has_fill', '?'), ('fill_factor', 'f8'),
+])
+
+WEDGE_DTYPE = np.dtype([
+    ('cx', 'f8'), ('cy', 'f8'),
+    ('radius', 'f8'),
+    ('start_theta', 'f8'), ('end_theta', 'f8'),
+])
+
+# One row per fill hatch arc, grouped by slice in the order the pen draws them
+HATCH_DTYPE = np.dtype([
+    ('slice', 'i4'),
+    ('radius', 'f8'),
+    ('start_theta', 'f8'), ('end_theta', 'f8'),
+])
+
+MIN_HATCH_SPACING = 2.5 # px between hatch lines at a fill factor of 1
+PREVIEW_TOLERANCE = 0.25 # px, furthest a preview polyline strays from the true arc
+LINE_WIDTH = 3
+
+# The generation stages of ArtproofDrawing.update, in order: which pots each one
+# reads and which earlier stages it builds on. A stage only runs again when one
+# of those changed.
+GENERATION_STAGES = {
+    "layers": ((0, 1, 2, 3, 4), ()), # ring widths, spacing and slices per ring
+    "include": ((5,), ("layers",)), # which slices are drawn
+    "fill": ((4, 6), ("layers",)), # hatch density of each slice
+    "slices": ((), ("layers", "include", "fill")),
+    "wedges": ((7, 8, 9), ()),
+}
+
+def polar_to_xy(cx, cy, radius, theta):
+    '''
+    Vectorized xy_from_center_radius_theta. All arguments may be numpy arrays.
+
+    Returns an array of shape (..., 2)
+    '''
+
+    return np.stack((cx + radius * np.cos(-theta), cy + radius * np.sin(-theta)), axis=-1)
+
+def slice_corners(slices):
+    '''
+    Corner coordinates for an array of slice records.
+
+    Returns an array of shape (n, 4, 2) ordered inner_start, outer_start, inner_end, outer_end
+    '''
+
+    cx, cy = slices['cx'], slices['cy']
+    return np.stack((
+        polar_to_xy(cx, cy, slices['start_radius'], slices['start_theta']),
+        polar_to_xy(cx, cy, slices['end_radius'], slices['start_theta']),
+        polar_to_xy(cx, cy, slices['start_radius'], slices['end_theta']),
+        polar_to_xy(cx, cy, slices['end_radius'], slices['end_theta']),
+    ), axis=1)
+
+def wedge_corners(wedges):
+    '''
+    Arc end points for an array of wedge records.
+
+    Returns an array of shape (n, 2, 2) ordered inner_start, inner_end
+    '''
+
+    cx, cy = wedges['cx'], wedges['cy']
+    return np.stack((
+        polar_to_xy(cx, cy, wedges['radius'], wedges['start_theta']),
+        polar_to_xy(cx, cy, wedges['radius'], wedges['end_theta']),
+    ), axis=1)
+
+def slice_hatch(slices):
+    '''
+    Fill hatch arcs for every filled slice, generated for all slices in one pass.
+
+    A filled slice gets max(floor(fill_factor*width/2.5), 1) arcs spaced
+    width/(n+1) apart strictly inside it. Every other arc runs backwards, so
+    each one starts on the side the previous one ended (a serpentine).
+
+    Returns a HATCH_DTYPE array sorted by slice
+    '''
+
+    filled = np.flatnonzero(slices['has_fill'])
+    start_radius = slices['start_radius'][filled]
+    width = slices['end_radius'][filled] - start_radius
+    num_lines = np.maximum(np.floor(slices['fill_factor'][filled] * width/MIN_HATCH_SPACING), 1).astype(int)
+    line_spacing = width/(num_lines+1)
+
+    owner = np.repeat(np.arange(len(filled)), num_lines) # position in `filled` of each hatch arc
+    i = np.arange(len(owner)) - np.repeat(np.cumsum(num_lines) - num_lines, num_lines) # index within its slice
+    flip = (i % 2) == 1
+    start_theta = slices['start_theta'][filled][owner]
+    end_theta = slices['end_theta'][filled][owner]
+
+    hatch = np.empty(len(owner), dtype=HATCH_DTYPE)
+    hatch['slice'] = filled[owner]
+    hatch['radius'] = start_radius[owner] + line_spacing[owner]*(i+1)
+    hatch['start_theta'] = np.where(flip, end_theta, start_theta)
+    hatch['end_theta'] = np.where(flip, start_theta, end_theta)
+    return hatch
+
+def arc_polylines(cx, cy, radius, start_theta, end_theta, group, tolerance=PREVIEW_TOLERANCE):
+    '''
+    Tessellates a batch of arcs (screen angles) in one go. Consecutive arcs with
+    the same group id are chained into one polyline, so the gap between one
+    arc's end and the next one's start becomes a straight line; an arc with no
+    sweep is a single point.
+
+    Args:
+        cx, cy, radius, start_theta, end_theta: arrays, one entry per arc
+        group: array of group ids, sorted
+        tolerance: largest distance between a chord and the arc
+
+    Returns a list of (n, 2) point arrays, one per group
+    '''
+
+    if len(group) == 0:
+        return []
+    sweep = end_theta - start_theta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.where(radius > tolerance, 2*np.arccos(1 - tolerance/np.maximum(radius, tolerance)), np.inf)
+        segments = np.where(sweep == 0, 0, np.maximum(np.ceil(np.abs(sweep)/step), 1)).astype(int)
+    counts = segments + 1
+    arc = np.repeat(np.arange(len(group)), counts)
+    k = np.arange(len(arc)) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = k/np.maximum(segments, 1)[arc]
+    points = polar_to_xy(cx[arc], cy[arc], radius[arc], start_theta[arc] + sweep[arc]*t)
+    breaks = np.flatnonzero(np.diff(group[arc])) + 1
+    return np.split(points, breaks)
+
+def slice_polylines(slices, hatch, tolerance=PREVIEW_TOLERANCE):
+    '''
+    Every slice (outline and hatch) as one polyline, tracing exactly the path of its plotter stroke
+    '''
+
+    n = len(slices)
+    ids = np.arange(n)
+    start_radius, end_radius = slices['start_radius'], slices['end_radius']
+    start_theta, end_theta = slices['start_theta'], slices['end_theta']
+    # inner arc, outer arc back, the inner start corner, then the hatch
+    group = np.concatenate((ids, ids, ids, hatch['slice']))
+    order = np.concatenate((np.zeros(n), np.ones(n), np.full(n, 2), 3 + np.arange(len(hatch))))
+    radius = np.concatenate((start_radius, end_radius, start_radius, hatch['radius']))
+    a0 = np.concatenate((start_theta, end_theta, start_theta, hatch['start_theta']))
+    a1 = np.concatenate((end_theta, start_theta, start_theta, hatch['end_theta']))
+    sort = np.lexsort((order, group))
+    group = group[sort]
+    return arc_polylines(slices['cx'][group], slices['cy'][group], radius[sort], a0[sort], a1[sort], group, tolerance)
+
+def wedge_polylines(wedges, tolerance=PREVIEW_TOLERANCE):
+    '''
+    Every wedge as one closed polyline through its center
+    '''
+
+    n = len(wedges)
+    ids = np.arange(n)
+    start_theta, end_theta = wedges['start_theta'], wedges['end_theta']
+    group = np.concatenate((ids, ids, ids))
+    order = np.concatenate((np.zeros(n), np.ones(n), np.full(n, 2)))
+    radius = np.concatenate((np.zeros(n), wedges['radius'], np.zeros(n)))
+    a0 = np.concatenate((start_theta, start_theta, end_theta))
+    a1 = np.concatenate((start_theta, end_theta, end_theta))
+    sort = np.lexsort((order, group))
+    group = group[sort]
+    return arc_polylines(wedges['cx'][group], wedges['cy'][group], radius[sort], a0[sort], a1[sort], group, tolerance)
+
+def slice_stroke(record, corners, hatch=None):
+    '''
+    One slice as a single stroke: the closed outline followed by its fill hatch,
+    drawn as a serpentine so the pen never has to lift inside the slice.
+
+    Screen angles are measured clockwise-up (y points down), which is why every
+    arc uses the negated theta.
+
+    Args:
+        record: the slice's SLICE_DTYPE fields as a tuple
+        corners: (inner_start, outer_start, inner_end, outer_end) points
+        hatch: the slice's rows of slice_hatch (worked out here if None)
+    '''
+    cx, cy, start_theta, end_theta, start_radius, end_radius, has_fill, fill_factor = record
+    inner_start, outer_start, inner_end, outer_end = corners
+    stroke = [
+        Arc(cx, cy, start_radius, -start_theta, -end_theta),
+        line(inner_end, outer_end),
+        Arc(cx, cy, end_radius, -end_theta, -start_theta),
+        line(outer_start, inner_start),
+    ]
+
+    if hatch is None:
+        hatch = slice_hatch(np.array([record], dtype=SLICE_DTYPE))
+    r_0 = start_radius
+    for _, r, start, end in hatch.tolist():
+        # step out along the side the previous arc ended on
+        stroke.append(line(xy_from_center_radius_theta((cx, cy), r_0, start), xy_from_center_radius_theta((cx, cy), r, start)))
+        stroke.append(Arc(cx, cy, r, -start, -end))
+        r_0 = r
+    return stroke
+
+def wedge_stroke(record, corners):
+    '''
+    One wedge as a single closed stroke through its center
+
+    Args:
+        record: the wedge's WEDGE_DTYPE fields as a tuple
+        corners: (inner_start, inner_end) points
+    '''
+    cx, cy, radius, start_theta, end_theta = record
+    inner_start, inner_end = corners
+    return [
+        line((cx, cy), inner_start),
+        Arc(cx, cy, radius, -start_theta, -end_theta),
+        line(inner_end, (cx, cy)),
+    ]
+
+def quantize_values(values):
+    '''
+    Snap pot readings onto the integer 0-1023 ADC grid, so they can be used as a cache key
+    '''
+
+    return tuple(min(1023, max(0, int(round(value)))) for value in values)
+
+class LRUCache:
+    '''
+    Bounded least-recently-used mapping with hit/miss counters. A maxsize of 0 disables it.
+    '''
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        '''
+        Returns the cached value (marking it most recently used), or None
+        '''
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
 
 class Element:
     LINE_COLOR = (0, 0, 0)
@@ -81,12 +327,18 @@ class Element:
         '''
         pass
 
-    def to_svg(self): 
+    def to_stroke(self):
         '''
-        Returns the SVG representation of the element
+        Returns the element as one plotter stroke (see paths.py)
         '''
         pass
 
+    def to_svg(self, svg):
+        '''
+        Writes the element as one path to an svgout.SVGWriter
+        '''
+        svg.path([self.to_stroke()])
+
 
 class Slice(Element):
 
@@ -107,57 +359,34 @@ class Slice(Element):
         self.inner_end_xy = xy_from_center_radius_theta(self.center, self.start_radius, self.end_theta) # problem one
         self.outer_end_xy = xy_from_center_radius_theta(self.center, self.end_radius, self.end_theta)   # problem one
 
-        # for pygame
-        self.inner_rect = pygame.Rect(rect_coord_from_center_radius(self.center, self.start_radius))
-        self.outer_rect = pygame.Rect(rect_coord_from_center_radius(self.center, self.end_radius))
+    @property
+    def inner_rect(self):
+        return pygame_rect(self.center, self.start_radius)
+
+    @property
+    def outer_rect(self):
+        return pygame_rect(self.center, self.end_radius)
+
+    @classmethod
+    def from_record(cls, record):
+        '''
+        Build a Slice view from a row of a SLICE_DTYPE array
+        '''
+        cx, cy, start_theta, end_theta, start_radius, end_radius, has_fill, fill_factor = record.tolist()
+        return cls((cx, cy), start_theta, end_theta, start_radius, end_radius, has_fill=has_fill, fill_factor=fill_factor)
+
+    def to_record(self):
+        return (self.center[0], self.center[1], self.start_theta, self.end_theta,
+                self.start_radius, self.end_radius, self.has_fill, self.fill_factor)
         
     def draw(self, screen):
-        
-        pygame.draw.arc(screen, self.LINE_COLOR, self.inner_rect, self.start_theta, self.end_theta, 3)
-        pygame.draw.arc(screen, self.LINE_COLOR, self.outer_rect, self.start_theta, self.end_theta, 3)
-        pygame.draw.line(screen, self.LINE_COLOR, self.inner_start_xy, self.outer_start_xy, 3)
-        pygame.draw.line(screen, self.LINE_COLOR, self.inner_end_xy, self.outer_end_xy, 3) # problem one
-
-        if self.has_fill: 
-            width = self.end_radius - self.start_radius
-            min_spacing = 2.5
-            num_lines = max(math.floor(self.fill_factor * width/min_spacing), 1)
-            line_spacing = width/(num_lines)
-            for i in range(num_lines):
-                r = self.start_radius + i*line_spacing
-                pygame.draw.arc(screen, self.LINE_COLOR, rect_coord_from_center_radius(self.center, r), self.start_theta, self.end_theta, 4)
-
-
-    def to_svg(self, dwg):
-        
-        svg_arc(dwg, self.center, self.start_radius, self.start_theta, self.end_theta, color="black")
-        svg_arc(dwg, self.center, self.end_radius, self.start_theta, self.end_theta, color="black")
-
-        dwg.add(dwg.line(self.inner_start_xy, self.outer_start_xy, stroke="black", stroke_width=3))
-        dwg.add(dwg.line(self.inner_end_xy, self.outer_end_xy, stroke="black", stroke_width=3))
-
-        if self.has_fill:
-            width = self.end_radius - self.start_radius
-            num_lines = math.floor(width/3)
-            min_spacing = 2.5
-            num_lines = max(math.floor(self.fill_factor * width/min_spacing), 1)
-            line_spacing = width/(num_lines+1)
-
-            for i in range(num_lines):
-                flip = ((i%2) == 1)
-                if flip:
-                    start = self.end_theta
-                    end = self.start_theta
-                else:
-                    start = self.start_theta
-                    end = self.end_theta
-                r = self.start_radius + line_spacing*(i+1)
-                r_0 = self.start_radius + line_spacing*(i)
-                p0 = xy_from_center_radius_theta(self.center, r_0, start)
-                p1 = xy_from_center_radius_theta(self.center, r, start)
-                dwg.add(dwg.line(p0, p1, stroke="black"))
-                #svg arc drawing must be in order or it continues the long way around
-                svg_arc(dwg, self.center, r, self.start_theta, self.end_theta, color="black")
+        record = np.array([self.to_record()], dtype=SLICE_DTYPE)
+        points, = slice_polylines(record, slice_hatch(record))
+        import pygame
+        pygame.draw.lines(screen, self.LINE_COLOR, False, points.tolist(), LINE_WIDTH)
+
+    def to_stroke(self):
+        return slice_stroke(self.to_record(), (self.inner_start_xy, self.outer_start_xy, self.inner_end_xy, self.outer_end_xy))
 
 
 class Wedge(Element): 
@@ -172,25 +401,39 @@ class Wedge(Element):
 
         self.inner_start_xy = xy_from_center_radius_theta(self.center, self.radius, self.start_theta)
         self.inner_end_xy = xy_from_center_radius_theta(self.center, self.radius, self.end_theta) 
-        
-        self.inner_rect = pygame.Rect(rect_coord_from_center_radius(self.center, self.radius))
+
+    @property
+    def inner_rect(self):
+        return pygame_rect(self.center, self.radius)
+
+    @classmethod
+    def from_record(cls, record):
+        '''
+        Build a Wedge view from a row of a WEDGE_DTYPE array
+        '''
+        cx, cy, radius, start_theta, end_theta = record.tolist()
+        return cls((cx, cy), radius, start_theta, end_theta)
+
+    def to_record(self):
+        return (self.center[0], self.center[1], self.radius, self.start_theta, self.end_theta)
 
     def draw(self, screen): 
-        pygame.draw.arc(screen, self.LINE_COLOR, self.inner_rect, self.start_theta, self.end_theta, 3)
-        pygame.draw.line(screen, self.LINE_COLOR, self.center, self.inner_end_xy, 3)
-        pygame.draw.line(screen, self.LINE_COLOR, self.center, self.inner_start_xy, 3)
+        points, = wedge_polylines(np.array([self.to_record()], dtype=WEDGE_DTYPE))
+        import pygame
+        pygame.draw.lines(screen, self.LINE_COLOR, False, points.tolist(), LINE_WIDTH)
 
-    def to_svg(self, dwg): 
-        svg_arc(dwg, self.center, self.radius, self.start_theta, self.end_theta, color="black")
-        dwg.add(dwg.line(self.center, self.inner_end_xy, stroke="black", stroke_width=3))
-        dwg.add(dwg.line(self.center, self.inner_start_xy, stroke="black", stroke_width=3))
+    def to_stroke(self):
+        return wedge_stroke(self.to_record(), (self.inner_start_xy, self.inner_end_xy))
 
 class ArtproofDrawing: 
+    BACKGROUND_COLOR = (255, 255, 255)
 
-    def __init__(self, dimensions, values, screen): 
+    def __init__(self, dimensions, values, screen, cache_size=64, surface_cache_size=8): 
         '''
         Dimensions: (width, height)
         Values: list of values from 0 to 1023
+        cache_size: number of (values, seed) geometries to remember
+        surface_cache_size: number of rendered surfaces to remember (~1.4MB each at 600x600)
         '''
         self.dimensions = dimensions
         self.screen = screen
@@ -199,7 +442,47 @@ class ArtproofDrawing:
         self.max_radius = min(dimensions[0], dimensions[1])/2 - self.border
 
         self.values = []
-        self.elements = []
+        self.version = 0 # bumped whenever the geometry changes
+        self.surface = None # cached offscreen render of the current geometry
+        self.surface_version = None
+        self.cache_key = None # (quantized values, seed) the current geometry was generated from
+        self.geometry_cache = LRUCache(cache_size)
+        self._stages = {} # stage name -> (inputs key, output) of its last run
+        self.stage_runs = {} # stage name -> times it has run
+        self.surface_cache = LRUCache(surface_cache_size)
+        self.slices = self.wedges = None
+        self.slice_version = 0 # bumped only when the slices change
+        self._slice_layer = None # background plus slices, reused while only the wedges move
+        self._slice_layer_version = None
+        self.set_geometry(np.empty(0, dtype=SLICE_DTYPE), np.empty(0, dtype=WEDGE_DTYPE))
+
+    def set_geometry(self, slices, wedges):
+        '''
+        Replace the slice and wedge record arrays and refresh the derived corner and hatch arrays.
+        Passing the same array object as before keeps what was derived from it.
+        '''
+        if slices is not self.slices:
+            self.slices = slices
+            self.slice_xy = slice_corners(slices)
+            self.hatch = slice_hatch(slices) # shared by the preview and the plotter output
+            self._slice_lines = None
+            self.slice_version += 1
+        if wedges is not self.wedges:
+            self.wedges = wedges
+            self.wedge_xy = wedge_corners(wedges)
+            self._wedge_lines = None
+        self._elements = None
+        self.cache_key = None
+        self.version += 1
+
+    @property
+    def elements(self):
+        '''
+        Slice and Wedge views of the current geometry (built lazily, for compatibility)
+        '''
+        if self._elements is None:
+            self._elements = [Slice.from_record(r) for r in self.slices] + [Wedge.from_record(r) for r in self.wedges]
+        return self._elements
 
     def update(self, values, seed=0):
         '''
@@ -216,71 +499,247 @@ class ArtproofDrawing:
         7: Expected number of wedges 
         8: Expected wedge theta size 
         9: Expected wedge radius
+
+        Results are memoized on the quantized values and seed, so returning to a
+        previous slider position is a cache lookup. Below that, generation is
+        split into stages (see GENERATION_STAGES), each with its own random
+        stream, and only the stages whose pots moved are run again.
         '''    
 
-        random.seed(seed)
-        np.random.seed(seed)
-        self.elements = []
-        self.values = [value/1023 for value in values]
+        key = (quantize_values(values), seed)
+        self.values = [value/1023 for value in key[0]]
+
+        cached = self.geometry_cache.get(key)
+        if cached is not None:
+            self.set_geometry(*cached)
+            self.cache_key = key
+            return
+
+        q = key[0]
+        candidates = self._stage("layers", q, seed, self._generate_layers)
+        included = self._stage("include", q, seed, lambda rng: rng.random(len(candidates)) < self.values[5]) # element is included
+        fills = self._stage("fill", q, seed, lambda rng: self._generate_fills(rng, len(candidates)))
+        slices = self._stage("slices", q, seed, lambda rng: self._assemble_slices(candidates, included, fills))
+        wedges = self._stage("wedges", q, seed, self._generate_wedges)
+
+        self.geometry_cache.put(key, (slices, wedges))
+        self.set_geometry(slices, wedges)
+        self.cache_key = key
 
+    def _stage(self, name, q, seed, generate):
+        '''
+        Returns the output of generation stage `name`, running `generate(rng)` only if
+        the stage's pots, the seed or a stage it builds on changed since last time
+        '''
+        pots, depends = GENERATION_STAGES[name]
+        key = (seed, tuple(q[i] for i in pots)) + tuple(self._stages[d][0] for d in depends)
+        entry = self._stages.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        # every stage draws from its own stream, so one stage's draws never shift another's
+        rng = np.random.default_rng([seed, list(GENERATION_STAGES).index(name)])
+        result = generate(rng)
+        self._stages[name] = (key, result)
+        self.stage_runs[name] = self.stage_runs.get(name, 0) + 1
+        return result
+
+    def _generate_layers(self, rng):
+        '''
+        Lays out the rings of slices (pots 0-4). Returns a SLICE_DTYPE array of
+        every candidate slice, before inclusion and fill are decided.
+        '''
+        cx, cy = self.center
+        candidates = []
         curr_radius = 20
 
         while curr_radius < self.max_radius: # build layers
-            layer_width = abs(random.gauss(self.values[0]*self.max_radius/2+20, self.values[1]*self.max_radius/5))
+            layer_width = abs(rng.normal(self.values[0]*self.max_radius/2+20, self.values[1]*self.max_radius/5))
 
             if curr_radius + layer_width > self.max_radius:
                 break
 
-            num_elts_in_layer = math.floor(abs(random.gauss(self.values[2]*30, self.values[3]*5)))+1
+            num_elts_in_layer = math.floor(abs(rng.normal(self.values[2]*30, self.values[3]*5)))+1
             elt_size_in_radians = 2*3.14/num_elts_in_layer
 
             for j in range(num_elts_in_layer): # build elements
-                if self.values[5] > random.random(): # element is included
-                    fillval = True
-                    #mean = a/(a+b) in [0,1]
-                    #peakiness = (a+b) in (0, inf]
-                    #-> a = mean * peakiness
-                    #-> b = peakiness - a
-                    peakiness = 1e3/(1e4*(self.values[6]**2) + 1.0/1e6)
-                    a = self.values[4] * peakiness
-                    b = peakiness - a
-                    a = np.clip(a, 1/1e32, 1e32)
-                    b = np.clip(b, 1/1e32, 1e32)
-                    fill_fact = min( 1.0, max(np.random.beta(a,b), 0))**2
-                    elt = Slice(self.center, j*elt_size_in_radians, (j+1)*elt_size_in_radians, curr_radius, curr_radius + layer_width, has_fill = fillval, fill_factor = fill_fact)
-                    self.elements.append(elt)
-            
-            curr_radius += layer_width + abs(random.gauss(self.values[4], self.values[4]/5))
-
-        num_wedges = math.floor(abs(random.gauss(self.values[7]*16, self.values[7]*2)))
+                candidates.append((cx, cy, j*elt_size_in_radians, (j+1)*elt_size_in_radians, curr_radius, curr_radius + layer_width, True, 0.0))
 
+            curr_radius += layer_width + abs(rng.normal(self.values[4], self.values[4]/5))
+
+        return np.array(candidates, dtype=SLICE_DTYPE)
+
+    def _generate_fills(self, rng, count):
+        '''
+        Fill factor for each of `count` candidate slices (pots 4 and 6). Every
+        candidate gets one, so toggling a slice on or off doesn't reshuffle the others.
+        '''
+        #mean = a/(a+b) in [0,1]
+        #peakiness = (a+b) in (0, inf]
+        #-> a = mean * peakiness
+        #-> b = peakiness - a
+        peakiness = 1e3/(1e4*(self.values[6]**2) + 1.0/1e6)
+        a = self.values[4] * peakiness
+        b = peakiness - a
+        a = np.clip(a, 1/1e32, 1e32)
+        b = np.clip(b, 1/1e32, 1e32)
+        return np.clip(rng.beta(a, b, size=count), 0, 1.0)**2
+
+    def _assemble_slices(self, candidates, included, fills):
+        slices = candidates[included]
+        slices['fill_factor'] = fills[included]
+        return slices
+
+    def _generate_wedges(self, rng):
+        '''
+        The wedges (pots 7-9), as a WEDGE_DTYPE array
+        '''
+        cx, cy = self.center
+        num_wedges = math.floor(abs(rng.normal(self.values[7]*16, self.values[7]*2)))
+
+        wedges = []
         for i in range(num_wedges):
-            theta_size = random.uniform(0.03,0.2)+abs(random.gauss(self.values[8]*math.pi/6, .001))
-            start_theta = (random.random()*2*math.pi)-(theta_size/2)
+            theta_size = rng.uniform(0.03,0.2)+abs(rng.normal(self.values[8]*math.pi/6, .001))
+            start_theta = (rng.random()*2*math.pi)-(theta_size/2)
             #theta_size = abs(random.gauss(self.values[8]*math.pi/12, self.values[8]*math.pi/12))
-            radius = min(self.max_radius - 20, max(random.gauss(self.values[9]*self.max_radius/1.5, self.max_radius/5), 30))
+            radius = min(self.max_radius - 20, max(rng.normal(self.values[9]*self.max_radius/1.5, self.max_radius/5), 30))
             #elt = Wedge(self.center, self.values[9]*(self.max_radius-20)+3, random.random()*2*math.pi, start_theta + theta_size)
-            elt = Wedge(self.center, radius, start_theta, start_theta + theta_size)
-            self.elements.append(elt)
-        
+            wedges.append((cx, cy, radius, start_theta, start_theta + theta_size))
 
-    def draw(self):
-        
-        for element in self.elements: 
-            element.draw(self.screen)
-    
-    def to_svg(self, fname): 
-        
-        dwg = svgwrite.Drawing(fname, self.dimensions)
-        for element in self.elements:
-            element.to_svg(dwg)
-            
-        dwg.save()
+        return np.array(wedges, dtype=WEDGE_DTYPE)
+
+    def save_geometry(self, file):
+        '''
+        Writes the slice and wedge arrays, and the (values, seed) they came from, as .npz
+
+        Args:
+            file: file name or writable binary file
+        '''
+        values, seed = self.cache_key if self.cache_key is not None else ((), -1)
+        np.savez_compressed(file, slices=self.slices, wedges=self.wedges,
+                            values=np.array(values, dtype=np.int64), seed=np.int64(seed))
+
+    def load_geometry(self, file):
+        '''
+        Replaces the geometry with a save_geometry snapshot, without regenerating anything
+        '''
+        with np.load(file) as data:
+            self.set_geometry(data["slices"], data["wedges"])
+            if int(data["seed"]) >= 0:
+                self.cache_key = (tuple(data["values"].tolist()), int(data["seed"]))
+                self.values = [value/1023 for value in self.cache_key[0]]
+
+    def cache_info(self):
+        '''
+        Hit/miss counters for the geometry and surface caches
+        '''
+        return {"geometry": self.geometry_cache.info(), "surface": self.surface_cache.info()}
+
+    def render(self):
+        '''
+        Returns the offscreen surface for the current geometry, rasterizing it only if
+        the geometry changed since the last render
+        '''
+        if self.surface is None or self.surface_version != self.version:
+            surface = self.surface_cache.get(self.cache_key) if self.cache_key is not None else None
+            if surface is None:
+                surface = self._render_slices().copy()
+                self._draw_lines(surface, self.wedge_lines)
+                if self.cache_key is not None:
+                    self.surface_cache.put(self.cache_key, surface)
+            self.surface = surface
+            self.surface_version = self.version
+        return self.surface
+
+    def _render_slices(self):
+        if self._slice_layer is None or self._slice_layer_version != self.slice_version:
+            import pygame
+            self._slice_layer = pygame.Surface(self.dimensions)
+            self._slice_layer.fill(self.BACKGROUND_COLOR)
+            self._draw_lines(self._slice_layer, self.slice_lines)
+            self._slice_layer_version = self.slice_version
+        return self._slice_layer
+
+    def draw(self, position=(0, 0)):
+        '''
+        Blits the cached render onto the screen
+
+        Returns the pygame.Rect that was touched, for pygame.display.update
+        '''
+        return self.screen.blit(self.render(), position)
+
+    @property
+    def slice_lines(self):
+        '''
+        One polyline per slice, following the plotter strokes (built lazily)
+        '''
+        if self._slice_lines is None:
+            self._slice_lines = [points.tolist() for points in slice_polylines(self.slices, self.hatch)]
+        return self._slice_lines
+
+    @property
+    def wedge_lines(self):
+        '''
+        One polyline per wedge (built lazily)
+        '''
+        if self._wedge_lines is None:
+            self._wedge_lines = [points.tolist() for points in wedge_polylines(self.wedges)]
+        return self._wedge_lines
+
+    @property
+    def preview_lines(self):
+        '''
+        One polyline per slice and wedge, following the plotter strokes
+        '''
+        return self.slice_lines + self.wedge_lines
+
+    def _draw_lines(self, surface, lines):
+        import pygame
+        color = Element.LINE_COLOR
+        for points in lines:
+            pygame.draw.lines(surface, color, False, points, LINE_WIDTH)
+
+    def draw_to(self, surface):
+        '''
+        Rasterizes every slice and wedge onto the given surface, one polyline each
+        '''
+        self._draw_lines(surface, self.preview_lines)
+
+    def to_svg(self, output, precision=3):
+        '''
+        Writes the drawing as SVG, one path per slice / wedge, streamed straight out
+
+        Args:
+            output: file name or writable text file
+            precision: decimals written for coordinates
+        '''
+        with SVGWriter(output, self.dimensions, precision=precision, stroke_width=3) as svg:
+            for stroke in self.to_strokes():
+                svg.path([stroke])
+
+    def to_strokes(self):
+        '''
+        The drawing as plotter strokes (see paths.py), in drawing pixel coordinates,
+        one per slice and wedge
+        '''
+        bounds = np.searchsorted(self.hatch['slice'], np.arange(len(self.slices) + 1))
+        strokes = [slice_stroke(record, corners, self.hatch[bounds[i]:bounds[i+1]])
+                   for i, (record, corners) in enumerate(zip(self.slices.tolist(), self.slice_xy.tolist()))]
+        strokes += [wedge_stroke(record, corners) for record, corners in zip(self.wedges.tolist(), self.wedge_xy.tolist())]
+        return strokes
 
     def add_element(self, element): 
-        self.elements.append(element)
+        '''
+        Append a Slice or Wedge to the record arrays
+        '''
+        if isinstance(element, Slice):
+            slices = np.append(self.slices, np.array([element.to_record()], dtype=SLICE_DTYPE))
+            self.set_geometry(slices, self.wedges)
+        else:
+            wedges = np.append(self.wedges, np.array([element.to_record()], dtype=WEDGE_DTYPE))
+            self.set_geometry(self.slices, wedges)
 
 def run_artproof_test(): 
+    import pygame
     screen = intialize_pygame((600, 600))
     BACKGROUND_COLOR = (255,255,255)
 
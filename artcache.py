@@ -0,0 +1,252 @@
+#! /usr/bin/env python3
+# This file keeps exported drawings on disk so a reprint doesn't regenerate anything
+'''
+Content-addressed cache of export artifacts.
+
+An export is fully determined by the drawing size, the pot values and seed, the
+code that generates and lays it out and the signature / plotter config files.
+The key is a sha256 over all of those, so a change to any of them simply misses
+instead of handing out a stale file.
+
+Each entry is a folder holding the page SVG, the G-code and a geometry snapshot
+(ArtproofDrawing.save_geometry, .npz):
+
+    <cache_dir>/<key[:2]>/<key>/drawing.svg
+                               /drawing.gcode
+                               /geometry.npz
+    <cache_dir>/index.json    key -> files, size, last use, values, seed, stats
+
+Files are hard linked in and out where the filesystem allows (copied otherwise),
+so a hit costs a couple of links. Once the entries add up to more than max_bytes
+the least recently used ones are removed.
+
+Only one process should own a cache (the UI's ExportPool); workers just write
+their snapshot into staging_dir and the owner files it away. Whatever is still
+in staging_dir when a cache is opened is left over from a run that stopped
+mid-export, and is deleted.
+
+A hit only marks the entry used in memory, so the UI thread doesn't write the
+index on every reprint; the index is written on put(), flush() and close().
+'''
+import hashlib
+import json
+import os
+import shutil
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HERE, "artifact_cache")
+MAX_BYTES = 200*1024*1024
+INDEX = "index.json"
+
+# everything that decides what an export looks like, and the plot time estimate kept with it
+CODE_FILES = ("art.py", "dedup.py", "export.py", "grblsim.py", "machine.py", "paths.py", "pathopt.py", "plottime.py", "svgout.py")
+INPUT_FILES = ("party_signature.svg", "test_party_config.cfg")
+
+_inputs_digest = None
+
+def inputs_digest():
+    '''
+    sha256 of the code and input files an export depends on (read once per process)
+    '''
+    global _inputs_digest
+    if _inputs_digest is None:
+        h = hashlib.sha256()
+        for name in CODE_FILES + INPUT_FILES:
+            h.update(name.encode() + b"\0")
+            with open(os.path.join(HERE, name), "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        _inputs_digest = h.hexdigest()
+    return _inputs_digest
+
+def artifact_key(dimensions, values, seed):
+    '''
+    Cache key of the export of the drawing for (values, seed) at the given size
+    '''
+    text = json.dumps([inputs_digest(), list(dimensions), [int(v) for v in values], int(seed)])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def link_or_copy(src, dst):
+    '''
+    Puts src at dst (replacing it) as a hard link, or a copy if linking isn't possible
+    '''
+    tmp = dst + ".part"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError: # other filesystem, or no hard links
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ArtifactCache:
+    '''
+    Size bounded, least recently used cache of export artifacts
+    '''
+
+    FILES = {"svg": "drawing.svg", "gcode": "drawing.gcode", "geometry": "geometry.npz"}
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        '''
+        Args:
+            cache_dir: folder for the entries and the index (created if missing)
+            max_bytes: total size the entries may take before the oldest are removed
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.staging_dir = os.path.join(cache_dir, "staging")
+        self.hits = self.misses = 0
+        self._dirty = False # index changed since it was last written
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self._clear_staging()
+        self._index = self._load_index()
+
+    def _clear_staging(self):
+        for name in os.listdir(self.staging_dir):
+            try:
+                os.remove(os.path.join(self.staging_dir, name))
+            except OSError:
+                pass
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX)) as f:
+                return json.load(f)
+        except (OSError, ValueError): # no cache yet, or an index cut short
+            return {}
+
+    def _save_index(self):
+        fname = os.path.join(self.cache_dir, INDEX)
+        with open(fname + ".part", "w") as f:
+            json.dump(self._index, f)
+        os.replace(fname + ".part", fname)
+        self._dirty = False
+
+    def flush(self):
+        '''
+        Writes the index if anything changed since it was last written
+        '''
+        if self._dirty:
+            self._save_index()
+
+    def close(self):
+        self.flush()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def staging_path(self, key, kind="geometry"):
+        '''
+        Where a worker should write an artifact of `kind` for put() to pick up
+        '''
+        return os.path.join(self.staging_dir, key + "." + self.FILES[kind].rsplit(".", 1)[1])
+
+    def discard_staged(self, key, kinds=("geometry",)):
+        '''
+        Deletes what a failed or cancelled export may have left in staging_dir
+        '''
+        for kind in kinds:
+            try:
+                os.remove(self.staging_path(key, kind))
+            except OSError: # never written
+                pass
+
+    def get(self, key):
+        '''
+        Returns the index entry for key ("files" maps kinds to paths) and marks it
+        used (in memory only, see flush), or None if it isn't cached (or its files have gone)
+        '''
+        entry = self._index.get(key)
+        if entry is not None:
+            files = {kind: os.path.join(self.entry_dir(key), name) for kind, name in entry["files"].items()}
+            if all(os.path.exists(fname) for fname in files.values()):
+                self.hits += 1
+                entry["used"] = time.time()
+                self._dirty = True
+                return dict(entry, files=files)
+            self.remove(key)
+        self.misses += 1
+        return None
+
+    def fetch(self, key, outputs):
+        '''
+        Puts the cached artifacts where an export would have written them
+
+        Args:
+            key: artifact_key of the drawing
+            outputs: {kind: destination path}, e.g. {"svg": "drawing_3.svg", "gcode": "drawing_3.gcode"}
+
+        Returns the index entry, or None on a miss (nothing is written then)
+        '''
+        entry = self.get(key)
+        if entry is None or any(kind not in entry["files"] for kind in outputs):
+            return None
+        for kind, dst in outputs.items():
+            link_or_copy(entry["files"][kind], dst)
+        return entry
+
+    def put(self, key, files, staged=(), **meta):
+        '''
+        Stores the artifacts of a finished export
+
+        Args:
+            key: artifact_key of the drawing
+            files: {kind: path} of finished output files, linked into the cache
+            staged: kinds written to staging_path(key, kind), moved into the cache
+            meta: anything JSON-able to keep in the index (values, seed, stats, ...)
+        '''
+        folder = self.entry_dir(key)
+        os.makedirs(folder, exist_ok=True)
+        stored = {}
+        for kind, src in list(files.items()) + [(kind, self.staging_path(key, kind)) for kind in staged]:
+            dst = os.path.join(folder, self.FILES[kind])
+            if kind in staged:
+                os.replace(src, dst)
+            else:
+                link_or_copy(src, dst)
+            stored[kind] = self.FILES[kind]
+        size = sum(os.path.getsize(os.path.join(folder, name)) for name in stored.values())
+        now = time.time()
+        self._index[key] = dict(meta, files=stored, bytes=size, created=now, used=now)
+        self.evict(keep=key)
+        self._save_index()
+
+    def remove(self, key):
+        if self._index.pop(key, None) is not None:
+            self._dirty = True
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(self.entry_dir(key))) # only goes if no other entry shares the prefix
+        except OSError:
+            pass
+
+    def size(self):
+        return sum(entry["bytes"] for entry in self._index.values())
+
+    def evict(self, keep=None):
+        '''
+        Removes least recently used entries until the cache fits in max_bytes
+
+        Returns how many were removed
+        '''
+        total = self.size()
+        removed = 0
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["bytes"]
+            self.remove(key)
+            removed += 1
+        return removed
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._index), "bytes": self.size(), "max_bytes": self.max_bytes}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
@@ -0,0 +1,313 @@
+#! /usr/bin/env python3
+# This file generates drawings in bulk, without a display
+'''
+Headless batch generation over a grid of pot values and seeds.
+
+Every (values, seed) pair is regenerated in a worker process and written out as
+any of PNG (rendered with Cairo), SVG (the drawing, see ArtproofDrawing.to_svg)
+and G-code (laid out with the signature, like the kiosk's print button). Files
+are named after their values and seed, so the same pair always lands in the
+same place:
+
+    <out_dir>/s<seed>_v<v0>-<v1>-...-<v9>.png
+
+As workers finish, one JSON line per drawing is appended to the manifest
+(<out_dir>/manifest.jsonl): its values, seed, files and element counts. That
+doubles as the catalogue and as the record of what is done; running the same
+batch again skips everything already in the manifest, so an interrupted batch
+just picks up where it stopped.
+
+    python3 batch.py -o catalogue --seeds 0-999 --png
+    python3 batch.py -o grid --values 512 --grid 5=0:1023:9 --grid 7=0:1023:9 --seeds 0-9 --png --svg
+    python3 batch.py -o plots --random 200 --gcode -j 8
+
+Nothing here needs pygame or a display.
+'''
+import concurrent.futures
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+try:
+    import cairo
+except ImportError: # only needed for PNG output
+    cairo = None
+
+import export
+import plottime
+from art import ArtproofDrawing
+from paths import Arc
+
+DIMENSIONS = (600, 600) # same as the kiosk
+NUM_POTS = 10
+MANIFEST = "manifest.jsonl"
+FORMATS = ("png", "svg", "gcode")
+LINE_WIDTH = 3 # pixels at scale 1, same as the preview
+
+
+def parse_seeds(text):
+    '''
+    Seeds from a string like "0-99" or "1,5,9" or "0-9,100"
+    '''
+    seeds = []
+    for part in text.split(","):
+        lo, _, hi = part.partition("-")
+        seeds.extend(range(int(lo), int(hi) + 1) if hi else [int(lo)])
+    return seeds
+
+def value_grid(base, axes=(), random_vectors=0, seed=0):
+    '''
+    Pot vectors (raw 0-1023 values) for a batch
+
+    Args:
+        base: the values of the pots that are not swept (list of NUM_POTS)
+        axes: list of (pot, lo, hi, steps); every combination is generated
+        random_vectors: uniformly random vectors added on top
+        seed: seed for the random vectors
+
+    With no axes the grid is just `base`, left out if there are random vectors.
+    '''
+
+    sweeps = [[round(lo + (hi - lo)*k/max(1, steps - 1)) for k in range(steps)] for _, lo, hi, steps in axes]
+    vectors = []
+    for combo in itertools.product(*sweeps) if axes or not random_vectors else ():
+        values = list(base)
+        for (pot, _, _, _), value in zip(axes, combo):
+            values[pot] = value
+        vectors.append(values)
+
+    rng = random.Random(seed)
+    vectors.extend([rng.randrange(1024) for _ in range(NUM_POTS)] for _ in range(random_vectors))
+    return vectors
+
+def job_name(values, seed):
+    return "s%04d_v%s" % (seed, "-".join("%04d" % v for v in values))
+
+def render_png(strokes, fname, dimensions=DIMENSIONS, scale=1.0, line_width=LINE_WIDTH):
+    '''
+    Renders strokes (drawing pixel coordinates) black on white to a PNG with Cairo
+
+    Args:
+        strokes: list of strokes (see paths.py)
+        fname: PNG to write
+        dimensions: (width, height) of the drawing
+        scale: output pixels per drawing pixel
+        line_width: stroke width in drawing pixels
+    '''
+    if cairo is None:
+        raise RuntimeError("PNG output needs pycairo")
+
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, math.ceil(dimensions[0]*scale), math.ceil(dimensions[1]*scale))
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+
+    ctx.scale(scale, scale)
+    ctx.set_source_rgb(0, 0, 0)
+    ctx.set_line_width(line_width)
+    ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+    ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+    for stroke in strokes:
+        ctx.new_sub_path()
+        for piece in stroke:
+            if isinstance(piece, Arc):
+                # Arc angles go the same way as cairo's, both in y-down pixels
+                arc = ctx.arc if piece.end >= piece.start else ctx.arc_negative
+                arc(piece.cx, piece.cy, piece.r, piece.start, piece.end)
+            else:
+                points = piece.tolist()
+                if not ctx.has_current_point():
+                    ctx.move_to(*points[0])
+                for x, y in points[1:]:
+                    ctx.line_to(x, y)
+    ctx.stroke() # one stroke call for the whole drawing
+    surface.write_to_png(fname)
+
+
+# the worker's drawing, reused between jobs so unchanged generation stages are skipped
+_drawing = None
+
+def _run_batch_job(dimensions, values, seed, out_dir, name, formats, png_scale, time_budget):
+    '''
+    Worker side of run_batch: regenerates one drawing and writes the requested files.
+    Files are written under a temporary name and renamed when complete, so an
+    interrupted batch never leaves half a file behind.
+
+    Returns the manifest record
+    '''
+    global _drawing
+    if _drawing is None or _drawing.dimensions != dimensions:
+        _drawing = ArtproofDrawing(dimensions, values, None, cache_size=0, surface_cache_size=0)
+    drawing = _drawing
+    started = time.perf_counter()
+    drawing.update(values, seed)
+
+    files = {}
+    base = os.path.join(out_dir, name)
+    if "png" in formats:
+        files["png"] = base + ".png"
+        render_png(drawing.to_strokes(), files["png"] + ".part", dimensions, png_scale)
+    if "svg" in formats:
+        files["svg"] = base + ".svg"
+        drawing.to_svg(files["svg"] + ".part")
+    stats = None
+    if "gcode" in formats:
+        files["gcode"] = base + ".gcode"
+        stats = export.export_drawing(drawing, fname_gcode=files["gcode"] + ".part", time_budget=time_budget)
+    for fname in files.values():
+        os.replace(fname + ".part", fname)
+
+    record = {
+        "name": name,
+        "values": list(values),
+        "seed": seed,
+        "files": {kind: os.path.basename(fname) for kind, fname in files.items()},
+        "slices": len(drawing.slices),
+        "wedges": len(drawing.wedges),
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+    if stats is not None:
+        record["pen_down_mm"] = round(float(stats["after"].pen_down), 1)
+        record["pen_up_mm"] = round(float(stats["after"].pen_up), 1)
+        record["retraced_mm"] = round(float(stats["removed_mm"]), 1) # taken out by dedup
+        record["plot_seconds"] = round(plottime.estimate_gcode(files["gcode"]).seconds, 1)
+    return record
+
+def load_manifest(out_dir):
+    '''
+    Names of the drawings already recorded in <out_dir>/manifest.jsonl
+    '''
+    done = set()
+    fname = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["name"])
+                except (ValueError, KeyError): # a line cut short when the batch was killed
+                    continue
+    return done
+
+def _ends_with_newline(fname):
+    with open(fname, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def run_batch(vectors, seeds, out_dir, formats=("png",), workers=None, dimensions=DIMENSIONS,
+              png_scale=1.0, time_budget=export.OPTIMIZE_TIME_BUDGET, progress=None):
+    '''
+    Generates every pot vector with every seed across a process pool
+
+    Args:
+        vectors: list of pot vectors (see value_grid)
+        seeds: list of seeds
+        out_dir: folder for the files and the manifest (created if missing)
+        formats: any of "png", "svg", "gcode"
+        workers: worker processes (default: one per CPU)
+        dimensions: (width, height) of the drawings
+        png_scale: output pixels per drawing pixel for PNGs
+        time_budget: safety cap in seconds on path refinement per G-code file
+        progress: optional callable(done, total, record, error) called as each drawing
+            finishes; a failed drawing has record None and the exception as error
+
+    Returns (written, skipped, failed): counts of drawings written, already in the
+    manifest, and failed
+    '''
+
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError("unknown formats: %s" % ", ".join(sorted(unknown)))
+    if "png" in formats and cairo is None:
+        raise RuntimeError("PNG output needs pycairo")
+
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_manifest(out_dir)
+    todo = []
+    for values in vectors:
+        for seed in seeds:
+            name = job_name(values, seed)
+            if name not in done:
+                done.add(name) # the grid may repeat a vector
+                todo.append((tuple(values), seed, name))
+    skipped = len(vectors)*len(seeds) - len(todo)
+
+    workers = workers or os.cpu_count() or 1
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+    written = failed = 0
+    jobs = iter(todo)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor, \
+            open(os.path.join(out_dir, MANIFEST), "a", buffering=1) as manifest:
+        if manifest.tell() and not _ends_with_newline(manifest.name):
+            manifest.write("\n") # don't glue the first record onto a line cut short
+        # keep a few jobs per worker in flight rather than queueing the whole grid up front
+        pending = set()
+        while True:
+            for values, seed, name in itertools.islice(jobs, 4*workers - len(pending)):
+                pending.add(executor.submit(_run_batch_job, dimensions, values, seed, out_dir, name,
+                                            tuple(formats), png_scale, time_budget))
+            if not pending:
+                break
+            finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    if progress:
+                        progress(written + failed, len(todo), None, e)
+                    continue
+                manifest.write(json.dumps(record) + "\n")
+                written += 1
+                if progress:
+                    progress(written + failed, len(todo), record, None)
+    return written, skipped, failed
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    def grid_axis(text):
+        pot, _, span = text.partition("=")
+        lo, hi, steps = span.split(":")
+        return int(pot), int(lo), int(hi), int(steps)
+
+    parser = argparse.ArgumentParser(description='Generate drawings over a grid of pot values and seeds, without a display')
+    parser.add_argument('-o', '--out-dir', required=True, help='folder for the files and manifest.jsonl')
+    parser.add_argument('--png', action='store_true', default=False, help='render PNGs with Cairo')
+    parser.add_argument('--svg', action='store_true', default=False, help='write the drawing SVGs')
+    parser.add_argument('--gcode', action='store_true', default=False, help='write plotter G-code (laid out with the signature)')
+    parser.add_argument('-s', '--seeds', type=parse_seeds, default=[0], help='seeds, e.g. 0-999 or 1,5,9 (default 0)')
+    parser.add_argument('--values', type=int, nargs='+', default=[512],
+            help='pot values (0-1023) for the pots not swept; one value is used for all (default 512)')
+    parser.add_argument('--grid', type=grid_axis, action='append', default=[], metavar='POT=LO:HI:STEPS',
+            help='sweep a pot over STEPS values from LO to HI (repeatable, every combination is made)')
+    parser.add_argument('-n', '--random', type=int, default=0, help='random pot vectors to add')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--scale', type=float, default=1.0, help='PNG pixels per drawing pixel (default %(default)s)')
+    parser.add_argument('--time-budget', type=float, default=export.OPTIMIZE_TIME_BUDGET,
+            help='safety cap in seconds on path refinement per G-code file (default %(default)s)')
+    args = parser.parse_args()
+
+    formats = [kind for kind in FORMATS if getattr(args, kind)] or ["png"]
+    base = args.values*NUM_POTS if len(args.values) == 1 else args.values
+    if len(base) != NUM_POTS:
+        parser.error("--values takes 1 or %d values" % NUM_POTS)
+    vectors = value_grid(base, args.grid, args.random)
+
+    def show(done, total, record, error):
+        if error is not None:
+            print("\nfailed:", repr(error), file=sys.stderr)
+        print("\r%d/%d drawings" % (done, total), end="", file=sys.stderr, flush=True)
+
+    started = time.monotonic()
+    written, skipped, failed = run_batch(vectors, args.seeds, args.out_dir, formats, args.workers,
+                                         png_scale=args.scale, time_budget=args.time_budget, progress=show)
+    print(file=sys.stderr)
+    print("%d written, %d already done, %d failed in %.1fs" % (written, skipped, failed, time.monotonic() - started))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+# This file times the drawing pipeline, from pot values to G-code streamed into a simulated plotter
+'''
+Headless benchmark of every stage a visitor's drawing goes through:
+
+    update -> draw (offscreen) -> svg -> gcode (export) -> stream (simulated grbl)
+
+Each case is one pot vector and seed. The pot vectors cover the extreme corners
+of the 10 parameters (see ArtproofDrawing.update) plus random vectors in between.
+For every case the wall time of each stage is recorded along with what it made:
+element counts, SVG / G-code sizes, pen travel and the simulated plot time.
+
+Results are written as JSON. Given a baseline (an earlier results file) the
+median time of every stage is compared and anything that got more than
+REGRESSION_THRESHOLD slower is flagged; outputs that changed for the same case
+are listed too, since that usually means the drawing itself changed. Every
+output compared is deterministic: path refinement runs its fixed number of
+2-opt passes here, without the kiosk's time cap.
+
+    python3 benchmark.py -n 8 --seeds 3 -o results.json
+    python3 benchmark.py --save-baseline           # remember this run (benchmarks/ is not checked in)
+    python3 benchmark.py                           # compare against it
+'''
+import json
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # never open a window
+
+import pygame
+
+import export
+import grblsim
+import plottime
+import stream
+from art import ArtproofDrawing
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, "benchmarks", "baseline.json") # machine specific, gitignored
+
+DIMENSIONS = (600, 600) # same as the kiosk
+NUM_POTS = 10
+STAGES = ("update", "draw", "svg", "gcode", "stream")
+REGRESSION_THRESHOLD = 0.25 # flag a stage whose median time grew by more than this fraction
+REGRESSION_FLOOR = 0.002 # seconds; smaller slowdowns are timer noise
+STREAM_TIME_SCALE = 1e6 # simulated plotter runs this much faster than real time, so streaming is host bound
+
+
+def pot_matrix(random_vectors=8, corners="edges", seed=0):
+    '''
+    Pot vectors (raw 0-1023 values) to benchmark
+
+    Args:
+        random_vectors: how many uniformly random vectors to add
+        corners: "none", "edges" (all low, all high and each pot alone at the
+            other extreme, 22 vectors) or "all" (every one of the 1024 corners)
+        seed: seed for the random vectors
+    '''
+
+    lo, hi = 0, 1023
+    vectors = []
+    if corners == "edges":
+        vectors.append([lo]*NUM_POTS)
+        vectors.append([hi]*NUM_POTS)
+        for i in range(NUM_POTS):
+            vectors.append([hi if k == i else lo for k in range(NUM_POTS)])
+            vectors.append([lo if k == i else hi for k in range(NUM_POTS)])
+    elif corners == "all":
+        for bits in range(2**NUM_POTS):
+            vectors.append([hi if bits >> k & 1 else lo for k in range(NUM_POTS)])
+    elif corners != "none":
+        raise ValueError("corners must be none, edges or all, not %r" % corners)
+
+    rng = random.Random(seed)
+    vectors.extend([rng.randrange(1024) for _ in range(NUM_POTS)] for _ in range(random_vectors))
+    return vectors
+
+def run_case(values, seed, tmp_dir, stream_gcode=True):
+    '''
+    Runs one pot vector / seed through every stage
+
+    Returns a dict with the stage times (seconds) and the output measurements
+    '''
+
+    times = {}
+    case = {"values": list(values), "seed": seed, "times": times}
+    surface = pygame.Surface(DIMENSIONS)
+    # no caches, every stage does its full work
+    drawing = ArtproofDrawing(DIMENSIONS, values, surface, cache_size=0, surface_cache_size=0)
+
+    t = time.perf_counter()
+    drawing.update(values, seed)
+    times["update"] = time.perf_counter() - t
+    case["slices"] = len(drawing.slices)
+    case["wedges"] = len(drawing.wedges)
+
+    t = time.perf_counter()
+    drawing.draw()
+    times["draw"] = time.perf_counter() - t
+
+    fname_svg = os.path.join(tmp_dir, "bench.svg")
+    t = time.perf_counter()
+    drawing.to_svg(fname_svg)
+    times["svg"] = time.perf_counter() - t
+    case["svg_bytes"] = os.path.getsize(fname_svg)
+
+    fname_gcode = os.path.join(tmp_dir, "bench.gcode")
+    t = time.perf_counter()
+    paths = export.export_drawing(drawing, fname_gcode=fname_gcode, time_budget=None) # same G-code every run
+    times["gcode"] = time.perf_counter() - t
+    with open(fname_gcode) as f:
+        case["gcode_lines"] = sum(1 for _ in f)
+    case["gcode_bytes"] = os.path.getsize(fname_gcode)
+    case["pen_down_mm"] = paths["after"].pen_down
+    case["pen_up_mm"] = paths["after"].pen_up
+    case["strokes"] = paths["after"].strokes
+    case["removed_mm"] = paths["removed_mm"] # retraced lines dedup left out
+    case["plot_estimate"] = plottime.estimate_gcode(fname_gcode).seconds # with acceleration, unlike the simulator
+
+    if stream_gcode:
+        port = grblsim.FakeSerial(timeout=1.0, time_scale=STREAM_TIME_SCALE)
+        port.readline() # startup banner
+        port.readline()
+        t = time.perf_counter()
+        with open(fname_gcode) as f:
+            stats = stream.stream_gcode(port, f)
+        times["stream"] = time.perf_counter() - t
+        sim = port.sim.summary()
+        case["plot_seconds"] = sim["motion_seconds"] # how long the real plotter would be moving
+        case["stream_errors"] = sim["errors"] + stats.errors
+
+    return case
+
+def summarize(cases):
+    '''
+    Median / p95 / max / total time of every stage over all cases
+    '''
+
+    summary = {}
+    for stage in STAGES:
+        samples = sorted(case["times"][stage] for case in cases if stage in case["times"])
+        if not samples:
+            continue
+        summary[stage] = {
+            "median": statistics.median(samples),
+            "p95": samples[min(len(samples) - 1, int(0.95*len(samples)))],
+            "max": samples[-1],
+            "total": sum(samples),
+        }
+    return summary
+
+def run(vectors, seeds, stream_gcode=True, progress=None):
+    '''
+    Benchmarks every pot vector with every seed
+
+    Args:
+        vectors: list of pot vectors (see pot_matrix)
+        seeds: list of seeds
+        stream_gcode: include the streaming stage
+        progress: optional callable(done, total)
+
+    Returns the results dict that gets written as JSON
+    '''
+
+    cases = []
+    total = len(vectors)*len(seeds)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for values in vectors:
+            for seed in seeds:
+                cases.append(run_case(values, seed, tmp_dir, stream_gcode))
+                if progress:
+                    progress(len(cases), total)
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "cases": len(cases),
+        },
+        "summary": summarize(cases),
+        "cases": cases,
+    }
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    '''
+    Compares a run against a baseline run
+
+    Returns (regressions, changes): lists of human readable lines. Regressions are
+    stages whose median got slower than the threshold allows (and by more than
+    REGRESSION_FLOOR), changes are cases
+    present in both runs whose outputs differ. Only outputs that don't depend on
+    timing are compared.
+    '''
+
+    regressions = []
+    for stage, now in results["summary"].items():
+        then = baseline["summary"].get(stage)
+        if not then or not then["median"]:
+            continue
+        ratio = now["median"]/then["median"]
+        if ratio > 1 + threshold and now["median"] - then["median"] > REGRESSION_FLOOR:
+            regressions.append("%s: median %.1fms -> %.1fms (%+.0f%%)" % (
+                stage, 1000*then["median"], 1000*now["median"], 100*(ratio - 1)))
+
+    outputs = ("slices", "wedges", "svg_bytes", "gcode_lines", "gcode_bytes", "strokes", "stream_errors")
+    key = lambda case: (tuple(case["values"]), case["seed"])
+    before = {key(case): case for case in baseline["cases"]}
+    changes = []
+    for case in results["cases"]:
+        old = before.get(key(case))
+        if old is None:
+            continue
+        diff = ["%s %s -> %s" % (name, old.get(name), case.get(name)) for name in outputs if old.get(name) != case.get(name)]
+        if diff:
+            changes.append("%s seed %d: %s" % (case["values"], case["seed"], ", ".join(diff)))
+    return regressions, changes
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Time the drawing pipeline and compare against a baseline')
+    parser.add_argument('-n', '--random', type=int, default=8, help='random pot vectors on top of the corners (default %(default)s)')
+    parser.add_argument('-c', '--corners', choices=('none', 'edges', 'all'), default='edges',
+            help='which corners of the pot space to include (default %(default)s)')
+    parser.add_argument('-s', '--seeds', type=int, default=3, help='seeds per pot vector (default %(default)s)')
+    parser.add_argument('-o', '--output', default=None, help='write the results JSON here')
+    parser.add_argument('-b', '--baseline', default=BASELINE_FILE, help='baseline results to compare against (default %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', default=False, help='store this run as the baseline')
+    parser.add_argument('--no-stream', action='store_false', dest='stream', default=True, help='skip the streaming stage')
+    parser.add_argument('-t', '--threshold', type=float, default=REGRESSION_THRESHOLD,
+            help='allowed slowdown of a stage median before it is flagged (default %(default)s)')
+    args = parser.parse_args()
+
+    vectors = pot_matrix(args.random, args.corners)
+    show = lambda done, total: print("\r%d/%d cases" % (done, total), end="", file=sys.stderr, flush=True)
+    results = run(vectors, list(range(args.seeds)), args.stream, progress=show)
+    print(file=sys.stderr)
+
+    for stage, s in results["summary"].items():
+        print("%-7s median %7.1fms  p95 %7.1fms  max %7.1fms" % (stage, 1000*s["median"], 1000*s["p95"], 1000*s["max"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+        print("saved baseline to", args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions, changes = compare(results, baseline, args.threshold)
+        for line in changes:
+            print("changed:", line)
+        for line in regressions:
+            print("REGRESSION:", line)
+        if regressions:
+            sys.exit(1)
+        print("no regressions against", args.baseline)
+    else:
+        print("no baseline at %s, run with --save-baseline to make one" % args.baseline)
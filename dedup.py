@@ -0,0 +1,289 @@
+#! /usr/bin/env python3
+# This file removes stroke sections that retrace something already drawn
+'''
+Overlap removal for plotter strokes (see paths.py).
+
+Neighbouring slices share their radial edges, the arcs of consecutive layers
+can land within a fraction of a millimetre of each other, and wedge sides run
+along slice edges. Plotted as is, the pen goes over all of those twice.
+
+Strokes are walked in order, keeping track of what has been drawn so far. The
+part of a straight segment that runs within `tolerance` of an already drawn,
+(nearly) parallel segment is taken out, and so is the part of an arc that lies
+on an already drawn arc with the same center and a radius within `tolerance`.
+Crossings are left alone: only near-parallel lines and co-circular arcs count.
+
+Taking out the middle of a stroke splits it and costs a pen lift, so a gap in
+the middle of a stroke is only made when it is at least `min_gap` long; shorter
+overlaps are drawn again. Overlaps at either end of a stroke just shorten it.
+
+    strokes, removed = dedup_strokes(strokes, tolerance=1.0, min_gap=40.0)
+'''
+import collections
+import math
+
+import numpy as np
+
+from paths import Arc, stroke_length
+
+MAX_SINE = 0.02 # segments more than ~1 degree apart are crossing, not overlapping
+ANGLE_BIN = MAX_SINE # radians per direction bucket, so overlapping segments are at most one bucket apart
+
+
+def _subtract(intervals, lo=0.0, hi=1.0):
+    '''
+    The parts of [lo, hi] not covered by any of the (start, end) intervals, as a sorted list
+    '''
+    free = []
+    at = lo
+    for a, b in sorted(intervals):
+        if a > at:
+            free.append((at, min(a, hi)))
+        at = max(at, b)
+        if at >= hi:
+            break
+    if at < hi:
+        free.append((at, hi))
+    return [(a, b) for a, b in free if b > a]
+
+
+class DrawnSet:
+    '''
+    What has been drawn so far: straight segments bucketed by direction and arcs
+    bucketed by radius, each answering "which part of this is already drawn?"
+    '''
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.angle_bins = max(1, int(round(math.pi/ANGLE_BIN)))
+        self.segments = collections.defaultdict(list) # direction bin -> [(p0, unit, length)]
+        self.arcs = collections.defaultdict(list) # radius bin -> [(cx, cy, r, lo, hi)]
+
+    def _angle_bin(self, ux, uy):
+        angle = math.atan2(uy, ux) % math.pi
+        return int(angle/math.pi*self.angle_bins) % self.angle_bins
+
+    def add_segment(self, p0, p1):
+        dx, dy = p1[0] - p0[0], p1[1] - p0[1]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return
+        ux, uy = dx/length, dy/length
+        self.segments[self._angle_bin(ux, uy)].append((p0, (ux, uy), length))
+
+    def add_arc(self, arc):
+        lo, hi = sorted((arc.start, arc.end))
+        self.arcs[int(arc.r/self.tolerance)].append((arc.cx, arc.cy, arc.r, lo, hi))
+
+    def covered_segment(self, p0, p1):
+        '''
+        Parts of the segment p0 -> p1 already drawn, as (u0, u1) fractions along it
+        '''
+        dx, dy = p1[0] - p0[0], p1[1] - p0[1]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return []
+        ux, uy = dx/length, dy/length
+        b = self._angle_bin(ux, uy)
+        tol = self.tolerance
+        covered = []
+        for k in (b - 1, b, b + 1):
+            for q0, (vx, vy), q_length in self.segments.get(k % self.angle_bins, ()):
+                if abs(ux*vy - uy*vx) > MAX_SINE:
+                    continue
+                # distance of the segment's points from the drawn one's line, linear in u
+                h0 = -vy*(p0[0] - q0[0]) + vx*(p0[1] - q0[1])
+                h1 = -vy*(p1[0] - q0[0]) + vx*(p1[1] - q0[1])
+                u_lo, u_hi = _linear_band(h0, h1, -tol, tol)
+                if u_lo >= u_hi:
+                    continue
+                # and where they are alongside it
+                t0 = vx*(p0[0] - q0[0]) + vy*(p0[1] - q0[1])
+                t1 = vx*(p1[0] - q0[0]) + vy*(p1[1] - q0[1])
+                a, c = _linear_band(t0, t1, 0.0, q_length)
+                a, c = max(a, u_lo), min(c, u_hi)
+                if c > a:
+                    covered.append((a, c))
+        return covered
+
+    def covered_arc(self, arc):
+        '''
+        Parts of the arc already drawn, as (u0, u1) fractions from its start to its end
+        '''
+        sweep = arc.end - arc.start
+        if sweep == 0:
+            return []
+        lo, hi = sorted((arc.start, arc.end))
+        tol = self.tolerance
+        covered = []
+        b = int(arc.r/tol)
+        for k in (b - 1, b, b + 1):
+            for cx, cy, r, c_lo, c_hi in self.arcs.get(k, ()):
+                if abs(r - arc.r) > tol or math.hypot(cx - arc.cx, cy - arc.cy) > tol:
+                    continue
+                # the drawn arc may be a full turn away
+                first = math.floor((lo - c_hi)/(2*math.pi))
+                last = math.ceil((hi - c_lo)/(2*math.pi))
+                for turn in range(first, last + 1):
+                    a = max(lo, c_lo + 2*math.pi*turn)
+                    c = min(hi, c_hi + 2*math.pi*turn)
+                    if c > a:
+                        u_a, u_c = (a - arc.start)/sweep, (c - arc.start)/sweep
+                        covered.append((min(u_a, u_c), max(u_a, u_c)))
+        return covered
+
+
+def _linear_band(v0, v1, lo, hi):
+    '''
+    The u in [0, 1] for which v0 + u*(v1 - v0) lies within [lo, hi], as (u_lo, u_hi)
+    (empty when u_lo >= u_hi)
+    '''
+    if v0 == v1:
+        return (0.0, 1.0) if lo <= v0 <= hi else (1.0, 0.0)
+    a, b = (lo - v0)/(v1 - v0), (hi - v0)/(v1 - v0)
+    if a > b:
+        a, b = b, a
+    return max(a, 0.0), min(b, 1.0)
+
+
+# one piece of a stroke, cut down to [u0, u1]: an Arc, or a segment (p0, p1) of a polyline
+_Part = collections.namedtuple("_Part", "piece index u0 u1 length keep")
+
+def _sub_arc(arc, u0, u1):
+    return Arc(arc.cx, arc.cy, arc.r, arc.start + arc.sweep*u0, arc.start + arc.sweep*u1)
+
+def _sub_point(p0, p1, u):
+    return (p0[0] + (p1[0] - p0[0])*u, p0[1] + (p1[1] - p0[1])*u)
+
+def _split(stroke, drawn):
+    '''
+    Cuts the stroke into parts that are already drawn (keep=False) or not, adding
+    the new ones to `drawn` as it goes
+    '''
+    parts = []
+    for piece in stroke:
+        if isinstance(piece, Arc):
+            items = [(piece, None, piece.length())]
+        else:
+            points = piece.tolist()
+            items = [((points[i], points[i + 1]), i, math.dist(points[i], points[i + 1])) for i in range(len(points) - 1)]
+        for geometry, index, length in items:
+            if length == 0:
+                continue
+            if index is None:
+                covered = drawn.covered_arc(geometry)
+            else:
+                covered = drawn.covered_segment(*geometry)
+            free = _subtract(covered)
+            at = 0.0
+            for u0, u1 in free:
+                if u0 > at:
+                    parts.append(_Part(geometry, index, at, u0, length*(u0 - at), False))
+                parts.append(_Part(geometry, index, u0, u1, length*(u1 - u0), True))
+                if index is None:
+                    drawn.add_arc(_sub_arc(geometry, u0, u1))
+                else:
+                    drawn.add_segment(_sub_point(*geometry, u0), _sub_point(*geometry, u1))
+                at = u1
+            if at < 1.0:
+                parts.append(_Part(geometry, index, at, 1.0, length*(1.0 - at), False))
+    return parts
+
+def _runs(parts):
+    '''
+    Groups consecutive parts with the same keep flag: [(keep, length, [parts])]
+    '''
+    runs = []
+    for part in parts:
+        if runs and runs[-1][0] == part.keep:
+            runs[-1][1] += part.length
+            runs[-1][2].append(part)
+        else:
+            runs.append([part.keep, part.length, [part]])
+    return runs
+
+def _build(parts):
+    '''
+    A stroke from consecutive kept parts
+    '''
+    stroke = []
+    points = None
+    for part in parts:
+        if part.index is None:
+            if points:
+                stroke.append(np.array(points))
+                points = None
+            stroke.append(_sub_arc(part.piece, part.u0, part.u1))
+            continue
+        p0, p1 = part.piece
+        start, end = _sub_point(p0, p1, part.u0), _sub_point(p0, p1, part.u1)
+        if points is None:
+            points = [start]
+        points.append(end)
+    if points:
+        stroke.append(np.array(points))
+    return stroke
+
+def dedup_strokes(strokes, tolerance, min_gap=0.0):
+    '''
+    Removes the parts of strokes that retrace already drawn ones
+
+    Args:
+        strokes: list of strokes, in drawing order
+        tolerance: how close (in stroke units) two lines or arcs have to be to count as one
+        min_gap: shortest overlap taken out of the middle of a stroke (shorter ones are
+            drawn again instead of lifting the pen twice)
+
+    Returns (strokes, removed pen-down length)
+    '''
+
+    drawn = DrawnSet(tolerance)
+    out = []
+    removed = 0.0
+    for stroke in strokes:
+        runs = _runs(_split(stroke, drawn))
+        # specks left between two removed stretches aren't worth putting the pen down for
+        for i, run in enumerate(runs):
+            if run[0] and run[1] < tolerance and 0 < i < len(runs) - 1:
+                run[0] = False
+        runs = _runs([part._replace(keep=run[0]) for run in runs for part in run[2]])
+        # short gaps in the middle get drawn again
+        for i, run in enumerate(runs):
+            if not run[0] and run[1] < min_gap and 0 < i < len(runs) - 1:
+                run[0] = True
+                for part in run[2]:
+                    if part.index is None:
+                        drawn.add_arc(_sub_arc(part.piece, part.u0, part.u1))
+                    else:
+                        drawn.add_segment(_sub_point(*part.piece, part.u0), _sub_point(*part.piece, part.u1))
+        runs = _runs([part._replace(keep=run[0]) for run in runs for part in run[2]])
+        for keep, length, parts in runs:
+            if keep:
+                out.append(_build(parts))
+            else:
+                removed += length
+    return out, removed
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import export
+    from art import ArtproofDrawing
+
+    parser = argparse.ArgumentParser(description='Show how much retracing dedup_strokes takes out of generated drawings')
+    parser.add_argument('-s', '--seeds', type=int, default=5, help='drawings to try (default %(default)s)')
+    parser.add_argument('-v', '--value', type=int, default=512, help='value for every pot (default %(default)s)')
+    args = parser.parse_args()
+
+    for seed in range(args.seeds):
+        values = [args.value]*10
+        drawing = ArtproofDrawing((600, 600), values, None, cache_size=0, surface_cache_size=0)
+        drawing.update(values, seed)
+        strokes = export.plot_strokes(drawing)
+        before = sum(stroke_length(s) for s in strokes)
+        deduped, removed = dedup_strokes(strokes, export.DEDUP_TOLERANCE, export.DEDUP_MIN_GAP)
+        print("seed %d: %.0fmm -> %.0fmm pen down (-%.1f%%), %d -> %d strokes" % (
+            seed, before/export.PX_PER_MM, (before - removed)/export.PX_PER_MM, 100*removed/before if before else 0,
+            len(strokes), len(deduped)), file=sys.stdout)
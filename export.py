@@ -0,0 +1,571 @@
+#! /usr/bin/env python3
+# This file turns a drawing into the plotter's SVG and G-code
+'''
+In-process replacement for the three vpype commands the UI used to run:
+
+    vpype read drawing.svg scaleto 4.5in 4.5in layout -m .5in -v top 5.5x7in linesimplify -t 0.05mm write drawing.svg
+    vpype read party_signature.svg scaleto 4.05in 1.05in layout -h center -v bottom 5.5x6.5in read drawing.svg write drawing.svg
+    vpype -c test_party_config.cfg read drawing.svg linemerge linesort gwrite -p test_party_config drawing.gcode
+
+The drawing's strokes go straight through the same steps in memory, so nothing
+is parsed back from disk. linemerge and linesort are replaced by pathopt.optimize.
+Arcs stay arcs all the way to the G-code: if the profile has arc_cw / arc_ccw
+templates they are written as G2/G3 moves, otherwise (and for arcs too small to
+be worth it) they are flattened with the same 0.05mm tolerance linesimplify used.
+'''
+import concurrent.futures
+import functools
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import re
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+try:
+    import tomllib
+except ModuleNotFoundError: # python < 3.11
+    import tomli as tomllib
+
+import artcache
+import dedup
+import pathopt
+import plottime
+from paths import Arc, arc_segments, bounds, piece_start, simplify_strokes, stroke_to_polyline, tessellate_arc, transform_strokes
+from svgout import SVGWriter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIGNATURE_FILE = os.path.join(HERE, "party_signature.svg")
+CONFIG_FILE = os.path.join(HERE, "test_party_config.cfg")
+PROFILE = "test_party_config"
+
+# everything on the page is in SVG pixels, like vpype
+PX_PER_IN = 96.0
+PX_PER_MM = PX_PER_IN/25.4
+UNITS = {"px": 1.0, "in": PX_PER_IN, "mm": PX_PER_MM, "cm": 10*PX_PER_MM}
+
+PAGE_SIZE = (5.5*PX_PER_IN, 7*PX_PER_IN)
+DRAWING_SIZE = (4.5*PX_PER_IN, 4.5*PX_PER_IN)
+DRAWING_MARGIN = 0.5*PX_PER_IN
+SIGNATURE_SIZE = (4.05*PX_PER_IN, 1.05*PX_PER_IN)
+SIGNATURE_PAGE_SIZE = (5.5*PX_PER_IN, 6.5*PX_PER_IN)
+TOLERANCE = 0.05*PX_PER_MM # linesimplify / arc flattening tolerance
+MERGE_TOLERANCE = 0.05*PX_PER_MM # linemerge default
+OPTIMIZE_TIME_BUDGET = 5.0 # safety cap on 2-opt per export; it normally converges well within pathopt.TWO_OPT_PASSES
+DEDUP_TOLERANCE = 0.1*PX_PER_MM # lines / arcs closer than this are drawn once; well under the ~0.24mm tightest hatch pitch
+DEDUP_MIN_GAP = 20*PX_PER_MM # shorter retraced stretches in the middle of a stroke are cheaper to redraw than to lift over
+ARC_GAP = 0.001 # (machine units) largest jump into the start of an arc move
+
+_XY_WORD = re.compile(r"([XY])\s*([-+]?(?:\d*\.\d+|\d+\.?))", re.IGNORECASE)
+_NUMBER = re.compile(r"[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+
+
+@functools.lru_cache(maxsize=None)
+def load_signature(fname=SIGNATURE_FILE):
+    '''
+    Reads the polylines and polygons of the signature SVG as strokes (cached, don't modify)
+    '''
+
+    strokes = []
+    for elt in ET.parse(fname).iter():
+        tag = elt.tag.rsplit('}', 1)[-1]
+        if tag not in ("polyline", "polygon"):
+            continue
+        points = np.array([float(v) for v in _NUMBER.findall(elt.get("points", ""))]).reshape(-1, 2)
+        if tag == "polygon" and len(points):
+            points = np.concatenate((points, points[:1]))
+        if len(points) > 1:
+            strokes.append([points])
+    return tuple(strokes)
+
+@functools.lru_cache(maxsize=None)
+def load_profile(config=CONFIG_FILE, profile=PROFILE):
+    '''
+    Reads a vpype gwrite profile from a TOML config file (cached, don't modify)
+    '''
+
+    with open(config, "rb") as f:
+        return tomllib.load(f)["gwrite"][profile]
+
+def scale_to(strokes, width, height):
+    '''
+    Uniformly scales the strokes around their center to fit in width x height (vpype scaleto)
+    '''
+
+    b = bounds(strokes)
+    if b is None:
+        return list(strokes)
+    w, h = b[2] - b[0], b[3] - b[1]
+    factor = min(width/w if w else math.inf, height/h if h else math.inf)
+    if math.isinf(factor):
+        return list(strokes)
+    cx, cy = (b[0] + b[2])/2, (b[1] + b[3])/2
+    return transform_strokes(strokes, factor, (cx - cx*factor, cy - cy*factor))
+
+def layout(strokes, page_size, margin=None, halign="center", valign="center"):
+    '''
+    Positions the strokes on a page (vpype layout). With a margin the strokes are
+    first scaled to fill the page inside it, and the alignment is relative to that area.
+
+    Args:
+        strokes: list of strokes
+        page_size: (width, height)
+        margin: None, or the margin to fit to
+        halign: left, center or right
+        valign: top, center or bottom
+    '''
+
+    width, height = page_size
+    inset = 0.0 if margin is None else margin
+    if margin is not None:
+        strokes = scale_to(strokes, width - 2*margin, height - 2*margin)
+    b = bounds(strokes)
+    if b is None:
+        return list(strokes)
+
+    dx = {"left": inset - b[0],
+          "center": width/2 - (b[0] + b[2])/2,
+          "right": width - inset - b[2]}[halign]
+    dy = {"top": inset - b[1],
+          "center": height/2 - (b[1] + b[3])/2,
+          "bottom": height - inset - b[3]}[valign]
+    return transform_strokes(strokes, 1.0, (dx, dy))
+
+def plot_strokes(drawing, signature=SIGNATURE_FILE):
+    '''
+    The drawing laid out on the 5.5x7in page with the signature under it, in page pixels
+    '''
+
+    strokes = scale_to(drawing.to_strokes(), *DRAWING_SIZE)
+    strokes = layout(strokes, PAGE_SIZE, margin=DRAWING_MARGIN, valign="top")
+    strokes = simplify_strokes(strokes, TOLERANCE)
+
+    sig = scale_to(load_signature(signature), *SIGNATURE_SIZE)
+    sig = layout(sig, SIGNATURE_PAGE_SIZE, halign="center", valign="bottom")
+
+    # same order vpype ended up with: the signature was read first
+    return sig + strokes
+
+def write_svg(strokes, output, page_size=PAGE_SIZE, precision=3):
+    '''
+    Saves the strokes as an SVG page (one path per stroke)
+
+    Args:
+        strokes: list of strokes, in page pixels
+        output: file name or writable text file
+        page_size: page (width, height)
+        precision: decimals written for coordinates
+    '''
+
+    width, height = page_size
+    size = ("%gin" % (width/PX_PER_IN), "%gin" % (height/PX_PER_IN))
+    with SVGWriter(output, size, view_box=(0, 0, width, height), precision=precision) as svg:
+        for stroke in strokes:
+            svg.path([stroke])
+
+def _to_machine(strokes, profile, page_size):
+    '''
+    Applies the gwrite unit, flip, scale/offset and axis inversion settings
+    '''
+
+    unit = UNITS[profile.get("unit", "mm")]
+    strokes = transform_strokes(strokes, 1.0/unit)
+    width, height = page_size[0]/unit, page_size[1]/unit
+    if profile.get("horizontal_flip", False):
+        strokes = transform_strokes(strokes, 1.0, (width, 0.0), flip_x=True)
+    if profile.get("vertical_flip", False):
+        strokes = transform_strokes(strokes, 1.0, (0.0, height), flip_y=True)
+
+    sx, sy = profile.get("scale_x", 1), profile.get("scale_y", 1)
+    offset = (profile.get("offset_x", 0), profile.get("offset_y", 0))
+    if abs(sx) != abs(sy): # arcs can't survive a non-uniform scale
+        tolerance = TOLERANCE/unit/max(abs(sx), abs(sy))
+        strokes = [[stroke_to_polyline(s, tolerance)*(sx, sy) + offset] for s in strokes]
+    else:
+        strokes = transform_strokes(strokes, abs(sx), offset, flip_x=sx < 0, flip_y=sy < 0)
+
+    # invert_x / invert_y mirror the geometry in place, around the center of its bounds
+    invert_x, invert_y = profile.get("invert_x", False), profile.get("invert_y", False)
+    b = bounds(strokes)
+    if b is not None and (invert_x or invert_y):
+        strokes = transform_strokes(strokes, 1.0, (b[0] + b[2] if invert_x else 0.0, b[1] + b[3] if invert_y else 0.0), flip_x=invert_x, flip_y=invert_y)
+    return strokes, unit
+
+def machine_start(profile):
+    '''
+    Where document_start leaves the pen (the last X and Y it moves to, in machine
+    units), which is where travel to the first stroke starts from
+    '''
+
+    position = {"X": 0.0, "Y": 0.0}
+    for letter, value in _XY_WORD.findall(re.sub(r"\(.*?\)|;.*", "", profile.get("document_start") or "")):
+        position[letter.upper()] = float(value)
+    return position["X"], position["Y"]
+
+def machine_to_page(point, strokes, profile, page_size=PAGE_SIZE):
+    '''
+    Maps a point in machine units back to page pixels, undoing _to_machine. The
+    strokes are needed because invert_x / invert_y mirror around their bounds.
+    '''
+
+    unit = UNITS[profile.get("unit", "mm")]
+    width, height = page_size[0]/unit, page_size[1]/unit
+    hflip, vflip = profile.get("horizontal_flip", False), profile.get("vertical_flip", False)
+    sx, sy = profile.get("scale_x", 1), profile.get("scale_y", 1)
+    ox, oy = profile.get("offset_x", 0), profile.get("offset_y", 0)
+
+    def forward(x, y): # _to_machine up to the inversion
+        x, y = x/unit, y/unit
+        x, y = (width - x if hflip else x), (height - y if vflip else y)
+        return x*sx + ox, y*sy + oy
+
+    x, y = point
+    invert_x, invert_y = profile.get("invert_x", False), profile.get("invert_y", False)
+    b = bounds(strokes)
+    if b is not None and (invert_x or invert_y):
+        (x0, y0), (x1, y1) = forward(b[0], b[1]), forward(b[2], b[3])
+        x, y = (x0 + x1 - x if invert_x else x), (y0 + y1 - y if invert_y else y)
+    x, y = (x - ox)/sx, (y - oy)/sy
+    x, y = (width - x if hflip else x), (height - y if vflip else y)
+    return x*unit, y*unit
+
+def _gcode_moves(stroke, tolerance, arcs):
+    '''
+    The moves of one stroke as (x, y, arc) tuples: the first is where the pen goes
+    down, arc is None for a straight move or (i, j, ccw) for a circular one
+    '''
+
+    x, y = piece_start(stroke[0])
+    moves = [(x, y, None)]
+    for piece in stroke:
+        if not isinstance(piece, Arc):
+            moves.extend((x, y, None) for x, y in piece[1:].tolist())
+        elif arcs and arc_segments(piece, tolerance) > 1:
+            # merged strokes can leave a gap (up to the merge tolerance) in front of an arc;
+            # close it with a line so grbl measures the same radius at both ends of the arc
+            sx, sy = piece.point(piece.start)
+            px, py = moves[-1][:2]
+            if math.hypot(sx - px, sy - py) > ARC_GAP:
+                moves.append((sx, sy, None))
+            # at most a half turn per move, so the end point never lands back on the start
+            parts = max(1, math.ceil(abs(piece.sweep)/math.pi - 1e-9))
+            ccw = piece.end > piece.start
+            for k in range(parts):
+                sx, sy = piece.point(piece.start + piece.sweep*k/parts)
+                ex, ey = piece.point(piece.start + piece.sweep*(k + 1)/parts)
+                moves.append((ex, ey, (piece.cx - sx, piece.cy - sy, ccw)))
+        else: # a single chord is within tolerance, a line is as good as an arc
+            moves.extend((x, y, None) for x, y in tessellate_arc(piece, tolerance)[1:].tolist())
+    return moves
+
+def write_gcode(strokes, output, profile=None, page_size=PAGE_SIZE):
+    '''
+    Writes strokes (in page pixels) as G-code using a vpype gwrite profile.
+
+    On top of the vpype templates the profile may have arc_cw and arc_ccw, which
+    get the same variables as segment plus i and j (center offset from the arc's
+    start). Without them every arc is flattened into segment moves.
+
+    Args:
+        strokes: list of strokes, already merged and sorted
+        output: file name or writable text file
+        profile: gwrite settings dict (defaults to test_party_config)
+        page_size: page (width, height), used by the flip options
+    '''
+
+    if profile is None:
+        profile = load_profile()
+    strokes, unit = _to_machine(strokes, profile, page_size)
+    tolerance = TOLERANCE/unit
+
+    template = lambda name: profile.get(name) or None
+    document_start, document_end = template("document_start"), template("document_end")
+    layer_start, layer_end = template("layer_start"), template("layer_end")
+    line_start, line_end, line_join = template("line_start"), template("line_end"), template("line_join")
+    segment_first, segment, segment_last = template("segment_first"), template("segment"), template("segment_last")
+    arc_cw, arc_ccw = template("arc_cw"), template("arc_ccw")
+    arcs = bool(arc_cw and arc_ccw)
+
+    out = []
+    if document_start:
+        out.append(document_start)
+    # single layer, like the merged vpype document
+    if layer_start:
+        out.append(layer_start.format(index=0, index1=1, layer_index=0, layer_index1=1, layer_id=1, filename=""))
+
+    last_x = last_y = 0.0
+    ix = iy = 0
+    for line_index, stroke in enumerate(strokes):
+        moves = _gcode_moves(stroke, tolerance, arcs)
+        if line_start:
+            out.append(line_start.format(index=line_index, index1=line_index + 1))
+        last_index = len(moves) - 1
+        for segment_index, (x, y, arc) in enumerate(moves):
+            dx, dy = x - last_x, y - last_y
+            idx, idy = int(round(x - ix)), int(round(y - iy))
+            ix += idx
+            iy += idy
+            last_x, last_y = x, y
+            values = dict(x=x, y=y, dx=dx, dy=dy, _x=-x, _y=-y, _dx=-dx, _dy=-dy,
+                          ix=ix, iy=iy, idx=idx, idy=idy, index=segment_index, index1=segment_index + 1)
+            if arc is not None:
+                i, j, ccw = arc
+                out.append((arc_ccw if ccw else arc_cw).format(i=i, j=j, **values))
+                continue
+            if segment_first and segment_index == 0:
+                seg = segment_first
+            elif segment_last and segment_index == last_index:
+                seg = segment_last
+            else:
+                seg = segment
+            if seg:
+                out.append(seg.format(**values))
+        if line_end:
+            out.append(line_end.format(index=line_index, index1=line_index + 1))
+        if line_join and line_index != len(strokes) - 1:
+            out.append(line_join)
+
+    if layer_end:
+        out.append(layer_end.format(index=0, index1=1, layer_index=0, layer_index1=1, layer_id=1, filename=""))
+    if document_end:
+        out.append(document_end)
+
+    text = "".join(out)
+    if hasattr(output, "write"):
+        output.write(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text)
+
+def export_drawing(drawing, fname_svg=None, fname_gcode=None, profile=None, progress=None, time_budget=OPTIMIZE_TIME_BUDGET,
+                   min_gap=DEDUP_MIN_GAP):
+    '''
+    Lays out the drawing with the signature and writes the page SVG and/or the G-code
+
+    Args:
+        drawing: an ArtproofDrawing that has been updated
+        fname_svg: where to save the laid out SVG (skipped if None)
+        fname_gcode: where to save the G-code (skipped if None)
+        profile: gwrite settings dict (defaults to test_party_config)
+        progress: optional callable(stage, fraction) told about each finished step
+        time_budget: safety cap in seconds on 2-opt path refinement (see pathopt.two_opt)
+        min_gap: see dedup.dedup_strokes (None to keep retraced lines)
+
+    Returns the path optimizer's {"before": PathStats, "after": PathStats} in mm, plus
+    "laid_out" for the strokes before retraced lines were removed and "removed_mm",
+    the pen-down length that took out (None if no G-code was written)
+    '''
+
+    report = progress or (lambda stage, fraction: None)
+    strokes = plot_strokes(drawing)
+    laid_out = pathopt.path_stats(strokes)
+    removed = 0.0
+    if min_gap is not None:
+        strokes, removed = dedup.dedup_strokes(strokes, DEDUP_TOLERANCE, min_gap)
+    report("layout", 0.2)
+    if fname_svg:
+        write_svg(strokes, fname_svg)
+        report("svg", 0.4)
+    stats = None
+    if fname_gcode:
+        if profile is None:
+            profile = load_profile()
+        # the pen starts wherever document_start parks it, not at the page origin
+        start = machine_to_page(machine_start(profile), strokes, profile)
+        strokes, stats = pathopt.optimize(strokes, MERGE_TOLERANCE, start=start, time_budget=time_budget)
+        stats["laid_out"] = laid_out
+        stats = {k: pathopt.PathStats(v.pen_down/PX_PER_MM, v.pen_up/PX_PER_MM, v.strokes) for k, v in stats.items()}
+        stats["removed_mm"] = removed/PX_PER_MM
+        report("optimize", 0.7)
+        write_gcode(strokes, fname_gcode, profile)
+    report("done", 1.0)
+    return stats
+
+def _stats_to_json(stats):
+    return {k: list(v) if isinstance(v, tuple) else v for k, v in stats.items()} if stats else None
+
+def _stats_from_json(stats):
+    return {k: pathopt.PathStats(*v) if isinstance(v, list) else v for k, v in stats.items()} if stats else None
+
+# progress queue of the current worker process, set up by _init_worker
+_progress = None
+
+def _init_worker(progress_queue):
+    global _progress
+    _progress = progress_queue
+
+def _run_export_job(job_id, dimensions, values, seed, fname_svg, fname_gcode, fname_geometry=None):
+    '''
+    Worker side of ExportPool: regenerates the drawing from the snapshot and exports it.
+    Files are written under a temporary name and renamed when complete, so nothing
+    watching the output folder ever sees half a file. With fname_geometry the
+    slices and wedges are saved there too (see ArtproofDrawing.save_geometry).
+
+    Returns (path optimizer stats, plottime.PlotEstimate of the G-code or None)
+    '''
+    from art import ArtproofDrawing
+
+    def report(stage, fraction):
+        if _progress is not None:
+            _progress.put((job_id, stage, fraction))
+
+    report("generating", 0.0)
+    drawing = ArtproofDrawing(dimensions, values, None, cache_size=0, surface_cache_size=0)
+    drawing.update(values, seed)
+
+    tmp_svg = fname_svg + ".part" if fname_svg else None
+    tmp_gcode = fname_gcode + ".part" if fname_gcode else None
+    stats = export_drawing(drawing, tmp_svg, tmp_gcode, progress=report)
+    estimate = plottime.estimate_gcode(tmp_gcode) if tmp_gcode else None
+    tmp_geometry = None
+    if fname_geometry:
+        tmp_geometry = fname_geometry + ".part"
+        with open(tmp_geometry, "wb") as f:
+            drawing.save_geometry(f)
+    for tmp, final in ((tmp_svg, fname_svg), (tmp_gcode, fname_gcode), (tmp_geometry, fname_geometry)):
+        if tmp:
+            os.replace(tmp, final)
+    return stats, estimate
+
+
+class ExportJob:
+    '''
+    One export submitted to an ExportPool. status is queued, running, done or failed.
+    '''
+
+    def __init__(self, job_id, name, kind, values, seed, fname_svg, fname_gcode):
+        self.id = job_id
+        self.name = name
+        self.kind = kind # what the UI wants done with it, e.g. "print" or "save"
+        self.values = values
+        self.seed = seed
+        self.fname_svg = fname_svg
+        self.fname_gcode = fname_gcode
+        self.status = "queued"
+        self.stage = None
+        self.progress = 0.0
+        self.error = None
+        self.stats = None # path optimizer report, once done
+        self.estimate = None # plottime.PlotEstimate of the G-code, once done
+        self.cache_key = None # artcache key, when the pool has a cache
+        self.cached = False # served from the artifact cache without regenerating
+        self.submitted = time.monotonic()
+        self.finished = None
+        self.future = None
+
+
+class ExportPool:
+    '''
+    Runs exports in worker processes so the UI loop never waits on them.
+
+    Each job carries its own snapshot of the pot values and seed, and the drawing
+    is regenerated in the worker. Call poll() once per frame to pick up progress
+    and the jobs that finished since the last call; on_done says when there is
+    a finished job to pick up.
+
+    With an artcache.ArtifactCache, a drawing that was exported before is linked
+    out of the cache instead: the job is done straight away and shows up in the
+    next poll() without any worker being involved.
+    '''
+
+    def __init__(self, dimensions, workers=4, out_dir=".", cache=None, on_done=None):
+        '''
+        Args:
+            dimensions: (width, height) of the drawing
+            workers: number of worker processes
+            out_dir: folder the .svg and .gcode files are written to
+            cache: optional artcache.ArtifactCache for finished exports
+            on_done: optional callable(), called (on a pool thread) whenever a job finishes
+        '''
+        self.dimensions = dimensions
+        self.out_dir = out_dir
+        self.cache = cache
+        self.on_done = on_done
+        self.jobs = {}
+        self._ids = itertools.count()
+
+        # forkserver children start from a clean process, not a copy of the UI with its threads
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        self._progress = ctx.Queue()
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                                                initializer=_init_worker, initargs=(self._progress,))
+
+    def submit(self, name, values, seed, kind="save"):
+        '''
+        Queues an export of the drawing for (values, seed) as <out_dir>/<name>.svg/.gcode
+
+        Returns the ExportJob
+        '''
+        base = os.path.join(self.out_dir, name)
+        job = ExportJob(next(self._ids), name, kind, tuple(values), seed, base + ".svg", base + ".gcode")
+        self.jobs[job.id] = job
+        fname_geometry = None
+        if self.cache is not None:
+            job.cache_key = artcache.artifact_key(self.dimensions, job.values, seed)
+            entry = self.cache.fetch(job.cache_key, {"svg": job.fname_svg, "gcode": job.fname_gcode})
+            if entry is not None:
+                job.cached = True
+                job.future = concurrent.futures.Future()
+                estimate = entry.get("estimate")
+                job.future.set_result((_stats_from_json(entry.get("stats")), plottime.PlotEstimate(*estimate) if estimate else None))
+            else:
+                fname_geometry = self.cache.staging_path(job.cache_key)
+        if job.future is None:
+            job.future = self._executor.submit(_run_export_job, job.id, self.dimensions, job.values, seed,
+                                               job.fname_svg, job.fname_gcode, fname_geometry)
+        if self.on_done is not None:
+            job.future.add_done_callback(lambda future: self.on_done())
+        return job
+
+    def active(self):
+        '''
+        Jobs that have not finished yet, oldest first
+        '''
+        return [job for job in self.jobs.values() if job.status in ("queued", "running")]
+
+    def poll(self):
+        '''
+        Applies pending progress reports and returns the jobs that finished since the last poll
+        '''
+        while True:
+            try:
+                job_id, stage, fraction = self._progress.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs.get(job_id)
+            if job is not None and job.status in ("queued", "running"):
+                job.status = "running"
+                job.stage = stage
+                job.progress = fraction
+
+        finished = []
+        for job_id, job in list(self.jobs.items()):
+            if job.future.done():
+                error = concurrent.futures.CancelledError() if job.future.cancelled() else job.future.exception()
+                job.status = "failed" if error else "done"
+                job.error = error
+                job.stats, job.estimate = (None, None) if error else job.future.result()
+                job.progress = 1.0
+                job.finished = time.monotonic()
+                if self.cache is not None and not error and not job.cached:
+                    try:
+                        self.cache.put(job.cache_key, {"svg": job.fname_svg, "gcode": job.fname_gcode}, staged=("geometry",),
+                                       name=job.name, values=list(job.values), seed=job.seed, stats=_stats_to_json(job.stats),
+                                       estimate=list(job.estimate) if job.estimate else None)
+                    except OSError as e: # the export itself is fine, it just won't be reused
+                        print("Could not cache %s: %r" % (job.name, e))
+                elif self.cache is not None and error and not job.cached:
+                    self.cache.discard_staged(job.cache_key)
+                finished.append(job)
+                del self.jobs[job_id]
+        return finished
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
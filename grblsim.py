@@ -0,0 +1,651 @@
+#! /usr/bin/env python3
+# This file pretends to be the plotter's grbl controller, for working on stream.py without the plotter
+'''
+A simulated grbl 1.1 controller.
+
+GrblSim models the parts of grbl that matter for streaming:
+
+* the serial link (bytes take 10 bits each at the baud rate, both ways)
+* the 128 byte serial RX buffer (overflowing it drops bytes, like the real thing)
+* the planner queue: a line is only taken out of the RX buffer and acknowledged
+  with "ok" once there is a free planner block for it
+* real-time "?" status reports, ctrl-x reset and $H homing
+* motion time from the feed rate and the per-axis max rates ($110-$112), with
+  G2/G3 arcs timed along the arc. Acceleration isn't modelled, every block runs
+  at its full rate.
+
+Nothing runs in the background. The simulation is advanced to "now" whenever
+the host touches the port, processing everything that happened in between in
+time order, so it doesn't matter how late the host looks.
+
+FakeSerial wraps a GrblSim in the parts of the serial.Serial interface that
+stream.py uses, and serve_pty puts one behind a pseudo terminal so the unchanged
+open_port_and_home / stream.py command line can talk to it.
+
+Run "python3 grblsim.py serve" for a pty, or "python3 grblsim.py bench" to stream
+freshly generated drawings and report starvation and job time.
+'''
+import collections
+import math
+import re
+import time
+
+import machine
+
+STARTUP_BANNER = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+REALTIME = b"?!~\x18"
+
+# grbl 1.1 error codes the simulator can produce
+ERROR_EXPECTED_COMMAND = 1
+ERROR_BAD_NUMBER = 2
+ERROR_INVALID_STATEMENT = 3
+ERROR_SETTING_DISABLED = 5
+ERROR_IDLE_ERROR = 8
+ERROR_OVERFLOW = 11
+ERROR_UNSUPPORTED_COMMAND = 20
+ERROR_UNDEFINED_FEED_RATE = 22
+ERROR_INVALID_TARGET = 33
+
+# the plotter's settings (machine.py); accelerations are reported but not modelled
+DEFAULT_SETTINGS = machine.grbl_settings()
+
+_WORD = re.compile(r"([A-Z])([-+]?[0-9]*\.?[0-9]*)")
+_COMMENT = re.compile(r"\(.*?\)|;.*")
+
+
+Block = collections.namedtuple("Block", "start end duration feed arc")
+
+
+class GrblSim:
+    '''
+    The grbl model. All times are simulated seconds.
+
+    Host side calls are write(data, now) for bytes sent to grbl, advance(now) and
+    read_output(now) for bytes grbl has sent back. next_event() says when
+    something will next happen, so a caller waiting for output knows how long
+    it can sleep.
+    '''
+
+    def __init__(self, rx_buffer_size=128, planner_blocks=15, baudrate=115200, homing_time=2.0, settings=None, line_size=80):
+        '''
+        Args:
+            rx_buffer_size: grbl's serial receive buffer, in bytes
+            planner_blocks: how many motions grbl can have planned (the Bf: field)
+            baudrate: serial speed, None for an instant link
+            homing_time: seconds a $H takes
+            settings: $ settings overriding DEFAULT_SETTINGS
+            line_size: longest line grbl accepts
+        '''
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.byte_time = 10.0/baudrate if baudrate else 0.0
+        self.homing_time = homing_time
+        self.line_size = line_size
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+
+        self.clock = 0.0
+        self._incoming = collections.deque() # (arrival time, bytes) on the wire to grbl
+        self._outgoing = collections.deque() # (arrival time, bytes) on the wire to the host
+        self._tx_free = self._rx_free = 0.0 # when each direction of the link is next free
+
+        # counters for benchmarks
+        self.max_rx = 0 # most bytes ever sitting in the RX buffer
+        self.overflows = 0 # bytes dropped because the RX buffer was full
+        self.lines = 0
+        self.errors = 0
+        self.starved = 0 # times the planner ran dry while grbl waited on the host
+        self.starved_time = 0.0
+        self.motion_time = 0.0
+        self.first_motion = None
+        self.last_motion = None
+
+        self._reset()
+        self._send(STARTUP_BANNER)
+
+    def _reset(self):
+        self.rx = bytearray()
+        self.planner = collections.deque()
+        self.block_started = None # when the head of the planner started moving
+        self.busy_until = None # end of a homing cycle or dwell
+        self.busy_state = None
+        self._pending_ok = False # reply owed at busy_until
+        self._starved_since = None
+        self.position = [0.0, 0.0, 0.0] # where the last planned block ends
+        self.machine = [0.0, 0.0, 0.0] # where the tool actually is, at the end of the running block
+        self.motion = 0
+        self.feed = None
+        self.absolute = True
+        self.scale = 1.0 # mm per unit, 25.4 after G20
+
+    # -- the serial link
+
+    def write(self, data, now):
+        '''
+        Host writes data at time `now`; it arrives after the link has carried it
+        '''
+        self.advance(now)
+        start = max(now, self._rx_free)
+        self._rx_free = start + len(data)*self.byte_time
+        self._incoming.append((self._rx_free, bytes(data)))
+
+    def _send(self, data):
+        start = max(self.clock, self._tx_free)
+        self._tx_free = start + len(data)*self.byte_time
+        self._outgoing.append((self._tx_free, data))
+
+    def read_output(self, now):
+        '''
+        Everything grbl has sent that reached the host by `now`
+        '''
+        self.advance(now)
+        out = bytearray()
+        while self._outgoing and self._outgoing[0][0] <= now:
+            out += self._outgoing.popleft()[1]
+        return bytes(out)
+
+    def next_event(self):
+        '''
+        Time of the next arrival, block end or timer, None if nothing is scheduled
+        '''
+        times = [t for t in (self._next_internal(), self._outgoing[0][0] if self._outgoing else None) if t is not None]
+        return min(times) if times else None
+
+    # -- time
+
+    def advance(self, now):
+        '''
+        Runs the machine up to time `now`, handling every event in order
+        '''
+        while True:
+            t = self._next_internal()
+            if t is None or t > now:
+                break
+            self.clock = max(self.clock, t)
+            if self._incoming and self._incoming[0][0] <= t:
+                self._receive(self._incoming.popleft()[1])
+            elif self.busy_until is not None and self.busy_until <= t:
+                self._finish_busy()
+            else:
+                self._finish_block()
+            self._process_lines()
+        self.clock = max(self.clock, now)
+        self._process_lines()
+
+    def _next_internal(self):
+        times = []
+        if self._incoming:
+            times.append(self._incoming[0][0])
+        if self.planner and self.block_started is not None:
+            times.append(self.block_started + self.planner[0].duration)
+        if self.busy_until is not None:
+            times.append(self.busy_until)
+        return min(times) if times else None
+
+    def _receive(self, data):
+        for c in data:
+            if c in REALTIME:
+                self._realtime(c)
+            elif len(self.rx) < self.rx_buffer_size:
+                self.rx.append(c)
+                self.max_rx = max(self.max_rx, len(self.rx))
+            else:
+                self.overflows += 1
+
+    def _realtime(self, c):
+        if c == ord("?"):
+            self._send(self.status_report().encode() + b"\r\n")
+        elif c == 0x18: # soft reset, throws away everything
+            self._outgoing.clear()
+            self._reset()
+            self._send(STARTUP_BANNER)
+        # feed hold / resume aren't modelled
+
+    def _finish_block(self):
+        block = self.planner.popleft()
+        self.machine = list(block.end)
+        self.motion_time += block.duration
+        self.last_motion = self.clock
+        if self.planner:
+            self.block_started = self.clock
+        else:
+            self.block_started = None
+            if b"\n" not in self.rx and b"\r" not in self.rx:
+                self._starved_since = self.clock
+
+    def _finish_busy(self):
+        self.busy_until = None
+        self.busy_state = None
+        if self._pending_ok:
+            self._pending_ok = False
+            self._send(b"ok\r\n")
+
+    def _plan(self, block):
+        if not self.planner:
+            self.block_started = self.clock
+            if self._starved_since is not None:
+                self.starved += 1
+                self.starved_time += self.clock - self._starved_since
+        self._starved_since = None
+        if self.first_motion is None:
+            self.first_motion = self.clock
+        self.planner.append(block)
+
+    # -- lines
+
+    def _process_lines(self):
+        while self.busy_until is None:
+            ends = [i for i in (self.rx.find(b"\n"), self.rx.find(b"\r")) if i >= 0]
+            if not ends:
+                if len(self.rx) >= self.rx_buffer_size: # a line that can never end
+                    self.rx.clear()
+                    self._reply(ERROR_OVERFLOW)
+                return
+            end = min(ends)
+            line = self.rx[:end].decode("ascii", "replace")
+            if not self._execute(line, dry_run=True): # has to wait for the planner
+                return
+            del self.rx[:end + 1]
+            self._execute(line)
+
+    def _reply(self, error=None):
+        if error is None:
+            self._send(b"ok\r\n")
+        else:
+            self.errors += 1
+            self._send(b"error:%d\r\n" % error)
+
+    def _execute(self, line, dry_run=False):
+        '''
+        Runs one line. With dry_run it only answers whether the line can run now
+        (motions need a free planner block, everything else an empty planner).
+        '''
+        if len(line) > self.line_size:
+            if not dry_run:
+                self._reply(ERROR_OVERFLOW)
+            return True
+        if line.startswith("$"):
+            if not dry_run:
+                self.lines += 1
+                if self.planner: # settings and homing are refused while moving
+                    self._reply(ERROR_IDLE_ERROR)
+                else:
+                    self._system_command(line.strip().upper())
+            return True
+
+        block = _COMMENT.sub("", line).replace(" ", "").replace("\t", "").upper()
+        words = []
+        pos = 0
+        for match in _WORD.finditer(block):
+            if match.start() != pos:
+                break
+            words.append(match.groups())
+            pos = match.end()
+        if pos != len(block):
+            if not dry_run:
+                self.lines += 1
+                self._reply(ERROR_EXPECTED_COMMAND if block[pos:pos+1].isdigit() else ERROR_UNSUPPORTED_COMMAND)
+            return True
+        try:
+            words = [(letter, float(value)) for letter, value in words]
+        except ValueError:
+            if not dry_run:
+                self.lines += 1
+                self._reply(ERROR_BAD_NUMBER)
+            return True
+
+        moves = any(letter in "XYZ" for letter, _ in words)
+        syncs = any((letter == "G" and value == 4) or (letter == "M" and value in (3, 4, 5)) for letter, value in words)
+        if dry_run:
+            if syncs:
+                return not self.planner
+            return not moves or len(self.planner) < self.planner_blocks
+        self.lines += 1
+        self._reply(self._gcode(words))
+        return True
+
+    def _gcode(self, words):
+        target = list(self.position)
+        offsets = {}
+        dwell = None
+        motion = self.motion
+        scale, absolute = self.scale, self.absolute
+        has_axis = False
+        for letter, value in words:
+            if letter == "G":
+                if value in (0, 1, 2, 3):
+                    motion = int(value)
+                elif value == 4:
+                    dwell = 0.0
+                elif value == 20:
+                    scale = 25.4
+                elif value == 21:
+                    scale = 1.0
+                elif value == 90:
+                    absolute = True
+                elif value == 91:
+                    absolute = False
+                elif value not in (17, 94, 54):
+                    return ERROR_UNSUPPORTED_COMMAND
+            elif letter == "M":
+                if value not in (0, 2, 3, 4, 5, 30):
+                    return ERROR_UNSUPPORTED_COMMAND
+            elif letter == "F":
+                self.feed = value*scale
+            elif letter in "XYZ":
+                has_axis = True
+                axis = "XYZ".index(letter)
+                target[axis] = value*scale if absolute else self.position[axis] + value*scale
+            elif letter in "IJ":
+                offsets[letter] = value*scale
+            elif letter == "P":
+                if dwell is not None:
+                    dwell = value
+            elif letter not in "NS":
+                return ERROR_UNSUPPORTED_COMMAND
+        self.motion, self.scale, self.absolute = motion, scale, absolute
+
+        if dwell is not None:
+            self.busy_until = self.clock + dwell
+            self.busy_state = "Run"
+            return None
+        if not has_axis:
+            return None
+        if motion != 0 and not self.feed:
+            return ERROR_UNDEFINED_FEED_RATE
+
+        start = tuple(self.position)
+        delta = [t - s for t, s in zip(target, start)]
+        arc = None
+        if motion in (2, 3):
+            i, j = offsets.get("I", 0.0), offsets.get("J", 0.0)
+            cx, cy = start[0] + i, start[1] + j
+            r0 = math.hypot(i, j)
+            r1 = math.hypot(target[0] - cx, target[1] - cy)
+            # grbl's check: the end point has to be on the circle through the start
+            if abs(r1 - r0) > 0.005 and abs(r1 - r0) > 0.001*r0:
+                return ERROR_INVALID_TARGET
+            a0 = math.atan2(start[1] - cy, start[0] - cx)
+            a1 = math.atan2(target[1] - cy, target[0] - cx)
+            sweep = a1 - a0
+            if motion == 2: # clockwise
+                if sweep >= -1e-9:
+                    sweep -= 2*math.pi
+            elif sweep <= 1e-9:
+                sweep += 2*math.pi
+            arc = (cx, cy, r0, a0, sweep)
+            length = math.hypot(abs(sweep)*r0, delta[2])
+            minutes = length/self.feed # arcs are assumed to be slower than the max rates
+        else:
+            length = math.sqrt(sum(d*d for d in delta))
+            rates = [self.settings[110], self.settings[111], self.settings[112]]
+            # no axis may go faster than its max rate, rapids go as fast as that allows
+            minutes = max(abs(d)/r for d, r in zip(delta, rates))
+            if motion != 0:
+                minutes = max(minutes, length/self.feed)
+        if length == 0:
+            return None
+
+        feed = length/minutes
+        self._plan(Block(start, tuple(target), minutes*60.0, feed, arc))
+        self.position = target
+        return None
+
+    def _system_command(self, line):
+        if line == "$H":
+            if not self.settings.get(22):
+                self._reply(ERROR_SETTING_DISABLED)
+                return
+            self.busy_until = self.clock + self.homing_time
+            self.busy_state = "Home"
+            self._pending_ok = True
+            self.position = [0.0, 0.0, 0.0]
+            self.machine = [0.0, 0.0, 0.0]
+        elif line == "$$":
+            for key in sorted(self.settings):
+                self._send(b"$%d=%.3f\r\n" % (key, self.settings[key]))
+            self._reply()
+        elif line in ("$X", "$G", "$#", "$I", "$N", "$C"):
+            if line == "$G":
+                self._send(b"[GC:G%d G54 G17 G%d G%d G94 M5 M9 T0 F%.0f S0]\r\n" % (
+                    self.motion, 21 if self.scale == 1.0 else 20, 90 if self.absolute else 91, self.feed or 0))
+            self._reply()
+        else:
+            match = re.fullmatch(r"\$(\d+)=([-+]?[0-9]*\.?[0-9]+)", line)
+            if match is None:
+                self._reply(ERROR_INVALID_STATEMENT)
+                return
+            self.settings[int(match.group(1))] = float(match.group(2))
+            self._reply()
+
+    # -- reports
+
+    def tool_position(self):
+        '''
+        Where the tool is right now, part way along the running block
+        '''
+        if not self.planner or self.block_started is None:
+            return list(self.machine)
+        block = self.planner[0]
+        f = min(1.0, (self.clock - self.block_started)/block.duration) if block.duration else 1.0
+        z = block.start[2] + f*(block.end[2] - block.start[2])
+        if block.arc:
+            cx, cy, r, a0, sweep = block.arc
+            a = a0 + f*sweep
+            return [cx + r*math.cos(a), cy + r*math.sin(a), z]
+        return [s + f*(e - s) for s, e in zip(block.start, block.end)]
+
+    def state(self):
+        if self.busy_state:
+            return self.busy_state
+        return "Run" if self.planner else "Idle"
+
+    def status_report(self):
+        x, y, z = self.tool_position()
+        feed = self.planner[0].feed if self.planner else 0
+        return "<%s|MPos:%.3f,%.3f,%.3f|Bf:%d,%d|FS:%.0f,0>" % (
+            self.state(), x, y, z, self.planner_blocks - len(self.planner),
+            self.rx_buffer_size - len(self.rx), feed)
+
+    def summary(self):
+        '''
+        Counters as a plain dict (times in simulated seconds)
+        '''
+        job = (self.last_motion - self.first_motion) if self.first_motion is not None and self.last_motion else 0.0
+        return {
+            "lines": self.lines,
+            "errors": self.errors,
+            "max_rx": self.max_rx,
+            "overflows": self.overflows,
+            "motion_seconds": self.motion_time,
+            "job_seconds": job,
+            "starved": self.starved,
+            "starved_seconds": self.starved_time,
+        }
+
+
+class FakeSerial:
+    '''
+    Stands in for serial.Serial, backed by a GrblSim running on the wall clock.
+
+    time_scale > 1 runs the machine faster than real time, which is handy for
+    long drawings but makes the host look that many times slower to grbl.
+    '''
+
+    def __init__(self, sim=None, timeout=None, time_scale=1.0, **kwargs):
+        '''
+        Args:
+            sim: the GrblSim to talk to (made from kwargs if None)
+            timeout: read timeout in seconds, like serial.Serial
+            time_scale: simulated seconds per real second
+        '''
+        self.sim = sim or GrblSim(**kwargs)
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.is_open = True
+        self._t0 = time.monotonic()
+        self._buffer = bytearray()
+
+    def now(self):
+        return (time.monotonic() - self._t0)*self.time_scale
+
+    def _pull(self):
+        self._buffer += self.sim.read_output(self.now())
+
+    def _wait(self, deadline):
+        '''
+        Sleeps until the sim's next event or the deadline, whichever comes first
+        '''
+        event = self.sim.next_event()
+        delay = 0.05 if event is None else max(0.0, (event - self.now())/self.time_scale)
+        if deadline is not None:
+            delay = min(delay, deadline - time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def in_waiting(self):
+        self._pull()
+        return len(self._buffer)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def write(self, data):
+        self.sim.write(data, self.now())
+        return len(data)
+
+    def _read_until(self, done):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            self._pull()
+            n = done(self._buffer)
+            if n:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                n = len(self._buffer)
+                break
+            self._wait(deadline)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    def read(self, size=1):
+        return self._read_until(lambda buf: size if len(buf) >= size else 0)
+
+    def readline(self):
+        return self._read_until(lambda buf: buf.find(b"\n") + 1)
+
+    def reset_input_buffer(self):
+        self._pull()
+        self._buffer.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def serve_pty(sim=None, verbose=False):
+    '''
+    Puts a GrblSim behind a pseudo terminal and serves it until interrupted.
+    Prints the device path to hand to stream.py / UI.py --port.
+    '''
+    import os
+    import pty
+    import select
+    import tty
+
+    sim = sim or GrblSim()
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    print("grbl simulator on", os.ttyname(slave), flush=True)
+    t0 = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic() - t0
+            out = sim.read_output(now)
+            if out:
+                os.write(master, out)
+                if verbose: print("REC:", out)
+            event = sim.next_event()
+            timeout = 0.05 if event is None else min(0.05, max(0.0, event - now))
+            ready, _, _ = select.select([master], [], [], timeout)
+            if ready:
+                data = os.read(master, 1024)
+                if verbose: print("SND:", data)
+                sim.write(data, time.monotonic() - t0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(master)
+        os.close(slave)
+    return sim
+
+
+def benchmark(count=3, seed=0, time_scale=10.0, rx_buffer_size=128, status_interval=None, verbose=False):
+    '''
+    Generates `count` drawings with random pot values, exports their G-code and
+    streams each one into a simulated plotter
+
+    Returns a list of (name, StreamStats summary, GrblSim summary)
+    '''
+    import os
+    import random
+    import tempfile
+
+    import export
+    import stream
+    from art import ArtproofDrawing
+
+    rng = random.Random(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for k in range(count):
+            values = [rng.randrange(1024) for _ in range(10)] # one per pot
+            drawing = ArtproofDrawing((600, 600), values, None, cache_size=0, surface_cache_size=0)
+            drawing.update(values, seed + k)
+            fname = os.path.join(tmp, "bench_%d.gcode" % k)
+            export.export_drawing(drawing, fname_gcode=fname)
+
+            port = FakeSerial(timeout=1.0, time_scale=time_scale, rx_buffer_size=rx_buffer_size)
+            port.readline() # banner
+            port.readline()
+            with open(fname) as f:
+                stats = stream.stream_gcode(port, f, verbose, rx_buffer_size=rx_buffer_size, status_interval=status_interval)
+            results.append(("drawing_%d %s" % (seed + k, values), stats.summary(), port.sim.summary()))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulated grbl controller for testing the streamer without the plotter')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='serve a simulated grbl on a pty')
+    serve.add_argument('-v', '--verbose', action='store_true', default=False, help='print everything sent and received')
+    bench = commands.add_parser('bench', help='stream generated drawings into the simulator and report')
+    bench.add_argument('-n', '--count', type=int, default=3, help='number of drawings (default %(default)s)')
+    bench.add_argument('-s', '--seed', type=int, default=0, help='seed for the pot values and drawings')
+    bench.add_argument('-t', '--time-scale', type=float, default=10.0, dest='time_scale',
+            help='simulated seconds per real second (default %(default)s)')
+    bench.add_argument('-b', '--rx-buffer', type=int, default=128, dest='rx_buffer',
+            help='size of grbl\'s serial receive buffer (default %(default)s)')
+    bench.add_argument('-i', '--status-interval', type=float, default=None, dest='status_interval',
+            help='poll status this often while streaming')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve_pty(verbose=args.verbose)
+    else:
+        results = benchmark(args.count, args.seed, args.time_scale, args.rx_buffer, args.status_interval)
+        for name, host, grbl in results:
+            print(name)
+            starved = host["planner_starvation_events"]
+            print("  host: %d lines, %d bytes in %.1fs (real time), planner ran dry %s, rx buffer drained %d times, ok latency p50 %.1fms p95 %.1fms" % (
+                host["lines"], host["bytes"], host["seconds"], "%d times" % starved if starved is not None else "? times (needs -i)", host["rx_drained_events"],
+                host["ok_latency_ms"]["p50"], host["ok_latency_ms"]["p95"]))
+            print("  grbl: job %.1fs (%.1fs moving), planner ran dry %d times for %.2fs, max rx %d bytes, %d overflows, %d errors" % (
+                grbl["job_seconds"], grbl["motion_seconds"], grbl["starved"], grbl["starved_seconds"],
+                grbl["max_rx"], grbl["overflows"], grbl["errors"]))
@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+# This file writes the pot LEDs without crowding the pot reads off the I2C bus
+'''
+Change-only, rate-limited NeoPixel output.
+
+The NeoPixels hang off the same Seesaw boards (and the same I2C bus) as the
+pots, so every write is bus time the pot reads don't get. PixelWriter keeps the
+colour each device last got and only writes the ones that changed. It doesn't
+write from the UI thread at all: show() just records the wanted colour, and
+flush() writes at most `writes_per_slot` devices. flush() is meant to run on
+the PotSampler thread right after each poll (see PotSampler's after_sample), so
+LED writes take turns with the pot reads instead of competing with them.
+
+A colour set again before it was written replaces the pending one, so a pot
+swept quickly costs one write for where it ends up, not one per frame.
+
+    leds = PixelWriter(pixels, bus=bus_counter)
+    sampler = PotSampler(pots, after_sample=leds.flush, bus=bus_counter)
+    leds.show_all(colors) # from the UI, whenever the colours may have changed
+'''
+import collections
+import threading
+
+
+def _color(color):
+    return tuple(min(255, max(0, int(round(c)))) for c in color)
+
+
+class PixelWriter:
+    '''
+    Remembers what every NeoPixel device shows and writes only the changes, a few per slot
+    '''
+
+    def __init__(self, pixels, writes_per_slot=2, bus=None):
+        '''
+        Args:
+            pixels: a list of NeoPixel objects (anything with .fill(color))
+            writes_per_slot: most devices written per flush() call
+            bus: optional perf.RateCounter, told about every write ("led writes")
+        '''
+        self.pixels = pixels
+        self.writes_per_slot = writes_per_slot
+        self.bus = bus
+        self.writes = 0 # devices written
+        self.skipped = 0 # show() calls that didn't change anything
+        self.errors = 0 # failed writes (retried on the next flush)
+        self._shown = [None]*len(pixels) # colour each device was last written
+        self._pending = collections.OrderedDict() # device -> colour to write, oldest first
+        self._lock = threading.Lock()
+
+    def show(self, index, color):
+        '''
+        Asks for device `index` to show `color` (an (r, g, b) of 0-255 values);
+        written by a later flush() unless it is already showing it
+        '''
+        color = _color(color)
+        with self._lock:
+            if color == self._shown[index]:
+                self._pending.pop(index, None) # back to what it shows, nothing to write
+                self.skipped += 1
+            elif self._pending.get(index) != color:
+                self._pending.pop(index, None)
+                self._pending[index] = color
+
+    def show_all(self, colors):
+        '''
+        show() for every device, colors in device order (extra colours are ignored)
+        '''
+        for index, color in enumerate(colors[:len(self.pixels)]):
+            self.show(index, color)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, max_writes=None):
+        '''
+        Writes up to max_writes (writes_per_slot if None) of the waiting colours,
+        oldest first. Call from the thread that owns the bus.
+
+        Returns how many devices were written
+        '''
+        limit = self.writes_per_slot if max_writes is None else max_writes
+        written = 0
+        while written < limit:
+            with self._lock:
+                if not self._pending:
+                    break
+                index, color = self._pending.popitem(last=False)
+            try:
+                self.pixels[index].fill(color)
+            except (OSError, RuntimeError): # I2C hiccup, try again next slot unless something newer came in
+                self.errors += 1
+                with self._lock:
+                    self._pending.setdefault(index, color)
+                break
+            with self._lock:
+                self._shown[index] = color
+            written += 1
+        if written:
+            self.writes += written
+            if self.bus is not None:
+                self.bus.add("led writes", written)
+        return written
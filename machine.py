@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+# This file reads the plotter's grbl settings, for everything that needs to know how fast it moves
+'''
+The plotter's grbl $ settings, from the [grbl] table of test_party_config.cfg.
+
+plottime.py (the plot time estimates) and grblsim.py (the simulated plotter)
+both take their max rates, accelerations etc. from here, so the estimate and
+the simulator describe the same machine, and correcting the numbers is a
+config edit. The table also says where the numbers came from: measured is only
+true once they have been read off the plotter with `$$`.
+
+    machine.grbl_settings()     # {110: 5000.0, 111: 5000.0, ...}
+    machine.settings_measured()  # False while they are placeholders
+
+Run "python3 machine.py" to print them.
+'''
+import functools
+import os
+
+try:
+    import tomllib
+except ModuleNotFoundError: # python < 3.11
+    import tomli as tomllib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(HERE, "test_party_config.cfg")
+
+
+@functools.lru_cache(maxsize=None)
+def load_grbl(config=CONFIG_FILE):
+    '''
+    The [grbl] table of a config file (cached, don't modify)
+    '''
+
+    with open(config, "rb") as f:
+        return tomllib.load(f)["grbl"]
+
+def grbl_settings(config=CONFIG_FILE):
+    '''
+    The plotter's $ settings as {setting number: value} (a new dict every call)
+    '''
+
+    return {int(number): float(value) for number, value in load_grbl(config)["settings"].items()}
+
+def settings_measured(config=CONFIG_FILE):
+    '''
+    True once the settings were read off the plotter rather than filled in by hand
+    '''
+
+    return bool(load_grbl(config).get("measured", False))
+
+
+if __name__ == "__main__":
+    grbl = load_grbl()
+    print("source:", grbl.get("source"), "(measured)" if settings_measured() else "(NOT measured)")
+    for number, value in sorted(grbl_settings().items()):
+        print("$%d=%.3f" % (number, value))
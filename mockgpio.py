@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+# This file stands in for RPi.GPIO off the pi
+'''
+The part of RPi.GPIO the UI uses, without any hardware, so the kiosk can run
+(and be driven) on a laptop:
+
+    import mockgpio as GPIO
+    GPIO.setup(17, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    GPIO.add_event_detect(17, GPIO.RISING, callback=on_press, bouncetime=50)
+    GPIO.press(17) # on_press(17) runs, like the button was pushed
+
+Pins read their pull level until drive() / press() says otherwise. Edge callbacks
+run on the calling thread (RPi.GPIO runs them on its own thread) and are
+debounced like RPi.GPIO's: an edge within `bouncetime` ms of the last one that
+was reported is dropped.
+
+Pot and Pixels stand in for the rest of the hardware UI.py talks to (the
+Seesaw pots and their NeoPixels over I2C), so `python3 UI.py --mock-gpio` needs
+neither board nor adafruit_seesaw.
+'''
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+_lock = threading.Lock()
+_levels = {} # pin -> current level
+_detect = {} # pin -> [edge, callbacks, bouncetime (s), time of the last reported edge]
+
+
+def setwarnings(flag):
+    pass
+
+def setmode(mode):
+    pass
+
+def setup(pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+    with _lock:
+        _levels[pin] = HIGH if direction == IN and pull_up_down == PUD_UP else initial
+
+def input(pin):
+    with _lock:
+        if pin not in _levels:
+            raise RuntimeError("You must setup() the GPIO channel first")
+        return _levels[pin]
+
+def output(pin, level):
+    drive(pin, level)
+
+def add_event_detect(pin, edge, callback=None, bouncetime=None):
+    with _lock:
+        if pin not in _levels:
+            raise RuntimeError("You must setup() the GPIO channel first")
+        if pin in _detect:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        _detect[pin] = [edge, [callback] if callback else [], (bouncetime or 0)/1000, None]
+
+def add_event_callback(pin, callback):
+    with _lock:
+        if pin not in _detect:
+            raise RuntimeError("Add event detection using add_event_detect first before adding a callback")
+        _detect[pin][1].append(callback)
+
+def remove_event_detect(pin):
+    with _lock:
+        _detect.pop(pin, None)
+
+def cleanup(pins=None):
+    with _lock:
+        for pin in list(_levels) if pins is None else ([pins] if isinstance(pins, int) else pins):
+            _levels.pop(pin, None)
+            _detect.pop(pin, None)
+
+
+# driving the pins, for tests and the keyboard stand-ins in UI.py
+
+def drive(pin, level):
+    '''
+    Puts `level` on the pin, running its edge callbacks if that is an edge they watch
+    '''
+    callbacks = ()
+    with _lock:
+        previous = _levels.get(pin, LOW)
+        _levels[pin] = level
+        detect = _detect.get(pin)
+        if detect is not None and level != previous:
+            edge, registered, bouncetime, last = detect
+            now = time.monotonic()
+            watched = edge == BOTH or (edge == RISING) == (level == HIGH)
+            if watched and (last is None or now - last >= bouncetime):
+                detect[3] = now
+                callbacks = list(registered)
+    for callback in callbacks:
+        callback(pin)
+
+def press(pin, hold=0.0):
+    '''
+    A push of a button wired to pull the pin high: high, `hold` seconds, low again
+    '''
+    drive(pin, HIGH)
+    if hold:
+        time.sleep(hold)
+    drive(pin, LOW)
+
+def bounce(pin, edges=6, interval=0.001):
+    '''
+    A press with contact bounce: the pin flips `edges` times, `interval` seconds apart
+    '''
+    for i in range(edges):
+        drive(pin, HIGH if i % 2 == 0 else LOW)
+        time.sleep(interval)
+    drive(pin, LOW)
+
+
+# the I2C side: pots and their LEDs
+
+class Pot:
+    '''
+    A potentiometer like adafruit_seesaw's AnalogInput: .value from 0 to 1023, moved with turn()
+    '''
+
+    def __init__(self, value=512):
+        self.value = value
+
+    def turn(self, counts):
+        self.value = min(1023, max(0, self.value + counts))
+
+
+class Pixels:
+    '''
+    A NeoPixel like adafruit_seesaw's: remembers the colour it was last filled with
+    '''
+
+    def __init__(self):
+        self.color = None
+        self.fills = 0
+
+    def fill(self, color):
+        self.color = tuple(color)
+        self.fills += 1
@@ -0,0 +1,270 @@
+#! /usr/bin/env python3
+# This file orders strokes to cut down on pen-up travel
+'''
+Pen-up travel optimizer for plotter strokes (see paths.py).
+
+Every stroke has two end points. They go into a uniform grid so "nearest free
+end point" and "end points within a tolerance" are cheap lookups instead of scans
+over every stroke. On top of that:
+
+* merge_endpoints joins strokes that touch (within a tolerance), reversing as needed
+* order_strokes is a greedy nearest-neighbour tour that may reverse strokes
+* two_opt reverses runs of the tour while that shortens it, for a fixed number of
+  passes (so the same strokes always come out the same), with a time cap as a backstop
+
+optimize() runs all of them and reports pen-down / pen-up distance before and after.
+'''
+import collections
+import math
+import time
+
+import numpy as np
+
+from paths import reverse_stroke, stroke_end, stroke_length, stroke_start
+
+PathStats = collections.namedtuple('PathStats', 'pen_down pen_up strokes')
+
+BRUTE_FORCE_BELOW = 64 # with this few points left a numpy scan beats walking grid rings
+TWO_OPT_PASSES = 20 # most sweeps over the tour (they usually converge within 10); the result only depends on the strokes
+
+
+class EndpointGrid:
+    '''
+    Uniform grid over a fixed set of points that supports removal, nearest point
+    and radius queries. Point 2*i is the start of stroke i and 2*i+1 is its end.
+    '''
+
+    def __init__(self, points, cell=None):
+        '''
+        Args:
+            points: (n, 2) array
+            cell: grid cell size (defaults to about two points per cell)
+        '''
+        self.points = np.asarray(points, dtype=float)
+        self.alive = np.ones(len(self.points), dtype=bool)
+        self.count = len(self.points)
+        if self.count == 0:
+            return
+
+        lo, hi = self.points.min(axis=0), self.points.max(axis=0)
+        if cell is None:
+            area = max((hi[0] - lo[0])*(hi[1] - lo[1]), 1e-9)
+            cell = max(math.sqrt(2*area/self.count), 1e-6)
+        self.cell = cell
+
+        self.cells = collections.defaultdict(list)
+        keys = np.floor(self.points/cell).astype(int)
+        for i, key in enumerate(map(tuple, keys.tolist())):
+            self.cells[key].append(i)
+        self.key_min = keys.min(axis=0)
+        self.key_max = keys.max(axis=0)
+
+    def __len__(self):
+        return self.count
+
+    def remove(self, i):
+        if self.alive[i]:
+            self.alive[i] = False
+            self.count -= 1
+
+    def _ring(self, kx, ky, r):
+        if r == 0:
+            yield kx, ky
+            return
+        for x in range(kx - r, kx + r + 1):
+            yield x, ky - r
+            yield x, ky + r
+        for y in range(ky - r + 1, ky + r):
+            yield kx - r, y
+            yield kx + r, y
+
+    def nearest(self, p):
+        '''
+        Returns (index, distance) of the closest live point, or (None, inf) if none are left
+        '''
+        if self.count == 0:
+            return None, math.inf
+        px, py = p
+        if self.count <= BRUTE_FORCE_BELOW:
+            idx = np.flatnonzero(self.alive)
+            d = np.hypot(self.points[idx, 0] - px, self.points[idx, 1] - py)
+            k = int(np.argmin(d))
+            return int(idx[k]), float(d[k])
+
+        kx, ky = int(math.floor(px/self.cell)), int(math.floor(py/self.cell))
+        max_r = max(abs(kx - self.key_min[0]), abs(kx - self.key_max[0]), abs(ky - self.key_min[1]), abs(ky - self.key_max[1]))
+        best, best_d = None, math.inf
+        points, alive, cells = self.points, self.alive, self.cells
+        for r in range(max_r + 1):
+            for key in self._ring(kx, ky, r):
+                for i in cells.get(key, ()):
+                    if alive[i]:
+                        d = math.hypot(points[i, 0] - px, points[i, 1] - py)
+                        if d < best_d:
+                            best, best_d = i, d
+            # everything in the next ring out is at least r cells away
+            if best is not None and best_d <= r*self.cell:
+                break
+        return best, best_d
+
+    def within(self, p, radius):
+        '''
+        Live point indices within radius of p, closest first
+        '''
+        if self.count == 0:
+            return []
+        px, py = p
+        lo = np.floor((np.array(p) - radius)/self.cell).astype(int)
+        hi = np.floor((np.array(p) + radius)/self.cell).astype(int)
+        found = []
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                for i in self.cells.get((x, y), ()):
+                    if self.alive[i]:
+                        d = math.hypot(self.points[i, 0] - px, self.points[i, 1] - py)
+                        if d <= radius:
+                            found.append((d, i))
+        return [i for d, i in sorted(found)]
+
+
+def _endpoints(strokes):
+    points = np.empty((2*len(strokes), 2))
+    for i, stroke in enumerate(strokes):
+        points[2*i] = stroke_start(stroke)
+        points[2*i + 1] = stroke_end(stroke)
+    return points
+
+def merge_endpoints(strokes, tolerance):
+    '''
+    Joins strokes whose end points are within tolerance, reversing them where needed
+    '''
+
+    strokes = list(strokes)
+    if not strokes:
+        return strokes
+    grid = EndpointGrid(_endpoints(strokes))
+    merged = []
+    for i in range(len(strokes)):
+        if not grid.alive[2*i]:
+            continue
+        grid.remove(2*i)
+        grid.remove(2*i + 1)
+        stroke = strokes[i]
+        for grow_at_end in (True, False):
+            while True:
+                p = stroke_end(stroke) if grow_at_end else stroke_start(stroke)
+                close = grid.within(p, tolerance)
+                if not close:
+                    break
+                k = close[0]
+                j, is_end = divmod(k, 2)
+                grid.remove(2*j)
+                grid.remove(2*j + 1)
+                # continue from the matched end point into the other stroke
+                other = strokes[j] if is_end == (not grow_at_end) else reverse_stroke(strokes[j])
+                stroke = stroke + other if grow_at_end else other + stroke
+        merged.append(stroke)
+    return merged
+
+def order_strokes(strokes, start=(0.0, 0.0)):
+    '''
+    Greedy nearest-neighbour ordering from `start`, reversing strokes where that is closer
+    '''
+
+    strokes = list(strokes)
+    if len(strokes) < 2:
+        return strokes
+    grid = EndpointGrid(_endpoints(strokes))
+    ordered = []
+    p = start
+    while len(grid):
+        k, _ = grid.nearest(p)
+        j, is_end = divmod(k, 2)
+        grid.remove(2*j)
+        grid.remove(2*j + 1)
+        stroke = reverse_stroke(strokes[j]) if is_end else strokes[j]
+        ordered.append(stroke)
+        p = stroke_end(stroke)
+    return ordered
+
+def two_opt(strokes, start=(0.0, 0.0), max_passes=TWO_OPT_PASSES, time_budget=None):
+    '''
+    Improves a stroke order by reversing runs of strokes (and their direction) while
+    that shortens the pen-up travel. Stops when a pass finds nothing to improve or
+    after max_passes passes, so the output is deterministic. time_budget (seconds,
+    None for none) is only a safety cap for pathological inputs; when it cuts a
+    pass short the result depends on timing.
+    '''
+
+    n = len(strokes)
+    if n < 3 or max_passes <= 0:
+        return list(strokes)
+    deadline = time.monotonic() + time_budget if time_budget is not None else math.inf
+    order = list(range(n))
+    flipped = [False]*n
+    S = _endpoints(strokes)
+    E = S[1::2].copy()
+    S = S[0::2].copy()
+    start = np.asarray(start, dtype=float)
+
+    improved = True
+    passes = 0
+    while improved and passes < max_passes and time.monotonic() < deadline:
+        improved = False
+        passes += 1
+        for i in range(n - 1):
+            if time.monotonic() > deadline:
+                break
+            prev = E[i - 1] if i > 0 else start
+            j = np.arange(i + 1, n)
+            nxt_exists = j + 1 < n
+            nxt = S[np.minimum(j + 1, n - 1)]
+            # reversing i..j swaps the travel edges prev->S[i], E[j]->S[j+1]
+            # for prev->E[j], S[i]->S[j+1]
+            old = np.hypot(*(prev - S[i])) + np.where(nxt_exists, np.hypot(*(E[j] - nxt).T), 0.0)
+            new = np.hypot(*(prev - E[j]).T) + np.where(nxt_exists, np.hypot(*(S[i] - nxt).T), 0.0)
+            gain = old - new
+            k = int(np.argmax(gain))
+            if gain[k] > 1e-9:
+                j = i + 1 + k
+                S[i:j + 1], E[i:j + 1] = E[i:j + 1][::-1].copy(), S[i:j + 1][::-1].copy()
+                order[i:j + 1] = order[i:j + 1][::-1]
+                flipped[i:j + 1] = [not f for f in flipped[i:j + 1][::-1]]
+                improved = True
+
+    return [reverse_stroke(strokes[k]) if f else strokes[k] for k, f in zip(order, flipped)]
+
+def path_stats(strokes, start=(0.0, 0.0)):
+    '''
+    Pen-down length, pen-up travel (from `start`, in order) and stroke count
+    '''
+
+    pen_down = sum(stroke_length(s) for s in strokes)
+    pen_up = 0.0
+    p = start
+    for stroke in strokes:
+        q = stroke_start(stroke)
+        pen_up += math.hypot(q[0] - p[0], q[1] - p[1])
+        p = stroke_end(stroke)
+    return PathStats(pen_down, pen_up, len(strokes))
+
+def optimize(strokes, merge_tolerance=0.0, start=(0.0, 0.0), max_passes=TWO_OPT_PASSES, time_budget=None):
+    '''
+    Merges touching strokes, orders them nearest-neighbour and refines with 2-opt
+
+    Args:
+        strokes: list of strokes
+        merge_tolerance: join strokes whose ends are this close (0 disables merging)
+        start: where the pen is before the first stroke
+        max_passes: 2-opt passes (0 disables it)
+        time_budget: safety cap in seconds on 2-opt (None for none)
+
+    Returns (strokes, {"before": PathStats, "after": PathStats})
+    '''
+
+    before = path_stats(strokes, start)
+    if merge_tolerance > 0:
+        strokes = merge_endpoints(strokes, merge_tolerance)
+    strokes = order_strokes(strokes, start)
+    strokes = two_opt(strokes, start, max_passes, time_budget)
+    return strokes, {"before": before, "after": path_stats(strokes, start)}
@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+# This file has the plotter geometry: strokes made of arcs and polylines
+'''
+A stroke is one continuous pen-down path, stored as a list of pieces. A piece is
+either an Arc or an (n, 2) numpy array of polyline vertices, and each piece starts
+where the previous one ended. Keeping arcs as arcs (instead of flattening them
+right away) means they survive scaling and flipping exactly and can be tessellated
+once, at the final resolution.
+'''
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+class Arc(namedtuple('Arc', 'cx cy r start end')):
+    '''
+    Circular arc from angle `start` to angle `end` (radians).
+
+    A point on the arc is (cx + r*cos(a), cy + r*sin(a)) in whatever space the
+    coordinates live in, so the arc runs towards increasing angles when end > start.
+    '''
+    __slots__ = ()
+
+    @property
+    def sweep(self):
+        return self.end - self.start
+
+    def point(self, angle):
+        return (self.cx + self.r*math.cos(angle), self.cy + self.r*math.sin(angle))
+
+    def reversed(self):
+        return Arc(self.cx, self.cy, self.r, self.end, self.start)
+
+    def length(self):
+        return abs(self.sweep)*self.r
+
+
+def line(p0, p1):
+    '''
+    A two-vertex polyline piece
+    '''
+
+    return np.array((p0, p1), dtype=float)
+
+def piece_start(piece):
+    if isinstance(piece, Arc):
+        return piece.point(piece.start)
+    return (piece[0, 0], piece[0, 1])
+
+def piece_end(piece):
+    if isinstance(piece, Arc):
+        return piece.point(piece.end)
+    return (piece[-1, 0], piece[-1, 1])
+
+def stroke_start(stroke):
+    return piece_start(stroke[0])
+
+def stroke_end(stroke):
+    return piece_end(stroke[-1])
+
+def reverse_stroke(stroke):
+    return [piece.reversed() if isinstance(piece, Arc) else piece[::-1] for piece in reversed(stroke)]
+
+def stroke_length(stroke):
+    length = 0.0
+    for piece in stroke:
+        if isinstance(piece, Arc):
+            length += piece.length()
+        else:
+            length += float(np.hypot(*np.diff(piece, axis=0).T).sum())
+    return length
+
+def transform_strokes(strokes, scale=1.0, offset=(0.0, 0.0), flip_x=False, flip_y=False):
+    '''
+    Applies p -> p*(±scale) + offset to every stroke. Flipping mirrors about the axis
+    through the origin before the offset is added.
+
+    Args:
+        strokes: list of strokes
+        scale: uniform scale factor
+        offset: (dx, dy) added after scaling
+        flip_x, flip_y: mirror the x / y coordinate
+    '''
+
+    sx = -scale if flip_x else scale
+    sy = -scale if flip_y else scale
+    dx, dy = offset
+    out = []
+    for stroke in strokes:
+        new_stroke = []
+        for piece in stroke:
+            if isinstance(piece, Arc):
+                start, end = piece.start, piece.end
+                if flip_x:
+                    start, end = math.pi - start, math.pi - end
+                if flip_y:
+                    start, end = -start, -end
+                new_stroke.append(Arc(piece.cx*sx + dx, piece.cy*sy + dy, piece.r*scale, start, end))
+            else:
+                new_stroke.append(piece*(sx, sy) + (dx, dy))
+        out.append(new_stroke)
+    return out
+
+def arc_bounds(arc):
+    '''
+    Exact (xmin, ymin, xmax, ymax) of an arc: its end points plus any axis extremes it passes
+    '''
+
+    xs = [arc.point(arc.start)[0], arc.point(arc.end)[0]]
+    ys = [arc.point(arc.start)[1], arc.point(arc.end)[1]]
+    lo, hi = min(arc.start, arc.end), max(arc.start, arc.end)
+    k = math.ceil(lo/(math.pi/2))
+    while k*math.pi/2 <= hi and len(xs) < 6:
+        x, y = arc.point(k*math.pi/2)
+        xs.append(x)
+        ys.append(y)
+        k += 1
+    return min(xs), min(ys), max(xs), max(ys)
+
+def bounds(strokes):
+    '''
+    (xmin, ymin, xmax, ymax) over all strokes, or None if there is no geometry
+    '''
+
+    boxes = []
+    for stroke in strokes:
+        for piece in stroke:
+            if isinstance(piece, Arc):
+                boxes.append(arc_bounds(piece))
+            else:
+                boxes.append((piece[:, 0].min(), piece[:, 1].min(), piece[:, 0].max(), piece[:, 1].max()))
+    if not boxes:
+        return None
+    boxes = np.array(boxes)
+    return boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()
+
+def arc_segments(arc, tolerance):
+    '''
+    Number of chords needed so that no chord is further than `tolerance` from the arc
+    '''
+
+    if arc.r <= tolerance:
+        return 1
+    step = 2*math.acos(1 - tolerance/arc.r)
+    return max(1, math.ceil(abs(arc.sweep)/step))
+
+def tessellate_arc(arc, tolerance):
+    '''
+    Polyline approximation of an arc with a maximum chord error of `tolerance`
+    '''
+
+    angles = np.linspace(arc.start, arc.end, arc_segments(arc, tolerance) + 1)
+    return np.stack((arc.cx + arc.r*np.cos(angles), arc.cy + arc.r*np.sin(angles)), axis=1)
+
+def stroke_to_polyline(stroke, tolerance):
+    '''
+    Flattens a stroke into a single (n, 2) vertex array
+    '''
+
+    parts = []
+    for i, piece in enumerate(stroke):
+        points = tessellate_arc(piece, tolerance) if isinstance(piece, Arc) else piece
+        # every piece starts where the previous one ended, don't repeat that vertex
+        parts.append(points if i == 0 else points[1:])
+    return np.concatenate(parts)
+
+def simplify_polyline(points, tolerance):
+    '''
+    Ramer-Douglas-Peucker simplification of an (n, 2) vertex array
+    '''
+
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        seg = b - a
+        seg_len = math.hypot(seg[0], seg[1])
+        inner = points[first + 1:last]
+        if seg_len == 0:
+            dist = np.hypot(*(inner - a).T)
+        else:
+            dist = np.abs(seg[0]*(inner[:, 1] - a[1]) - seg[1]*(inner[:, 0] - a[0]))/seg_len
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            keep[first + 1 + i] = True
+            stack.append((first, first + 1 + i))
+            stack.append((first + 1 + i, last))
+    return points[keep]
+
+def simplify_strokes(strokes, tolerance):
+    '''
+    Simplifies the polyline pieces of every stroke (arcs are already minimal)
+    '''
+
+    return [[piece if isinstance(piece, Arc) else simplify_polyline(piece, tolerance) for piece in stroke] for stroke in strokes]
@@ -0,0 +1,255 @@
+#! /usr/bin/env python3
+# This file keeps per-frame timings of the UI loop
+'''
+Lightweight stage timing for the UI loop.
+
+    profiler = FrameProfiler()
+    with profiler.stage("update"):
+        drawing.update(values, seed)
+    ...
+    profiler.end_frame()
+
+Every stage keeps its last `window` timings so percentiles are rolling. Other
+threads (e.g. the pot sampler) can add timings with record(). When the profiler
+is disabled stage() hands back a shared do-nothing context manager and record()
+returns straight away, so leaving the calls in the loop costs next to nothing.
+
+With a log file, a JSON line with the current percentiles of every stage is
+appended every `log_interval` seconds, for looking at after an event.
+
+StartupTimer is the one-off counterpart for boot: how long each import and
+init step took on the way to the first frame.
+
+RateCounter counts things that happen, rather than timing them, e.g. the I2C
+transactions of the pot reads and LED writes:
+
+    bus = RateCounter()
+    bus.add("pot reads", 10)
+    bus.rates() # {"pot reads": 498.7, ...} per second
+
+    startup = StartupTimer()
+    with startup.step("import pygame"):
+        import pygame
+    ...
+    startup.finish()
+    print(startup.report())
+'''
+import collections
+import contextlib
+import json
+import threading
+import time
+
+
+def percentile(samples, p):
+    '''
+    Nearest-rank percentile (p from 0 to 100) of an already sorted list
+    '''
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(p/100*len(samples)))]
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    '''
+    Times one named stage; reused every frame so nothing is allocated per call
+    '''
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.started)
+        return False
+
+
+class FrameProfiler:
+    '''
+    Rolling timings of named stages plus the whole frame
+    '''
+
+    def __init__(self, enabled=True, window=300, log_file=None, log_interval=10.0):
+        '''
+        Args:
+            enabled: collect timings (can be flipped at any time)
+            window: how many recent timings of each stage to keep
+            log_file: path to append JSON lines to (None for no log)
+            log_interval: seconds between log lines
+        '''
+        self.enabled = enabled
+        self.window = window
+        self.log_file = log_file
+        self.log_interval = log_interval
+        self.frames = 0
+        self._samples = {}
+        self._stages = {}
+        self._lock = threading.Lock() # only for creating new stages from other threads
+        self._frame_start = None
+        self._next_log = time.monotonic() + log_interval
+        self._log = open(log_file, "a", buffering=1) if log_file else None
+
+    def _series(self, name):
+        samples = self._samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(name, collections.deque(maxlen=self.window))
+        return samples
+
+    def stage(self, name):
+        '''
+        Context manager timing the code inside it as stage `name`
+        '''
+        if not self.enabled:
+            return _NULL_STAGE
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = _Stage(self._series(name))
+        return stage
+
+    def record(self, name, seconds):
+        '''
+        Adds one timing for `name` (safe to call from other threads)
+        '''
+        if self.enabled:
+            self._series(name).append(seconds)
+
+    def end_frame(self):
+        '''
+        Call once at the end of every loop iteration: records the frame time and
+        writes a log line when one is due
+        '''
+        if not self.enabled:
+            self._frame_start = None
+            return
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            self._series("frame").append(now - self._frame_start)
+        self._frame_start = now
+        self.frames += 1
+        if self._log and time.monotonic() >= self._next_log:
+            self.dump()
+            self._next_log = time.monotonic() + self.log_interval
+
+    def summary(self):
+        '''
+        {stage: {"p50", "p95", "max", "mean" (all in ms), "n"}} over the rolling window
+        '''
+        out = {}
+        for name, samples in list(self._samples.items()):
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            out[name] = {
+                "p50": 1000*percentile(ordered, 50),
+                "p95": 1000*percentile(ordered, 95),
+                "max": 1000*ordered[-1],
+                "mean": 1000*sum(ordered)/len(ordered),
+                "n": len(ordered),
+            }
+        return out
+
+    def dump(self):
+        '''
+        Appends the current summary to the log file as one JSON line
+        '''
+        if self._log:
+            self._log.write(json.dumps({"time": time.time(), "frames": self.frames, "stages": self.summary()}) + "\n")
+
+    def close(self):
+        if self._log:
+            self.dump()
+            self._log.close()
+            self._log = None
+
+
+class RateCounter:
+    '''
+    Running totals of named counts and their rate per second over the last `window` seconds
+    '''
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.totals = collections.Counter()
+        self._marks = collections.deque([(time.monotonic(), {})]) # (time, totals then), one per rates() call
+        self._lock = threading.Lock() # counts come in from other threads
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.totals[name] += n
+
+    def rates(self):
+        '''
+        {name: per second}, measured from the newest rates() call at least `window`
+        seconds ago (or from the start)
+        '''
+        now = time.monotonic()
+        with self._lock:
+            totals = dict(self.totals)
+            self._marks.append((now, totals))
+            while len(self._marks) > 2 and now - self._marks[1][0] >= self.window:
+                self._marks.popleft()
+            then, before = self._marks[0]
+        elapsed = now - then
+        return {name: (count - before.get(name, 0))/elapsed if elapsed > 0 else 0.0 for name, count in totals.items()}
+
+
+class StartupTimer:
+    '''
+    Wall time of each named startup step, in the order they ran
+    '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = [] # (name, seconds)
+        self.finished = None # seconds from the timer being made to finish()
+
+    @contextlib.contextmanager
+    def step(self, name):
+        '''
+        Context manager timing the code inside it as step `name`
+        '''
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - t))
+
+    def finish(self):
+        '''
+        Marks startup as done (e.g. on the first frame); later calls are ignored
+        '''
+        if self.finished is None:
+            self.finished = time.perf_counter() - self.started
+
+    def summary(self):
+        '''
+        {"steps": [[name, ms], ...], "total": ms until finish() (or so far)}
+        '''
+        total = self.finished if self.finished is not None else time.perf_counter() - self.started
+        return {"steps": [[name, 1000*seconds] for name, seconds in self.steps], "total": 1000*total}
+
+    def report(self):
+        '''
+        The steps as a text table with the slowest one marked, ending with the total
+        '''
+        summary = self.summary()
+        slowest = max((ms for _, ms in summary["steps"]), default=None)
+        lines = ["%-22s %8.1f ms%s" % (name, ms, "  <- slowest" if ms == slowest else "") for name, ms in summary["steps"]]
+        lines.append("%-22s %8.1f ms" % ("(untimed)", summary["total"] - sum(ms for _, ms in summary["steps"])))
+        lines.append("%-22s %8.1f ms" % ("startup total", summary["total"]))
+        return "\n".join(lines)
@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+# This file has the queue of drawings waiting for the plotter
+import collections
+import queue
+import threading
+import time
+
+
+class PlotTooLong(Exception):
+    '''
+    Raised by PlotQueue.submit for a job estimated to take longer than the queue allows
+    '''
+
+
+class PlotJob:
+    '''
+    One G-code file waiting for (or on) the plotter.
+
+    status is queued, streaming, done or failed. While streaming, progress is the
+    latest stream.StreamProgress (None until the first one arrives). estimate is
+    the plottime.PlotEstimate of the file, if one was made.
+    '''
+
+    def __init__(self, job_id, fname, name, estimate=None):
+        self.id = job_id
+        self.fname = fname
+        self.name = name
+        self.estimate = estimate
+        self.status = "queued"
+        self.error = None
+        self.progress = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @property
+    def wait_time(self):
+        '''
+        Seconds spent waiting in line (so far, if it hasn't started)
+        '''
+        return (self.started or time.monotonic()) - self.submitted
+
+    def __repr__(self):
+        return "PlotJob(%d, %r, %s)" % (self.id, self.name, self.status)
+
+
+class PlotQueue:
+    '''
+    Bounded FIFO of plot jobs, shared by the UI (producer) and the plot thread (consumer).
+
+    The consumer sleeps on a condition variable, so a new job starts streaming as
+    soon as it is submitted instead of on the next poll. The UI can be told about
+    every change (a job starting, progress, a job finishing) through on_change.
+    '''
+
+    def __init__(self, maxsize=5, history=20, max_seconds=None, on_change=None):
+        '''
+        Args:
+            maxsize: how many jobs may wait in line (not counting the one plotting)
+            history: how many finished jobs to remember
+            max_seconds: longest estimated plot time accepted (None for no limit)
+            on_change: optional callable(), called (on whichever thread made the change)
+                after a job is submitted, started or finished and on every progress update
+        '''
+        self.maxsize = maxsize
+        self.max_seconds = max_seconds
+        self.on_change = on_change
+        self.current = None # the job being streamed
+        self.history = collections.deque(maxlen=history)
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._next_id = 0
+
+    def submit(self, fname, name=None, estimate=None):
+        '''
+        Adds a G-code file to the end of the line
+
+        Args:
+            fname: the G-code file
+            name: what to call it on screen (fname if None)
+            estimate: optional plottime.PlotEstimate, for time_left() and the max_seconds check
+
+        Returns the PlotJob, raises queue.Full if the backlog is full and PlotTooLong
+        if the estimate is over max_seconds
+        '''
+        if estimate is not None and self.max_seconds is not None and estimate.seconds > self.max_seconds:
+            raise PlotTooLong("%s would take %.0fs to plot, the limit is %.0fs" % (name or fname, estimate.seconds, self.max_seconds))
+        with self._cond:
+            if len(self._pending) >= self.maxsize:
+                raise queue.Full("plot queue is full (%d waiting)" % len(self._pending))
+            job = PlotJob(self._next_id, fname, name or fname, estimate)
+            self._next_id += 1
+            self._pending.append(job)
+            self._cond.notify_all()
+        self._notify()
+        return job
+
+    def get(self, timeout=None):
+        '''
+        Consumer side: waits for the next job and marks it as streaming
+
+        Returns the job, or None on timeout or once the queue is closed
+        '''
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending or self._closed, timeout):
+                return None
+            if self._closed:
+                return None
+            job = self._pending.popleft()
+            job.status = "streaming"
+            job.started = time.monotonic()
+            self.current = job
+            self._cond.notify_all()
+        self._notify()
+        return job
+
+    def finish(self, job, error=None):
+        '''
+        Consumer side: marks the streaming job as done (or failed with `error`)
+        '''
+        with self._cond:
+            job.status = "failed" if error is not None else "done"
+            job.error = error
+            job.finished = time.monotonic()
+            if self.current is job:
+                self.current = None
+            self.history.append(job)
+            self._cond.notify_all()
+        self._notify()
+
+    def update_progress(self, job, progress):
+        '''
+        Consumer side: publishes streaming progress for the UI to pick up
+        '''
+        with self._cond:
+            job.progress = progress
+        self._notify()
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def close(self):
+        '''
+        Wakes up the consumer and makes get() return None from now on
+        '''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        '''
+        Number of jobs waiting (not counting the one plotting)
+        '''
+        with self._cond:
+            return len(self._pending)
+
+    def full(self):
+        with self._cond:
+            return len(self._pending) >= self.maxsize
+
+    def busy(self):
+        with self._cond:
+            return self.current is not None or bool(self._pending)
+
+    def position(self, job):
+        '''
+        Place in line: 0 while plotting, 1 for next up, ... and None once finished
+        '''
+        with self._cond:
+            if job is self.current:
+                return 0
+            for i, pending in enumerate(self._pending):
+                if pending is job:
+                    return i + 1
+            return None
+
+    def time_left(self, job):
+        '''
+        Estimated seconds until `job` is done plotting, counting the jobs ahead of it,
+        or None if that isn't known (a job without an estimate, or finished)
+        '''
+        with self._cond:
+            if job is not self.current and job not in self._pending:
+                return None
+            total = 0.0
+            if self.current is not None:
+                current = self.current
+                if current.progress is not None and current.progress.eta is not None:
+                    total += current.progress.eta # measured while streaming
+                elif current.estimate is not None:
+                    total += max(0.0, current.estimate.seconds - (time.monotonic() - current.started))
+                else:
+                    return None
+                if job is current:
+                    return total
+            for pending in self._pending:
+                if pending.estimate is None:
+                    return None
+                total += pending.estimate.seconds
+                if pending is job:
+                    return total
+
+    def snapshot(self):
+        '''
+        Returns (current job, list of waiting jobs) for display
+        '''
+        with self._cond:
+            return self.current, list(self._pending)
+
+    def longest_wait(self):
+        '''
+        Seconds the job at the front of the line has been waiting
+        '''
+        with self._cond:
+            return self._pending[0].wait_time if self._pending else 0.0
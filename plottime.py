@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+# This file estimates how long the plotter will take for a G-code file
+'''
+Plot time estimate from G-code, with grbl's motion planning.
+
+Every move becomes a planner block the way grbl makes one: rapids run at the
+per-axis max rates ($110-$112), feeds at F, both limited so no axis goes over
+its max rate or acceleration ($120-$122). G2/G3 arcs are cut into the same
+chords grbl uses ($12 arc tolerance). Corners are taken at grbl's junction
+speed ($11 junction deviation), and every block speeds up and slows down with
+a trapezoid profile.
+
+grbl only plans `planner_blocks` moves ahead, so it must always be able to stop
+by the end of what it has buffered. That is what keeps short tessellated moves
+slow, and it is modelled as an extra limit on each block's speed.
+
+Pen up and down are the Z moves of the gwrite profile (segment_first lifts to
+Z3, moves, drops to Z0). XY motion while Z is at or below pen_down_z counts as
+drawing, the rest as travel.
+
+    estimate = estimate_gcode("drawing.gcode")
+    print(estimate.seconds, estimate.pen_down_mm, estimate.travel_mm)
+
+MotionPlanner.line_seconds() splits the same estimate up per G-code line, which
+is what the streamer bases its progress and ETA on.
+
+The numbers are for the motion only; streaming overhead is small next to it.
+They are only as good as the plotter's settings in machine.py (the [grbl] table
+of test_party_config.cfg), which still need reading off the plotter.
+'''
+import collections
+import io
+import math
+import re
+
+import machine
+
+SETTINGS = machine.grbl_settings() # the plotter's $ settings
+PLANNER_BLOCKS = 15 # grbl's planner buffer on an Uno (the Bf: field)
+JUNCTION_DEVIATION = SETTINGS[11] # mm
+ARC_TOLERANCE = SETTINGS[12] # mm
+PEN_DOWN_Z = 0.0 # mm, Z of the pen touching the paper in test_party_config
+MIN_JUNCTION_SPEED = 0.0 # mm/s
+
+PlotEstimate = collections.namedtuple("PlotEstimate", "seconds pen_down_mm travel_mm lines moves")
+
+_WORD = re.compile(r"([A-Z])([-+]?[0-9]*\.?[0-9]*)")
+_COMMENT = re.compile(r"\(.*?\)|;.*")
+
+
+def _block_limits(unit, rates, accels):
+    '''
+    Highest speed (mm/s) and acceleration (mm/s^2) along the unit vector that
+    keep every axis within its own limits
+    '''
+    speed = accel = math.inf
+    for u, rate, a in zip(unit, rates, accels):
+        if u:
+            speed = min(speed, rate/abs(u))
+            accel = min(accel, a/abs(u))
+    return speed, accel
+
+def _arc_chords(start, target, center, clockwise, tolerance):
+    '''
+    End points of the straight segments grbl cuts a G2/G3 arc into
+    '''
+    cx, cy = center
+    r = math.hypot(start[0] - cx, start[1] - cy)
+    a0 = math.atan2(start[1] - cy, start[0] - cx)
+    a1 = math.atan2(target[1] - cy, target[0] - cx)
+    sweep = a1 - a0
+    if clockwise:
+        if sweep >= -1e-9:
+            sweep -= 2*math.pi
+    elif sweep <= 1e-9:
+        sweep += 2*math.pi
+    if r <= tolerance:
+        return [target]
+    segments = int(abs(0.5*sweep*r)/math.sqrt(tolerance*(2*r - tolerance)))
+    points = []
+    for k in range(1, segments):
+        a = a0 + sweep*k/segments
+        points.append((cx + r*math.cos(a), cy + r*math.sin(a), start[2] + (target[2] - start[2])*k/segments))
+    points.append(tuple(target))
+    return points
+
+def parse_moves(lines):
+    '''
+    Walks G-code lines and yields ("move", start, end, feed or None for a rapid)
+    for every straight motion (arcs already cut into chords), ("sync", seconds)
+    where grbl empties the planner (dwells, spindle / program commands), and
+    ("line", index in lines) for every line with a command, before its moves
+
+    Args:
+        lines: iterable of G-code lines
+    '''
+    position = [0.0, 0.0, 0.0]
+    motion = 0
+    feed = None
+    scale = 1.0
+    absolute = True
+    for index, raw in enumerate(lines):
+        words = [(letter, float(value) if value not in ("", "+", "-", ".") else 0.0)
+                 for letter, value in _WORD.findall(_COMMENT.sub("", raw).upper().replace(" ", ""))]
+        if not words:
+            continue
+        yield ("line", index)
+        target = list(position)
+        offsets = {}
+        has_axis = False
+        dwell = None
+        sync = False
+        for letter, value in words:
+            if letter == "G":
+                if value in (0, 1, 2, 3):
+                    motion = int(value)
+                elif value == 4:
+                    dwell = 0.0
+                elif value == 20:
+                    scale = 25.4
+                elif value == 21:
+                    scale = 1.0
+                elif value == 90:
+                    absolute = True
+                elif value == 91:
+                    absolute = False
+            elif letter == "M":
+                sync = True
+            elif letter == "F":
+                feed = value*scale
+            elif letter in "XYZ":
+                has_axis = True
+                axis = "XYZ".index(letter)
+                target[axis] = value*scale if absolute else position[axis] + value*scale
+            elif letter in "IJ":
+                offsets[letter] = value*scale
+            elif letter == "P" and dwell is not None:
+                dwell = value
+        if dwell is not None or sync:
+            yield ("sync", dwell or 0.0)
+            continue
+        if not has_axis:
+            continue
+        if motion in (2, 3):
+            center = (position[0] + offsets.get("I", 0.0), position[1] + offsets.get("J", 0.0))
+            start = tuple(position)
+            for end in _arc_chords(start, target, center, motion == 2, ARC_TOLERANCE):
+                yield ("move", start, end, feed)
+                start = end
+        else:
+            yield ("move", tuple(position), tuple(target), feed if motion else None)
+        position = target
+
+
+class MotionPlanner:
+    '''
+    Times a stream of moves with grbl's acceleration and junction speed rules
+    '''
+
+    def __init__(self, settings=None, planner_blocks=PLANNER_BLOCKS, junction_deviation=JUNCTION_DEVIATION, pen_down_z=PEN_DOWN_Z):
+        '''
+        Args:
+            settings: grbl $ settings overriding the plotter's (SETTINGS, max rates
+                $110-$112 in mm/min, accelerations $120-$122 in mm/s^2)
+            planner_blocks: how many moves grbl plans ahead
+            junction_deviation: grbl's $11, in mm
+            pen_down_z: Z at or below which the pen is drawing
+        '''
+        s = dict(SETTINGS)
+        s.update(settings or {})
+        self.rates = [s[110]/60.0, s[111]/60.0, s[112]/60.0] # mm/s
+        self.accels = [s[120], s[121], s[122]]
+        self.planner_blocks = planner_blocks
+        self.junction_deviation = junction_deviation
+        self.pen_down_z = pen_down_z
+
+    def estimate(self, lines):
+        '''
+        Returns a PlotEstimate for an iterable of G-code lines
+        '''
+        times, pen_down, travel, line_count, moves = self._walk(lines)
+        return PlotEstimate(sum(times.values()), pen_down, travel, line_count, moves)
+
+    def line_seconds(self, lines):
+        '''
+        Estimated seconds of machine time that each of `lines` (a list) accounts
+        for, in order: its moves and any dwell. Lines without either get 0.
+        '''
+        times = self._walk(lines)[0]
+        return [times.get(i, 0.0) for i in range(len(lines))]
+
+    def _walk(self, lines):
+        '''
+        Plans all the moves; returns ({line index: seconds}, pen down mm, travel mm,
+        lines with a command, moves)
+        '''
+        times = collections.defaultdict(float)
+        pen_down = travel = 0.0
+        line_count = moves = 0
+        line = None # index of the line the moves come from
+        # the blocks of one planned run (between syncs): length, nominal speed, accel, max entry speed, line
+        lengths, nominal, accel, entry, owners = [], [], [], [], []
+        prev_unit = None
+
+        def run_times():
+            if lengths:
+                for owner, seconds in zip(owners, self._block_times(lengths, nominal, accel, entry)):
+                    times[owner] += seconds
+
+        for item in parse_moves(lines):
+            kind = item[0]
+            if kind == "line":
+                line_count += 1
+                line = item[1]
+                continue
+            if kind == "sync":
+                run_times()
+                times[line] += item[1]
+                lengths, nominal, accel, entry, owners = [], [], [], [], []
+                prev_unit = None
+                continue
+
+            _, start, end, feed = item
+            delta = [e - s for s, e in zip(start, end)]
+            length = math.sqrt(sum(d*d for d in delta))
+            if length < 1e-9:
+                continue
+            moves += 1
+            xy = math.hypot(delta[0], delta[1])
+            if max(start[2], end[2]) <= self.pen_down_z + 1e-6:
+                pen_down += xy
+            else:
+                travel += xy
+
+            unit = [d/length for d in delta]
+            speed, a = _block_limits(unit, self.rates, self.accels)
+            if feed is not None:
+                speed = min(speed, feed/60.0)
+
+            # grbl's junction speed: the largest speed at which the corner stays
+            # within junction_deviation of the path, given the acceleration
+            if prev_unit is None:
+                v_junction = 0.0
+            else:
+                cos_theta = -sum(p*u for p, u in zip(prev_unit, unit))
+                if cos_theta > 0.999999: # reversing
+                    v_junction = MIN_JUNCTION_SPEED
+                elif cos_theta < -0.999999: # straight on
+                    v_junction = math.inf
+                else:
+                    sin_half = math.sqrt(0.5*(1.0 - cos_theta))
+                    v_junction = math.sqrt(max(MIN_JUNCTION_SPEED**2, a*self.junction_deviation*sin_half/(1.0 - sin_half)))
+                v_junction = min(v_junction, speed, nominal[-1])
+
+            lengths.append(length)
+            nominal.append(speed)
+            accel.append(a)
+            entry.append(v_junction)
+            owners.append(line)
+            prev_unit = unit
+
+        run_times()
+        return times, pen_down, travel, line_count, moves
+
+    def _block_times(self, lengths, nominal, accel, entry):
+        '''
+        Seconds each block of a run takes, for a run that starts and ends standing still
+        '''
+        n = len(lengths)
+        # with only planner_blocks buffered grbl has to be able to stop within them
+        horizon = [0.0]*(n + 1)
+        for i in range(n - 1, -1, -1):
+            horizon[i] = horizon[i + 1] + lengths[i]
+            if i + self.planner_blocks < n:
+                horizon[i] -= lengths[i + self.planner_blocks]
+        v = [0.0]*(n + 1) # speed at the start of each block, and at the very end
+        for i in range(1, n):
+            v[i] = min(entry[i], math.sqrt(2*accel[i]*horizon[i]))
+
+        # backward pass: every block must be able to slow down to the next entry speed
+        for i in range(n - 1, 0, -1):
+            v[i] = min(v[i], math.sqrt(v[i + 1]**2 + 2*accel[i]*lengths[i]))
+        # forward pass: and to speed up to it
+        for i in range(n):
+            v[i + 1] = min(v[i + 1], math.sqrt(v[i]**2 + 2*accel[i]*lengths[i]))
+
+        seconds = []
+        for i in range(n):
+            v0, v1, vn, a, length = v[i], v[i + 1], nominal[i], accel[i], lengths[i]
+            d_up = (vn*vn - v0*v0)/(2*a)
+            d_down = (vn*vn - v1*v1)/(2*a)
+            if d_up + d_down <= length: # trapezoid: reaches the nominal speed
+                seconds.append((vn - v0)/a + (vn - v1)/a + (length - d_up - d_down)/vn)
+            else: # triangle
+                peak = math.sqrt((2*a*length + v0*v0 + v1*v1)/2)
+                seconds.append((peak - v0)/a + (peak - v1)/a)
+        return seconds
+
+
+def estimate_gcode(file, **kwargs):
+    '''
+    PlotEstimate for a G-code file
+
+    Args:
+        file: file name or open text file
+        kwargs: passed on to MotionPlanner
+    '''
+    planner = MotionPlanner(**kwargs)
+    if hasattr(file, "read"):
+        return planner.estimate(file)
+    with open(file) as f:
+        return planner.estimate(f)
+
+def estimate_strokes(strokes, profile=None, **kwargs):
+    '''
+    PlotEstimate for laid out strokes (page pixels, see export.plot_strokes), by
+    writing their G-code in memory
+    '''
+    import export
+    out = io.StringIO()
+    export.write_gcode(strokes, out, profile)
+    out.seek(0)
+    return estimate_gcode(out, **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Estimate how long G-code takes to plot')
+    parser.add_argument('files', nargs='+', help='G-code files')
+    parser.add_argument('-b', '--planner-blocks', type=int, default=PLANNER_BLOCKS, help='grbl planner buffer (default %(default)s)')
+    args = parser.parse_args()
+
+    for fname in args.files:
+        e = estimate_gcode(fname, planner_blocks=args.planner_blocks)
+        print("%s: %d:%02d (%.0fs), %.0fmm drawing, %.0fmm travel, %d lines, %d moves" % (
+            fname, *divmod(int(round(e.seconds)), 60), e.seconds, e.pen_down_mm, e.travel_mm, e.lines, e.moves))
@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+# This file generates and rasterizes the on-screen art in its own process
+'''
+Off-thread preview rendering.
+
+Generating and rasterizing a drawing can take a while for some pot settings,
+and on the UI's thread that stalls button polling, the LEDs and the pygame
+event loop with it. PreviewRenderer moves the ArtproofDrawing into a worker
+process that renders into a shared-memory framebuffer with two slots:
+
+    preview = PreviewRenderer((600, 600))
+    preview.request(values, seed)   # never waits
+    ...
+    if preview.poll():              # a frame finished since the last poll
+        pygame.display.update(preview.draw(screen))
+
+Only one frame is ever being rendered. It goes into the slot that is not on
+screen, so the UI can blit the shown slot at any time without tearing. Values
+requested while the worker is busy replace each other and only the latest is
+rendered next, so a slow drawing leaves the previous frame up instead of
+freezing the UI, and a fast-moving slider doesn't build up a backlog.
+
+If the worker process dies it is started again with the latest request, up to
+MAX_RESTARTS times in a row; after that the last frame just stays up.
+'''
+import multiprocessing
+import time
+
+FRAME_FORMAT = "RGB" # pygame.image.frombuffer format of a framebuffer slot
+BYTES_PER_PIXEL = 3
+MAX_RESTARTS = 3 # worker deaths in a row (without a frame in between) before giving up on it
+
+
+def _frame_surfaces(pixels, dimensions):
+    '''
+    The two framebuffer slots in the shared pixel array, as pygame surfaces sharing its memory
+    '''
+    import pygame
+    size = dimensions[0]*dimensions[1]*BYTES_PER_PIXEL
+    view = memoryview(pixels)
+    return [pygame.image.frombuffer(view[slot*size:(slot + 1)*size], dimensions, FRAME_FORMAT) for slot in range(2)]
+
+def _render_worker(conn, pixels, dimensions, cache_size, surface_cache_size):
+    '''
+    Worker process: renders each (slot, values, seed) request into that slot and
+    answers ("frame", slot, cache_key, update seconds, render seconds), or
+    ("error", slot, repr of the exception). Stops on None or a closed pipe.
+    '''
+    from art import ArtproofDrawing
+    frames = _frame_surfaces(pixels, dimensions)
+    drawing = ArtproofDrawing(dimensions, [], None, cache_size=cache_size, surface_cache_size=surface_cache_size)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt): # the UI went away
+            return
+        if message is None:
+            return
+        slot, values, seed = message
+        try:
+            started = time.perf_counter()
+            drawing.update(values, seed)
+            generated = time.perf_counter()
+            frames[slot].blit(drawing.render(), (0, 0))
+            conn.send(("frame", slot, drawing.cache_key, generated - started, time.perf_counter() - generated))
+        except Exception as e:
+            conn.send(("error", slot, repr(e)))
+
+
+class PreviewRenderer:
+    '''
+    An ArtproofDrawing in a worker process, showing its latest finished frame
+    '''
+
+    def __init__(self, dimensions, cache_size=64, surface_cache_size=8):
+        '''
+        Args:
+            dimensions: (width, height) of the drawing
+            cache_size, surface_cache_size: passed on to the worker's ArtproofDrawing
+        '''
+        self.dimensions = tuple(dimensions)
+        self.cache_size = cache_size
+        self.surface_cache_size = surface_cache_size
+
+        self.version = 0 # bumped whenever a new frame is ready to be drawn
+        self.cache_key = None # (quantized values, seed) of the newest frame, None until there is one
+        self.update_seconds = self.render_seconds = None # worker timings of the newest frame
+        self.restarts = 0
+        self.errors = 0
+        self._failures = 0 # restarts since the last good frame
+
+        # forkserver children start from a clean process, not a copy of the UI with its threads
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+        self._pixels = self._ctx.RawArray("B", 2*self.dimensions[0]*self.dimensions[1]*BYTES_PER_PIXEL)
+        self._frames = _frame_surfaces(self._pixels, self.dimensions)
+        self._shown = 0 # slot holding the newest finished frame
+        self._pending = None # latest (values, seed) not yet sent to the worker
+        self._busy = None # (values, seed) the worker is rendering
+        self._process = None
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._process = self._ctx.Process(target=_render_worker, name="preview", daemon=True,
+                                          args=(child_conn, self._pixels, self.dimensions, self.cache_size, self.surface_cache_size))
+        self._process.start()
+        child_conn.close()
+
+    def _send(self):
+        values, seed = self._busy = self._pending
+        self._pending = None
+        try:
+            self._conn.send((1 - self._shown, values, seed))
+        except OSError: # it died while idle
+            self._restart()
+
+    def _restart(self):
+        '''
+        Starts a new worker in place of a dead one and hands it the latest request
+        '''
+        self._conn.close()
+        self._process.join(timeout=1)
+        if self._pending is None:
+            self._pending = self._busy
+        self._busy = None
+        self._failures += 1
+        if self._failures > MAX_RESTARTS:
+            print("Preview worker stopped (exit code %s) %d times in a row, giving up" % (self._process.exitcode, self._failures))
+            self._process = None
+            return
+        self.restarts += 1
+        print("Preview worker stopped (exit code %s), restarting" % self._process.exitcode)
+        self._start()
+        if self._pending is not None:
+            self._send()
+
+    def request(self, values, seed=0):
+        '''
+        Asks for the drawing for these values and seed; returns straight away
+        '''
+        self._pending = (tuple(int(v) for v in values), seed)
+        if self._busy is None and self._process is not None:
+            self._send()
+
+    def poll(self):
+        '''
+        Picks up a finished frame, if there is one, and sends the next request on.
+        Never blocks.
+
+        Returns True when a new frame is ready for draw()
+        '''
+        fresh = False
+        try:
+            while self._busy is not None and self._conn.poll():
+                message = self._conn.recv()
+                if message[0] == "frame":
+                    _, self._shown, self.cache_key, self.update_seconds, self.render_seconds = message
+                    self.version += 1
+                    self._failures = 0
+                    fresh = True
+                else:
+                    self.errors += 1
+                    print("Rendering %s failed: %s" % (self._busy, message[2]))
+                self._busy = None
+                if self._pending is not None:
+                    self._send()
+        except (EOFError, OSError): # the worker died mid frame
+            self._restart()
+        return fresh
+
+    @property
+    def busy(self):
+        '''
+        True while a frame is being rendered
+        '''
+        return self._busy is not None
+
+    def surface(self):
+        '''
+        The newest finished frame (shares memory with the framebuffer)
+        '''
+        return self._frames[self._shown]
+
+    def draw(self, screen, position=(0, 0)):
+        '''
+        Blits the newest finished frame onto the screen
+
+        Returns the pygame.Rect that was touched, for pygame.display.update
+        '''
+        return screen.blit(self._frames[self._shown], position)
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(timeout=2)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+        self._process = None
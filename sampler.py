@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+# This file reads the potentiometers in the background
+import threading
+import time
+
+
+class PotSampler(threading.Thread):
+    '''
+    Polls the potentiometers on its own thread and publishes a stable snapshot.
+
+    Raw readings are smoothed with an exponential moving average and a published
+    value only moves once the smoothed reading is more than `hysteresis` counts
+    away from it, so ADC jitter never shows up as a change. Every time a published
+    value moves the version counter goes up; readers compare versions instead of
+    comparing value lists, or get an on_change call.
+    '''
+
+    def __init__(self, pots, rate=50, smoothing=0.5, hysteresis=4, profiler=None, on_change=None, after_sample=None, bus=None):
+        '''
+        Args:
+            pots: a list of AnalogInput objects (anything with a .value from 0 to 1023)
+            rate: polls per second
+            smoothing: weight of a new reading in the moving average (1 = no smoothing)
+            hysteresis: how many counts a value has to move before it is published
+            profiler: optional FrameProfiler, told how long each poll of all pots takes ("pot_read")
+            on_change: optional callable(version, values), called on the sampler thread whenever a value moves
+            after_sample: optional callable() run on the sampler thread after every poll, for
+                other traffic on the same bus (e.g. leds.PixelWriter.flush)
+            bus: optional perf.RateCounter, told about every pot read ("pot reads")
+        '''
+        super().__init__(daemon=True)
+        self.pots = pots
+        self.period = 1.0/rate
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        self.profiler = profiler
+        self.on_change = on_change
+        self.after_sample = after_sample
+        self.bus = bus
+
+        self.errors = 0 # failed I2C reads
+        self.samples = 0 # completed polls of all pots
+
+        self._stop_event = threading.Event()
+        self._changed = threading.Condition()
+
+        # prime with one synchronous read so a snapshot is valid before the thread starts
+        raw = [pot.value for pot in pots]
+        self._smoothed = [float(v) for v in raw]
+        self._values = tuple(raw)
+        self._version = 0
+
+    def snapshot(self):
+        '''
+        Returns (version, values) for the latest published values
+        '''
+        with self._changed:
+            return self._version, self._values
+
+    def wait_for_change(self, version, timeout=None):
+        '''
+        Blocks until the published version differs from `version` (or the timeout passes)
+
+        Returns the same thing as snapshot()
+        '''
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._values
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def sample(self):
+        '''
+        Reads every pot once and publishes any value that moved past the hysteresis band
+        '''
+        started = time.perf_counter()
+        published = list(self._values)
+        changed = False
+        for i, pot in enumerate(self.pots):
+            try:
+                raw = pot.value
+            except (OSError, RuntimeError): # I2C hiccup, keep the previous reading
+                self.errors += 1
+                continue
+
+            smoothed = self._smoothed[i] + self.smoothing*(raw - self._smoothed[i])
+            self._smoothed[i] = smoothed
+
+            target = min(1023, max(0, int(round(smoothed))))
+            # always let the value settle on the ends of the range, otherwise a slider
+            # pushed all the way could stop a few counts short
+            at_end = target in (0, 1023) and target != published[i]
+            if abs(smoothed - published[i]) > self.hysteresis or at_end:
+                published[i] = target
+                changed = True
+
+        self.samples += 1
+        if self.bus is not None:
+            self.bus.add("pot reads", len(self.pots))
+        if self.profiler is not None:
+            self.profiler.record("pot_read", time.perf_counter() - started)
+        if changed:
+            with self._changed:
+                self._values = tuple(published)
+                self._version += 1
+                self._changed.notify_all()
+                version = self._version
+            if self.on_change is not None:
+                self.on_change(version, tuple(published))
+
+    def run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            self.sample()
+            if self.after_sample is not None: # the bus slot between this poll and the next
+                self.after_sample()
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else: # fell behind, don't try to catch up with a burst of reads
+                next_time = time.monotonic()
@@ -47,20 +47,123 @@ import re
 import time
 import sys
 import argparse
+from collections import deque, namedtuple
 # import threading
 
 RX_BUFFER_SIZE = 128
+PLANNER_BLOCKS = 15 # grbl's planner buffer on an Uno, the most the Bf: field ever reports free
 
-def wait_idle(port, verbose=False):
-    resp = "Busy"
-    while not resp.startswith("<Idle"):
-        port.write(b"?\n")
-        resp = port.readline().decode('UTF8')
-        while not resp.startswith("<"):
-            time.sleep(0.1)
-            resp = port.readline().decode('UTF8')
-        if verbose:
-            print("status: " + resp)
+class ResponseReader:
+    '''
+    Splits grbl's output into lines without blocking on every line.
+
+    read() only takes what is already waiting in the serial input; with
+    block=True it waits (up to the port timeout) for at least one more byte first.
+    '''
+
+    def __init__(self, port):
+        self.port = port
+        self._partial = b""
+
+    def _waiting(self):
+        waiting = getattr(self.port, "in_waiting", None)
+        return self.port.inWaiting() if waiting is None else waiting
+
+    def read(self, block=False):
+        data = b""
+        waiting = self._waiting()
+        if waiting:
+            data = self.port.read(waiting)
+        elif block:
+            data = self.port.read(1)
+            waiting = self._waiting()
+            if data and waiting:
+                data += self.port.read(waiting)
+        if not data:
+            return []
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return [line.decode("UTF8", "replace").strip() for line in lines if line.strip()]
+
+class GrblError(Exception):
+    pass
+
+GrblStatus = namedtuple("GrblStatus", "state mpos wpos planner_free rx_free feed raw")
+
+def parse_status(line):
+    '''
+    Parses a grbl status report, e.g. <Run|MPos:1.000,2.000,0.000|Bf:15,128|FS:3000,0>
+    (grbl 1.1) or <Run,MPos:1.000,2.000,0.000,WPos:...> (grbl 0.9)
+
+    Returns a GrblStatus, or None if the line isn't a status report
+    '''
+    if not (line.startswith("<") and line.endswith(">")):
+        return None
+    body = line[1:-1]
+    fields = {}
+    if "|" in body:
+        parts = body.split("|")
+        state = parts[0]
+        for part in parts[1:]:
+            key, _, value = part.partition(":")
+            fields[key] = value
+    else: # 0.9 style, everything comma separated
+        state, _, rest = body.partition(",")
+        for key, value in re.findall(r"(\w+):([-\d.,]+?)(?=,\w+:|$)", rest):
+            fields[key] = value
+
+    numbers = lambda key: tuple(float(v) for v in fields[key].split(",")) if key in fields else None
+    buffers = numbers("Bf") or (None, None)
+    feed = numbers("FS") or numbers("F")
+    return GrblStatus(state, numbers("MPos"), numbers("WPos"),
+                      int(buffers[0]) if buffers[0] is not None else None,
+                      int(buffers[1]) if buffers[1] is not None else None,
+                      feed[0] if feed else None, line)
+
+def wait_idle(port, verbose=False, interval=0.02, reader=None, on_status=None, stale=0):
+    '''
+    Polls grbl with the real-time "?" status query until it reports Idle.
+
+    "?" is handled by grbl as soon as it arrives (it never goes through the line
+    buffer and gets no "ok"), so this notices the end of motion within `interval`.
+
+    Args:
+        port: an open serial port to grbl
+        verbose: print every status report
+        interval: seconds between status queries
+        reader: the ResponseReader already used on this port, if any
+        on_status: optional callable given every GrblStatus
+        stale: number of "?" queries already sent whose replies should be ignored
+            (they describe the machine before the last line was acknowledged)
+
+    Returns the final GrblStatus, raises GrblError if grbl is in an alarm state
+    '''
+    reader = reader or ResponseReader(port)
+    saved_timeout = port.timeout
+    port.timeout = interval
+    try:
+        while True:
+            port.write(b"?")
+            deadline = time.monotonic() + interval
+            while time.monotonic() < deadline:
+                for resp in reader.read(block=True):
+                    status = parse_status(resp)
+                    if status is None:
+                        if verbose: print("REC:", resp)
+                        continue
+                    if verbose:
+                        print("status: " + resp)
+                    if stale > 0:
+                        stale -= 1
+                        continue
+                    if on_status:
+                        on_status(status)
+                    if status.state.startswith("Idle"):
+                        return status
+                    if status.state.startswith("Alarm"):
+                        raise GrblError("grbl is in alarm state: " + resp)
+    finally:
+        port.timeout = saved_timeout
 
 def open_port_and_home(portname, verbose=False):
     s = serial.Serial(portname, 115200, timeout=1.0)
@@ -90,7 +193,7 @@ def stream_settings(port, file, verbose=False):
     # Send settings file via simple call-response streaming method. Settings must be streamed
     # in this manner since the EEPROM accessing cycles shut-off the serial interrupt.
     if verbose:
-        print("SETTINGS MODE: Streaming", args.gcode_file.name, " to ", args.device_file)
+        print("SETTINGS MODE: Streaming", getattr(file, "name", file), " to ", getattr(port, "port", port))
     for line in file:
         l_count += 1 # Iterate line counter
         # l_block = re.sub('\s|\(.*?\)','',line).upper() # Strip comments/spaces/new line and capitalize
@@ -100,52 +203,260 @@ def stream_settings(port, file, verbose=False):
         grbl_out = port.readline().strip() # Wait for grbl response with carriage return
         if verbose: print('REC:', grbl_out)
 
-def stream_gcode(port, file, verbose=False):
-# Stream g-code to grbl
-    l_count = 0
+class StreamStats:
+    '''
+    Counters and timings for one streamed job.
+
+    Occupancy is sampled right after every send, in bins of OCCUPANCY_BIN bytes.
+
+    A planner starvation event is grbl's planner running out of blocks (a status
+    report with every planner block free) while lines of the job are still to be
+    sent or acknowledged, counted once each time it happens; planner_empty_reports
+    times the status interval is roughly how long it stayed dry. It can only be seen
+    with status polling on (stream_gcode's status_interval).
+
+    An RX drained event is a send that found grbl's serial buffer already empty
+    (every earlier line acknowledged). That only says the host was behind on
+    serial; the planner may still have had plenty buffered.
+    '''
+    OCCUPANCY_BIN = 8
+
+    def __init__(self, rx_buffer_size=RX_BUFFER_SIZE, planner_blocks=PLANNER_BLOCKS):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.lines = 0
+        self.bytes = 0
+        self.oks = 0
+        self.errors = 0
+        self.status_reports = 0 # reports that came in while streaming
+        self.planner_starvation_events = 0
+        self.planner_empty_reports = 0 # reports that found the planner empty mid job
+        self.rx_drained_events = 0
+        self.ok_latency = [] # seconds from sending a line to its ok/error
+        self.occupancy = [0]*(rx_buffer_size//self.OCCUPANCY_BIN + 1)
+        self.started = None
+        self.finished = None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        '''
+        The stats as a plain dict (rates per second, latencies in ms)
+        '''
+        elapsed = self.elapsed()
+        latency = sorted(self.ok_latency)
+        pct = lambda p: 1000*latency[min(len(latency) - 1, int(p*len(latency)))] if latency else 0.0
+        return {
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "oks": self.oks,
+            "errors": self.errors,
+            "seconds": elapsed,
+            "lines_per_s": self.lines/elapsed if elapsed else 0.0,
+            "bytes_per_s": self.bytes/elapsed if elapsed else 0.0,
+            "ok_latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+            # None when nobody polled status, there is no way to tell then
+            "planner_starvation_events": self.planner_starvation_events if self.status_reports else None,
+            "planner_empty_reports": self.planner_empty_reports if self.status_reports else None,
+            "rx_drained_events": self.rx_drained_events,
+            "occupancy": {"bin_bytes": self.OCCUPANCY_BIN, "counts": list(self.occupancy)},
+        }
+
+StreamProgress = namedtuple("StreamProgress",
+    "lines_sent lines_acked total fraction elapsed eta state position planner_free rx_free")
+
+def stream_gcode(port, file, verbose=False, rx_buffer_size=RX_BUFFER_SIZE, stats=None,
+                 status_interval=None, on_progress=None, line_seconds=None):
+    '''
+    Streams g-code with character counting: lines are sent as long as they fit in
+    what is left of grbl's serial RX buffer, so grbl never waits on a round trip.
+
+    With status_interval set, a real-time "?" query goes out that often while
+    streaming. "?" doesn't take up room in the RX buffer and gets a <...> status
+    report instead of an ok, so reports are parsed separately from the ok/error
+    replies that the character counting relies on.
+
+    Args:
+        port: an open serial port to grbl
+        file: iterable of g-code lines
+        verbose: print every line sent and received
+        rx_buffer_size: size of grbl's serial receive buffer
+        stats: a StreamStats to fill in (a new one is made if None)
+        status_interval: seconds between status queries (None to not poll)
+        on_progress: optional callable given a StreamProgress after every status
+            report, and every 1% of acknowledged lines when not polling
+        line_seconds: estimated machine seconds of every line (see
+            plottime.MotionPlanner.line_seconds), worked out here if None. Progress
+            and ETA go by these rather than by line count, since one line can be a
+            long move or a tiny segment.
+
+    Returns the StreamStats
+    '''
     # Send g-code program via a more agressive streaming protocol that forces characters into
     # Grbl's serial read buffer to ensure Grbl has immediate access to the next g-code command
     # rather than wait for the call-response serial protocol to finish. This is done by careful
     # counting of the number of characters sent by the streamer to Grbl and tracking Grbl's 
     # responses, such that we never overflow Grbl's serial read buffer. 
-    g_count = 0
-    c_line = []
-    # periodic() # Start status report periodic timer
-    for line in file:
-        l_count += 1 # Iterate line counter
-        # l_block = re.sub('\s|\(.*?\)','',line).upper() # Strip comments/spaces/new line and capitalize
-        l_block = line.strip()
-        c_line.append(len(l_block)+1) # Track number of characters in grbl serial read buffer
-        grbl_out = ''
-        while sum(c_line) >= RX_BUFFER_SIZE-1 | port.inWaiting() :
-            out_temp = port.readline().decode("UTF8").strip() # Wait for grbl response
-            if verbose: print("T:",out_temp)
-            if out_temp.find('ok') < 0 and out_temp.find('error') < 0 :
-                print("  Debug: ",out_temp) # Debug response
+    if stats is None:
+        stats = StreamStats(rx_buffer_size)
+    lines = list(file) # need the total for progress
+    total = len(lines)
+    reader = ResponseReader(port)
+    in_flight = deque() # (length, send time) of every line grbl hasn't acknowledged yet
+    buffered = 0 # running total of the lengths in in_flight
+    l_count = 0
+    acked = 0
+    status = None # last GrblStatus
+    queries = 0 # "?" sent and not answered yet
+    next_query = 0.0
+    last_step = -1 # last whole percent reported when not polling
+    was_starving = False # whether the last report found the planner empty mid job
+
+    if on_progress is not None and line_seconds is None:
+        import plottime
+        line_seconds = plottime.MotionPlanner().line_seconds(lines)
+    done_at = [0.0] # estimated seconds of the first i lines
+    for seconds in line_seconds or ():
+        done_at.append(done_at[-1] + seconds)
+    estimated = done_at[-1] if len(done_at) == total + 1 else 0.0
+
+    def estimated_done():
+        # acked lines are only in the planner; take off the moves the last report says are still queued
+        done = done_at[acked]
+        if status is not None and status.planner_free is not None:
+            queued = max(0, stats.planner_blocks - status.planner_free)
+            i = acked
+            while queued and i > 0:
+                i -= 1
+                if line_seconds[i]:
+                    done -= line_seconds[i]
+                    queued -= 1
+        return max(done, 0.0)
+
+    def publish():
+        if on_progress is None:
+            return
+        elapsed = time.monotonic() - stats.started
+        if estimated:
+            # what's left of the estimate, at the rate the machine has been keeping up with it
+            done = estimated_done()
+            fraction = done/estimated
+            eta = (estimated - done)*elapsed/done if done else None
+        else:
+            fraction = acked/total if total else 1.0
+            eta = elapsed*(1 - fraction)/fraction if fraction else None
+        on_progress(StreamProgress(l_count, acked, total, fraction, elapsed, eta,
+            status.state if status else None,
+            (status.wpos or status.mpos) if status else None,
+            status.planner_free if status else None,
+            status.rx_free if status else None))
+
+    def handle(responses):
+        nonlocal buffered, acked, status, queries, last_step, was_starving
+        now = time.monotonic()
+        for out_temp in responses:
+            if out_temp.startswith("<"):
+                report = parse_status(out_temp)
+                if report is None:
+                    continue
+                if verbose: print("status:", out_temp)
+                queries = max(0, queries - 1)
+                status = report
+                stats.status_reports += 1
+                if report.planner_free is not None:
+                    # ran dry with more of the job to come (before the first ok it just hasn't started)
+                    starving = (report.planner_free >= stats.planner_blocks and acked > 0
+                                and (l_count < total or bool(in_flight)))
+                    if starving:
+                        stats.planner_empty_reports += 1
+                        if not was_starving:
+                            stats.planner_starvation_events += 1
+                    was_starving = starving
+                if report.state.startswith("Alarm"):
+                    raise GrblError("grbl went into alarm while streaming: " + out_temp)
+                publish()
+                continue
+            if verbose: print("REC:", out_temp)
+            if out_temp.startswith("ok") or out_temp.startswith("error"):
+                if not in_flight: # a reply to something we didn't stream
+                    continue
+                length, sent = in_flight.popleft()
+                buffered -= length
+                acked += 1
+                stats.ok_latency.append(now - sent)
+                if out_temp.startswith("ok"):
+                    stats.oks += 1
+                else:
+                    stats.errors += 1
+                    print("  Error on a streamed line: ", out_temp)
+                if status_interval is None and total and acked*100//total != last_step:
+                    last_step = acked*100//total
+                    publish()
             else :
-                grbl_out += out_temp;
-                g_count += 1 # Iterate g-code counter
-                grbl_out += str(g_count); # Add line finished indicator
-                #del c_line[0] # Delete the block character count corresponding to the last 'ok'
-                c_line.pop(0) # Delete the block character count corresponding to the last 'ok'
-        if verbose: print("SND: " + str(l_count) + " : " + l_block)
-        port.write(l_block.encode('utf-8') + b'\n') # Send g-code block to grbl
-        if verbose : print("BUF:",str(sum(c_line)),"REC:",grbl_out)
-
-    #read rest of responses
-    for _ in c_line:
-        out_temp = port.readline().decode("UTF8").strip() # Wait for grbl response
-        while len(out_temp)>0:
-            if verbose:
-                print("REC:",out_temp)
-            out_temp = port.readline().decode("UTF8").strip() # Wait for grbl response
-    #wait for final commands to finish
-    wait_idle(port, verbose)
-    #final "ok" once idle
-    out_temp = port.readline().decode("UTF8").strip() # Wait for grbl response
+                print("  Debug: ",out_temp) # Debug response
+
+    def poll():
+        nonlocal queries, next_query
+        if status_interval is not None and time.monotonic() >= next_query:
+            port.write(b"?")
+            queries += 1
+            next_query = time.monotonic() + status_interval
+
+    saved_timeout = port.timeout
+    if status_interval is not None:
+        # blocking reads must come back in time for the next status query
+        port.timeout = status_interval
+    stats.started = time.monotonic()
+    try:
+        for line in lines:
+            l_count += 1 # Iterate line counter
+            # l_block = re.sub('\s|\(.*?\)','',line).upper() # Strip comments/spaces/new line and capitalize
+            l_block = line.strip()
+            length = len(l_block) + 1 # Track number of characters in grbl serial read buffer
+
+            # pick up whatever has already arrived, then block only while the line doesn't fit
+            poll()
+            handle(reader.read())
+            while in_flight and buffered + length >= rx_buffer_size - 1:
+                poll()
+                handle(reader.read(block=True))
+
+            if not in_flight and l_count > 1:
+                stats.rx_drained_events += 1
+            if verbose: print("SND: " + str(l_count) + " : " + l_block)
+            port.write(l_block.encode('utf-8') + b'\n') # Send g-code block to grbl
+            in_flight.append((length, time.monotonic()))
+            buffered += length
+            stats.lines += 1
+            stats.bytes += length
+            stats.occupancy[min(buffered, rx_buffer_size)//StreamStats.OCCUPANCY_BIN] += 1
+            if verbose : print("BUF:",str(buffered))
+
+        #read rest of responses
+        while in_flight:
+            poll()
+            handle(reader.read(block=True))
+        stats.finished = time.monotonic()
+    finally:
+        port.timeout = saved_timeout
+
+    #wait for final commands to finish; polled fast so the end of the job is seen within ms,
+    # progress still goes out only every status_interval
+    last_publish = 0.0
+    def on_status(report):
+        nonlocal status, last_publish
+        status = report
+        now = time.monotonic()
+        if status_interval is None or now - last_publish >= status_interval or report.state == "Idle":
+            last_publish = now
+            publish()
+    wait_idle(port, verbose, reader=reader, on_status=on_status, stale=queries)
     if verbose:
-        print("REC:",out_temp)
         print("G-code streaming finished!\n")
+    return stats
 
 
 if __name__ == "__main__":
@@ -159,6 +470,10 @@ if __name__ == "__main__":
             help='suppress output text')
     parser.add_argument('-s','--settings',action='store_true', default=False,
             help='settings write mode')        
+    parser.add_argument('-b','--rx-buffer',type=int, default=RX_BUFFER_SIZE, dest='rx_buffer',
+            help='size of grbl\'s serial receive buffer (default %(default)s)')
+    parser.add_argument('-i','--status-interval',type=float, default=None, dest='status_interval',
+            help='seconds between status queries while streaming, progress is printed with each one')
     args = parser.parse_args()
 
     # Initialize
@@ -168,7 +483,17 @@ if __name__ == "__main__":
     if args.settings :
         stream_settings(s, f, args.verbose)
     else:
-        stream_gcode(s, f, args.verbose)
+        show_progress = lambda p: print("%5.1f%% %s %s%s" % (100*p.fraction, p.state, p.position,
+            " eta %.0fs" % p.eta if p.eta is not None else ""))
+        stats = stream_gcode(s, f, args.verbose, rx_buffer_size=args.rx_buffer,
+                             status_interval=args.status_interval,
+                             on_progress=show_progress if args.status_interval else None)
+        summary = stats.summary()
+        starved = summary["planner_starvation_events"]
+        print("Streamed %d lines in %.1fs (%.0f lines/s, %.0f bytes/s), planner ran dry %s, rx buffer drained %d times, ok latency p50 %.1fms p95 %.1fms" % (
+            summary["lines"], summary["seconds"], summary["lines_per_s"], summary["bytes_per_s"],
+            "%d times" % starved if starved is not None else "? times (needs -i)", summary["rx_drained_events"],
+            summary["ok_latency_ms"]["p50"], summary["ok_latency_ms"]["p95"]))
 
     # Wait for user input after streaming is completed
     #print("WARNING: Wait until grbl completes buffered g-code blocks before exiting.")
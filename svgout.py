@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+# This file writes strokes out as SVG, straight to the file
+'''
+Streaming SVG output for strokes (see paths.py).
+
+SVGWriter writes the header when it is opened and every path as soon as it is
+given, so nothing is held in memory but the path being formatted. All strokes
+passed to one path() call go into a single "d" string; a stroke that starts
+where the previous one ended just carries on without a new M.
+
+    with SVGWriter("drawing.svg", (600, 600), stroke_width=3) as svg:
+        for stroke in strokes:
+            svg.path([stroke])
+'''
+import math
+from xml.sax.saxutils import quoteattr
+
+from paths import Arc, piece_start
+
+
+def number_formatter(precision=3):
+    '''
+    Returns a function formatting floats with `precision` decimals, without trailing zeros
+    '''
+    fmt = "%%.%df" % precision
+
+    def num(value):
+        s = fmt % value
+        if "." in s:
+            s = s.rstrip("0").rstrip(".")
+        return "0" if s == "-0" else s
+    return num
+
+def path_data(strokes, precision=3):
+    '''
+    SVG path "d" string for a list of strokes
+    '''
+
+    num = number_formatter(precision)
+    d = []
+    pen = None # formatted point the path is at
+    command = None # last command letter written
+    for stroke in strokes:
+        if not stroke:
+            continue
+        start = tuple(num(v) for v in piece_start(stroke[0]))
+        if start != pen:
+            d += ["M", start[0], start[1]]
+            command = "M"
+        for piece in stroke:
+            if isinstance(piece, Arc):
+                # split at half turns, so the large-arc flag is never needed
+                halves = max(1, math.ceil(abs(piece.sweep)/math.pi - 1e-9))
+                sweep = "1" if piece.end > piece.start else "0"
+                r = num(piece.r)
+                for k in range(1, halves + 1):
+                    x, y = piece.point(piece.start + piece.sweep*k/halves)
+                    pen = (num(x), num(y))
+                    d += ["A", r, r, "0", "0", sweep, pen[0], pen[1]]
+                command = "A"
+            elif len(piece) > 1:
+                if command not in ("L", "M"): # after M, further pairs are already line-tos
+                    d.append("L")
+                    command = "L"
+                for x, y in piece[1:].tolist():
+                    pen = (num(x), num(y))
+                    d += pen
+    return " ".join(d)
+
+
+class SVGWriter:
+    '''
+    Writes an SVG document path by path. All paths share one group carrying
+    the stroke style, so each <path> is just its d attribute.
+    '''
+
+    def __init__(self, output, size, view_box=None, precision=3, stroke="black", stroke_width=None):
+        '''
+        Args:
+            output: file name or writable text file
+            size: (width, height), numbers or strings with units ("5.5in")
+            view_box: optional (x, y, width, height)
+            precision: decimals written for coordinates
+            stroke: stroke color
+            stroke_width: stroke width (SVG default if None)
+        '''
+        self.precision = precision
+        self.paths = 0
+        if hasattr(output, "write"):
+            self._file, self._owned = output, False
+        else:
+            self._file, self._owned = open(output, "w"), True
+
+        width, height = size
+        attrs = 'width=%s height=%s' % (quoteattr(str(width)), quoteattr(str(height)))
+        if view_box is not None:
+            attrs += ' viewBox="%s"' % " ".join("%g" % v for v in view_box)
+        style = 'fill="none" stroke=%s' % quoteattr(stroke)
+        if stroke_width is not None:
+            style += ' stroke-width="%g"' % stroke_width
+        self._file.write('<?xml version="1.0" encoding="utf-8" ?>\n'
+                         '<svg xmlns="http://www.w3.org/2000/svg" version="1.1" %s>\n<g %s>\n' % (attrs, style))
+
+    def path(self, strokes):
+        '''
+        Writes the strokes as one <path> element (nothing if there is no geometry)
+        '''
+        d = path_data(strokes, self.precision)
+        if d:
+            self._file.write('<path d="%s"/>\n' % d)
+            self.paths += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.write('</g>\n</svg>\n')
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,29 @@
+#! /usr/bin/env python3
+# Checks that dedup.py only takes out lines that really are drawn twice (python3 -m pytest test_dedup.py)
+import numpy as np
+
+import art
+import dedup
+import export
+from paths import Arc
+
+
+def hatched_slice(pitch, lines=21):
+    '''
+    A slice in page pixels with `lines` hatch arcs `pitch` apart (and from its edges)
+    '''
+    width = pitch*(lines + 1)
+    record = np.array([(200.0, 200.0, 0.2, 1.4, 80.0, 80.0 + width, True, 0.0)], dtype=art.SLICE_DTYPE)
+    # slice_hatch puts floor(fill_factor*width/MIN_HATCH_SPACING) lines in; ask for `lines` of them
+    record['fill_factor'] = (lines + 0.5)*art.MIN_HATCH_SPACING/width
+    hatch = art.slice_hatch(record)
+    assert len(hatch) == lines
+    return art.slice_stroke(record[0].tolist(), art.slice_corners(record)[0], hatch), hatch
+
+def test_dense_hatch_is_kept():
+    # the tightest hatch pitch the page gets: ~0.24mm, thin slices at full fill
+    stroke, hatch = hatched_slice(0.24*export.PX_PER_MM)
+    strokes, removed = dedup.dedup_strokes([stroke], export.DEDUP_TOLERANCE, export.DEDUP_MIN_GAP)
+    assert removed == 0.0
+    drawn = {round(piece.r, 6) for s in strokes for piece in s if isinstance(piece, Arc)}
+    assert all(round(r, 6) in drawn for r in hatch['radius'])